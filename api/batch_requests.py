@@ -0,0 +1,91 @@
+# Batched requests.
+# A page of the frontend needs several endpoints at once, e.g. a place, its reviews and the logged in user.
+# Instead of one round trip for each of them, the client sends them together to /api/batch.
+# Every sub-request is dispatched through the app like a normal request, so it goes through the
+# same authentication, caching and error handling, and the sub-requests run concurrently.
+from werkzeug.exceptions import HTTPException
+from werkzeug.test import EnvironBuilder
+
+# Upper bound of the sub-requests in a single batch.
+MAX_BATCH_SIZE = 20
+
+# Headers passed on from the batch request to its sub-requests.
+FORWARDED_HEADERS = ('x-access-token', 'Accept-Language', 'User-Agent')
+
+# Endpoints a sub-request may call. They only read data, so the sub-requests can run in any order.
+# GET endpoints with side effects (e.g. logout), the streaming exports and the operational endpoints are left out.
+BATCH_ENDPOINTS = frozenset({
+    'get_places', 'suggest_places', 'get_nearby_places', 'get_place_clusters', 'get_place_by_place_id',
+    'get_place_rating_summary', 'get_all_reviews', 'get_my_reviews', 'get_reviews_feed', 'get_liked_reviews',
+    'get_reviews_for_place', 'get_review_by_id', 'get_reviews_with_user_details', 'get_user_by_id',
+    'get_logged_in_user',
+})
+
+# Key of the WSGI environment of a sub-request holding the environment of its batch request.
+# The request hooks use it to tell sub-requests apart, e.g. the metrics count them as part of the batch.
+PARENT_ENVIRON_KEY = 'batch_requests.parent'
+
+'''
+This function validates the sub-requests of a batch, e.g.
+{"requests": [{"id": "place", "path": "/api/place/1"}, {"id": "me", "path": "/api/logged-in-user"}]}
+Only GET requests to the endpoints allowed are accepted, the path is matched against the routes of url_map.
+The id of a sub-request is optional, it defaults to its position in the batch.
+It raises a ValueError describing the first problem found.
+'''
+def parse_batch(data, url_map, endpoints=BATCH_ENDPOINTS):
+    items = data.get('requests') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise ValueError('requests must be a non empty list')
+    if len(items) > MAX_BATCH_SIZE:
+        raise ValueError(f'A batch can have at most {MAX_BATCH_SIZE} requests')
+
+    parsed = []
+    for position, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get('path'), str):
+            raise ValueError(f'Request {position} must be an object with a path')
+        path = item['path']
+        if item.get('method', 'GET').upper() != 'GET':
+            raise ValueError(f'Request {position} must be a GET request')
+        if not path.startswith('/api/') or _endpoint(url_map, path) not in endpoints:
+            raise ValueError(f'Request {position} must be the path of an endpoint allowed in batches')
+        parsed.append({'id': item.get('id', position), 'path': path})
+    return parsed
+
+# Returns the endpoint a GET request to the path is routed to, or None if there is none.
+def _endpoint(url_map, path):
+    try:
+        endpoint, _ = url_map.bind('localhost').match(path.split('?')[0], method='GET')
+    except HTTPException:
+        return None
+    return endpoint
+
+'''
+This function runs a single sub-request through the app and returns its result.
+
+Implementation:
+It builds the WSGI environment of the sub-request with the headers of the batch request,
+and dispatches it in its own request context, like the app does for a request received over HTTP.
+The environment of the batch request is kept in it under PARENT_ENVIRON_KEY.
+A sub-request failing only fails its own result, never the whole batch.
+'''
+def dispatch(app, item, headers, base_url, parent_environ=None):
+    builder = EnvironBuilder(path=item['path'], method='GET', headers=headers, base_url=base_url,
+                             environ_base={PARENT_ENVIRON_KEY: parent_environ})
+    try:
+        with app.request_context(builder.get_environ()):
+            response = app.full_dispatch_request()
+            body = response.get_json(silent=True) if response.is_json else response.get_data(as_text=True)
+            return {'id': item['id'], 'status': response.status_code, 'body': body}
+    except Exception as e:
+        return {'id': item['id'], 'status': 500, 'body': {'error': str(e)}}
+    finally:
+        builder.close()
+
+'''
+This function runs the sub-requests of a batch concurrently with the given executor.
+parent_environ is the WSGI environment of the batch request.
+The results are returned in the order of the sub-requests.
+'''
+def run_batch(app, executor, items, headers, base_url, parent_environ=None):
+    futures = [executor.submit(dispatch, app, item, headers, base_url, parent_environ) for item in items]
+    return [future.result() for future in futures]
@@ -0,0 +1,47 @@
+# Benchmark of the cold start of the app.
+# Every run starts a fresh Python process, like a new serverless instance, which imports the app
+# and serves a first request. It prints the median and worst of:
+# - import: time to import index.py
+# - first request: time from the start of the import to the end of the first response
+#
+# Usage: python benchmarks/bench_cold_start.py [--runs 10] [--path /api/server_connectivity]
+#
+# Paths which use the database include the time to connect to it.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Code run by every fresh process. It prints its timings as JSON.
+CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+import index
+imported = time.perf_counter()
+response = index.app.test_client().get(sys.argv[1])
+done = time.perf_counter()
+print(json.dumps({"import": imported - started, "first_request": done - started, "status": response.status_code}))
+'''
+
+def run_once(path):
+    output = subprocess.run([sys.executable, '-c', CHILD, path], cwd=API_DIR, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--path', default='/api/server_connectivity')
+    args = parser.parse_args()
+
+    runs = [run_once(args.path) for _ in range(args.runs)]
+    print(f'{args.runs} cold starts of GET {args.path} (status {runs[-1]["status"]})')
+    for name in ('import', 'first_request'):
+        values = [run[name] * 1000 for run in runs]
+        print(f'{name:<14} median {statistics.median(values):8.1f} ms  max {max(values):8.1f} ms')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+# Benchmark of the API endpoints.
+# It seeds a database with a synthetic dataset (see seed.py), then drives every endpoint through the
+# Flask test client, first one request at a time for the latency and then from concurrent threads
+# for the throughput. It prints p50, p95 and p99 latencies and requests per second per endpoint,
+# and saves them as JSON, so that a run can be compared with an earlier one (e.g. in CI).
+#
+# Usage: python benchmarks/bench_endpoints.py [--in-memory] [--places 500] [--users 100] [--reviews 5000]
+#                                             [--requests 200] [--workers 8] [--only places,feed]
+#                                             [--output results.json] [--compare baseline.json] [--threshold 0.25]
+#
+# By default it uses the MongoDB of MONGO_URI, with the database MONGO_DB (TouristTalksBench if not set),
+# which is emptied first. --in-memory uses mongomock instead, if it is installed.
+# With --compare, it exits with status 1 if the p95 latency of an endpoint grew, or its requests per second
+# dropped, by more than the threshold. mongomock does not implement every operator used by the app,
+# so --in-memory skips the endpoints in IN_MEMORY_UNSUPPORTED, and they are left out of the saved results.
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import seed
+
+# Endpoints which fail under --in-memory, with the operator mongomock does not implement.
+IN_MEMORY_UNSUPPORTED = {
+    'places-nearby': '$geoNear',
+    'places-clusters': '$geoWithin',
+    'delete-user': '$toDouble',
+}
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))] if values else None
+
+'''
+This function returns the endpoints benchmarked, in the order they run.
+Every endpoint is a (name, request) pair, where request(i) returns the arguments of the i-th test client call.
+Endpoints writing data come after the read endpoints, and the ones deleting data come last.
+'''
+def endpoints(ctx):
+    places, users, reviews = ctx['places'], ctx['users'], ctx['reviews']
+    user, admin = ctx['user_headers'], ctx['admin_headers']
+    place = lambda i: i % places + 1
+    review = lambda i: f'r{i % reviews + 1}'
+    counters = {name: itertools.count(1) for name in ('signup', 'delete-review', 'delete-place', 'delete-user')}
+    import_body = '\n'.join(json.dumps(seed.place_data(ctx['rng'], 100000 + i)) for i in range(10))
+
+    return [
+        ('server-connectivity', lambda i: dict(method='GET', path='/api/server_connectivity')),
+        ('db-connectivity', lambda i: dict(method='GET', path='/api/db_connectivity')),
+        ('stats', lambda i: dict(method='GET', path='/api/stats', headers=admin)),
+        ('places', lambda i: dict(method='GET', path='/api/places', headers=user)),
+        ('places-page', lambda i: dict(method='GET', path='/api/places?limit=20&sort=rating&view=card', headers=user)),
+        ('places-category', lambda i: dict(method='GET', path='/api/places?limit=20&categories=Heritage', headers=user)),
+        ('places-search', lambda i: dict(method='GET', path=f'/api/places?search={seed.WORDS[i % len(seed.WORDS)]}', headers=user)),
+        ('places-suggest', lambda i: dict(method='GET', path=f'/api/places/suggest?q={seed.WORDS[i % len(seed.WORDS)][:3]}', headers=user)),
+        ('places-nearby', lambda i: dict(method='GET', path=f'/api/places/nearby?lat={50 + i % 6}&lng=-1&radius=50000', headers=user)),
+        ('places-clusters', lambda i: dict(method='GET', path='/api/places/clusters?bbox=-5,50,1.5,56&grid=8', headers=user)),
+        ('place', lambda i: dict(method='GET', path=f'/api/place/{place(i)}', headers=user)),
+        ('place-summary', lambda i: dict(method='GET', path=f'/api/places/{place(i)}/summary', headers=user)),
+        ('place-reviews', lambda i: dict(method='GET', path=f'/api/places/{place(i)}/reviews')),
+        ('place-reviews-users', lambda i: dict(method='GET', path=f'/api/places/{place(i)}/reviews-with-user-details', headers=user)),
+        ('reviews', lambda i: dict(method='GET', path='/api/reviews', headers=user)),
+        ('reviews-feed', lambda i: dict(method='GET', path='/api/reviews/feed?limit=20', headers=user)),
+        ('my-reviews', lambda i: dict(method='GET', path=f'/api/myreviews/u{i % users + 1}', headers=user)),
+        ('liked-reviews', lambda i: dict(method='GET', path=f'/api/liked-reviews/u{i % users + 1}', headers=user)),
+        ('liked-status', lambda i: dict(method='POST', path='/api/reviews/liked-status', headers=user,
+                                        json={'review_ids': [review(i + n) for n in range(20)]})),
+        ('review', lambda i: dict(method='GET', path=f'/api/reviews/{review(i)}', headers=user)),
+        ('user', lambda i: dict(method='GET', path=f'/api/users/u{i % users + 1}', headers=user)),
+        ('logged-in-user', lambda i: dict(method='GET', path='/api/logged-in-user', headers=user)),
+        ('batch', lambda i: dict(method='POST', path='/api/batch', headers=user, json={'requests': [
+            {'path': f'/api/place/{place(i)}'}, {'path': f'/api/places/{place(i)}/reviews-with-user-details'},
+            {'path': '/api/logged-in-user'}]})),
+        ('export-places', lambda i: dict(method='GET', path='/api/export/places', headers=admin)),
+        ('export-reviews', lambda i: dict(method='GET', path='/api/export/reviews', headers=admin)),
+        ('login', lambda i: dict(method='POST', path='/api/login', json={'username': 'user2', 'password': seed.PASSWORD})),
+        ('signup', lambda i: dict(method='POST', path='/api/signup', json={
+            'username': f'signup{next(counters["signup"])}-{ctx["run"]}', 'fullname': 'New User', 'password': seed.PASSWORD,
+            'email': f'signup{i}-{ctx["run"]}-{threading.get_ident()}@example.com', 'role': 'user', 'profile_photo': None})),
+        ('add-review', lambda i: dict(method='POST', path='/api/add-review', headers=user, json={
+            'place_id': place(i), 'user_id': 'u2', 'text': 'A lovely place.', 'rating': i % 5 + 1})),
+        ('update-review', lambda i: dict(method='PUT', path='/api/update-review', headers=user, json={
+            'review_id': review(i), 'text': 'Edited review.', 'rating': i % 5 + 1})),
+        ('review-feedback', lambda i: dict(method='PUT', path='/api/user-review-feedback', headers=user, json={
+            'user_id': 'u2', 'review_id': review(i // 2), 'feedback': 'Like' if i % 2 == 0 else 'Dislike'})),
+        ('update-profile', lambda i: dict(method='PUT', path='/api/update-user-profile', headers=user, json={
+            'user_id': 'u2', 'fullname': f'User 2 ({i})', 'username': 'user2', 'email': 'user2@example.com'})),
+        ('change-password', lambda i: dict(method='PUT', path='/api/change-password', headers=user, json={
+            'user_id': 'u2', 'current_password': seed.PASSWORD, 'new_password': seed.PASSWORD})),
+        ('add-place', lambda i: dict(method='POST', path='/api/add-place', headers=admin, json=seed.place_data(ctx['rng'], 200000 + i))),
+        ('import-places', lambda i: dict(method='POST', path='/api/import-places', headers=admin, data=import_body)),
+        ('logout', lambda i: dict(method='GET', path='/api/logout', headers=ctx['fresh_headers']('user3'))),
+        ('delete-review', lambda i: dict(method='DELETE', path=f'/api/delete-review/r{next(counters["delete-review"])}', headers=user)),
+        ('delete-place', lambda i: dict(method='DELETE', path=f'/api/delete-place/{next(counters["delete-place"])}', headers=admin)),
+        ('delete-user', lambda i: dict(method='DELETE', path=f'/api/delete-user-account/u{users - next(counters["delete-user"]) % (users - 3)}', headers=user)),
+    ]
+
+'''
+This function returns the context of the endpoints for a seeded dataset (see endpoints).
+index is the index module, dataset the sizes returned by seed.seed.
+'''
+def context(index, dataset, random_seed):
+    import jwt
+    import random
+
+    def fresh_headers(username):
+        user = index.users_collection.find_one({'username': username})
+        now = datetime.datetime.utcnow()
+        return {'x-access-token': jwt.encode({'jti': os.urandom(8).hex(), 'id': str(user['_id']), 'user': username,
+                                              'role': user['role'], 'iat': now, 'exp': now + datetime.timedelta(hours=1)},
+                                             index.app.config['SECRET_KEY'])}
+
+    return dict(dataset, rng=random.Random(random_seed), run=os.urandom(4).hex(), fresh_headers=fresh_headers,
+                user_headers=fresh_headers('user2'), admin_headers=fresh_headers(seed.ADMIN_USERNAME))
+
+# Sends the requests one at a time. Returns the latencies in milliseconds and the number of errors.
+def run_sequential(app, request, count):
+    client = app.test_client()
+    latencies = []
+    errors = 0
+    for i in range(count):
+        start = time.perf_counter()
+        response = client.open(**request(i))
+        response.get_data()
+        latencies.append((time.perf_counter() - start) * 1000)
+        errors += response.status_code >= 400
+    return latencies, errors
+
+# Sends the requests from concurrent threads. Returns the latencies, the number of errors and the requests per second.
+def run_concurrent(app, request, count, workers):
+    local = threading.local()
+    def send(i):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        start = time.perf_counter()
+        response = local.client.open(**request(i))
+        response.get_data()
+        return (time.perf_counter() - start) * 1000, response.status_code >= 400
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(send, range(count)))
+    elapsed = time.perf_counter() - start
+    return [latency for latency, _ in results], sum(error for _, error in results), count / elapsed
+
+'''
+This function compares the results with a baseline.
+Returns the endpoints which regressed by more than the threshold, as (name, metric, baseline, current) tuples.
+'''
+def regressions(results, baseline, threshold):
+    found = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if previous['p95_ms'] and current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            found.append((name, 'p95_ms', previous['p95_ms'], current['p95_ms']))
+        if previous['rps'] and current['rps'] < previous['rps'] / (1 + threshold):
+            found.append((name, 'rps', previous['rps'], current['rps']))
+    return found
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--in-memory', action='store_true', help='use mongomock instead of MongoDB')
+    parser.add_argument('--force', action='store_true', help='allow seeding the TouristTalks database')
+    parser.add_argument('--places', type=int, default=500)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--reviews', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint and phase')
+    parser.add_argument('--workers', type=int, default=8, help='threads of the concurrent phase')
+    parser.add_argument('--only', default=None, help='comma separated names of the endpoints to run')
+    parser.add_argument('--output', default=None, help='file to save the results to')
+    parser.add_argument('--compare', default=None, help='results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25, help='regression allowed by --compare, 0.25 is 25%%')
+    args = parser.parse_args()
+
+    os.environ.setdefault('MONGO_DB', 'TouristTalksBench')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    if os.environ['MONGO_DB'] == 'TouristTalks' and not args.in_memory and not args.force:
+        sys.exit('Refusing to empty the TouristTalks database, set MONGO_DB or pass --force.')
+
+    import database
+    if args.in_memory:
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit('--in-memory needs mongomock: pip install mongomock')
+        database.use_client(mongomock.MongoClient())
+
+    # Imported here, as the processes of the password pool import this module again.
+    import index
+
+    started = time.perf_counter()
+    dataset = seed.seed(index, args.places, args.users, args.reviews, random_seed=args.seed)
+    print(f'Seeded {dataset} in {time.perf_counter() - started:.1f}s')
+
+    ctx = context(index, dataset, args.seed)
+    selected = set(args.only.split(',')) if args.only else None
+
+    results = {}
+    skipped = []
+    print(f'{"endpoint":<22}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"req/s":>10}{"conc p99":>10}{"errors":>8}')
+    for name, request in endpoints(ctx):
+        if selected is not None and name not in selected:
+            continue
+        if args.in_memory and name in IN_MEMORY_UNSUPPORTED:
+            print(f'{name:<22}skipped, mongomock does not implement {IN_MEMORY_UNSUPPORTED[name]}')
+            skipped.append(name)
+            continue
+        latencies, errors = run_sequential(index.app, request, args.requests)
+        concurrent_latencies, concurrent_errors, rps = run_concurrent(index.app, request, args.requests, args.workers)
+        results[name] = {
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'rps': rps,
+            'concurrent_p99_ms': percentile(concurrent_latencies, 99),
+            'errors': errors + concurrent_errors,
+        }
+        result = results[name]
+        print(f'{name:<22}{result["p50_ms"]:9.2f}{result["p95_ms"]:9.2f}{result["p99_ms"]:9.2f}'
+              f'{result["rps"]:10.0f}{result["concurrent_p99_ms"]:10.2f}{result["errors"]:8d}')
+
+    report = {
+        'meta': {
+            'date': datetime.datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'backend': 'mongomock' if args.in_memory else 'mongodb',
+            'dataset': dataset,
+            'requests': args.requests,
+            'workers': args.workers,
+            'skipped': skipped,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f'Saved the results to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        found = regressions(results, baseline['results'], args.threshold)
+        for name, metric, previous, current in found:
+            print(f'REGRESSION {name} {metric}: {previous:.2f} -> {current:.2f}')
+        if found:
+            sys.exit(1)
+        print(f'No regression over {args.threshold:.0%} compared with {args.compare}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# Benchmark of the JSON serialisation of review documents.
+# Compares the old way (converting every document in a loop, then jsonify with the json module)
+# with the BSON JSON provider, using the json module and orjson.
+#
+# Usage: python benchmarks/bench_json.py [number of reviews]
+import datetime
+import json
+import os
+import sys
+import time
+from bson import Decimal128, ObjectId
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import json_provider
+
+'''
+This function builds n reviews shaped like the documents of the ReviewDetails collection.
+'''
+def make_reviews(n):
+    now = datetime.datetime(2024, 1, 1)
+    return [{
+        '_id': ObjectId(),
+        'review_id': f'R{i}',
+        'place_id': i % 500,
+        'user_id': f'U{i % 100}',
+        'rating': Decimal128(str(1 + i % 5)),
+        'comment': 'A lovely place to visit, would go again. ' * 3,
+        'timestamp': now + datetime.timedelta(seconds=i),
+        'likes': i % 17,
+        'site_name': f'Place {i % 500}',
+        'user': {'_id': ObjectId(), 'fullname': f'User {i % 100}'},
+    } for i in range(n)]
+
+# The conversion loop the endpoints used before the provider.
+def legacy(reviews):
+    for review in reviews:
+        review['_id'] = str(review['_id'])
+        review['rating'] = float(Decimal128.to_decimal(review['rating']))
+        review['timestamp'] = review['timestamp'].isoformat()
+        review['user']['_id'] = str(review['user']['_id'])
+    return json.dumps(reviews).encode('utf-8')
+
+def provider_json(reviews):
+    orjson, json_provider.orjson = json_provider.orjson, None
+    try:
+        return json_provider.dumps_bytes(reviews)
+    finally:
+        json_provider.orjson = orjson
+
+def provider_orjson(reviews):
+    return json_provider.dumps_bytes(reviews)
+
+def run(name, encode, n, repeat=5):
+    best = None
+    for _ in range(repeat):
+        reviews = make_reviews(n)
+        start = time.perf_counter()
+        encode(reviews)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f'{name:<24} {best * 1000:9.1f} ms {n / best:12,.0f} docs/s')
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    run('legacy loop + json', legacy, n)
+    run('provider (json)', provider_json, n)
+    if json_provider.orjson is not None:
+        run('provider (orjson)', provider_orjson, n)
+    else:
+        print('orjson is not installed')
@@ -0,0 +1,78 @@
+# Benchmark of a read endpoint during a burst of logins.
+# It measures the latency of GET /api/places?limit=20 on its own, then again while other threads
+# keep logging in, and prints the p50, p95 and p99 of both runs.
+# Run it once with the password pool and once with bcrypt on the request threads to compare:
+#
+# Usage: python benchmarks/bench_passwords.py [--logins 16] [--requests 300]
+#        PASSWORD_WORKERS=0 python benchmarks/bench_passwords.py
+#
+# It runs against the database configured for the app, and creates a user for the benchmark there.
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def measure_reads(client, token, count):
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        client.get('/api/places?limit=20', headers={'x-access-token': token})
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def report(name, latencies):
+    print(f'{name:<20} p50 {percentile(latencies, 50):8.1f} ms  p95 {percentile(latencies, 95):8.1f} ms  '
+          f'p99 {percentile(latencies, 99):8.1f} ms')
+
+def main():
+    # Imported here, as the processes of the password pool import this module again.
+    from index import app, users_collection, password_hasher
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logins', type=int, default=16, help='number of threads logging in')
+    parser.add_argument('--requests', type=int, default=300, help='number of read requests measured')
+    args = parser.parse_args()
+
+    client = app.test_client()
+    name = 'bench-' + uuid.uuid4().hex[:8]
+    password = uuid.uuid4().hex
+    client.post('/api/signup', json={'username': name, 'fullname': name, 'password': password,
+                                     'email': name + '@example.com', 'role': 'user', 'profile_photo': None})
+    try:
+        token = client.post('/api/login', json={'username': name, 'password': password}).get_json()['token']
+
+        report('reads alone', measure_reads(client, token, args.requests))
+
+        stop = threading.Event()
+        statuses = {}
+        def login_loop():
+            login_client = app.test_client()
+            while not stop.is_set():
+                status = login_client.post('/api/login', json={'username': name, 'password': password}).status_code
+                statuses[status] = statuses.get(status, 0) + 1
+
+        threads = [threading.Thread(target=login_loop) for _ in range(args.logins)]
+        for thread in threads:
+            thread.start()
+        try:
+            report('reads with logins', measure_reads(client, token, args.requests))
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        print(f'logins by status: {statuses}')
+        print(f'password hasher: {password_hasher.stats()}')
+    finally:
+        users_collection.delete_one({'username': name})
+
+if __name__ == '__main__':
+    main()
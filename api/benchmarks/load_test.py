@@ -0,0 +1,151 @@
+# Load test of the production server.
+# It starts the app under gunicorn (see gunicorn.conf.py) with an increasing number of worker processes,
+# sends requests from several client processes for a fixed duration, and prints the throughput
+# for each number of workers, so that the scaling with the number of cores can be checked.
+#
+# Usage: python benchmarks/load_test.py [--workers 1,2,4] [--threads 4] [--clients 4] [--connections 16]
+#                                       [--duration 10] [--path /api/place/1] [--seed]
+#
+# Without --seed, only the paths which do not need the database are useful, e.g. /api/server_connectivity.
+# With --seed, the database MONGO_DB (TouristTalksBench if not set) is emptied and filled with the dataset
+# of the benchmarks (see seed.py), and the requests carry the token of a user of the dataset.
+# The client processes run on the same machine as the server, so leave them some cores.
+import argparse
+import http.client
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, API_DIR)
+
+# Paths requested when the database is seeded, in turn.
+SEEDED_PATHS = ('/api/place/1', '/api/places?limit=20', '/api/places/1/reviews', '/api/reviews/feed?limit=20')
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))] if values else None
+
+# Sends requests on one keep-alive connection until the deadline. Returns the latencies and the number of errors.
+def _connection(port, paths, headers, deadline, offset):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    latencies = []
+    errors = 0
+    i = offset
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            connection.request('GET', paths[i % len(paths)], headers=headers)
+            response = connection.getresponse()
+            response.read()
+            errors += response.status >= 400
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        latencies.append((time.perf_counter() - start) * 1000)
+        i += 1
+    connection.close()
+    return latencies, errors
+
+# Runs in a client process: one thread per connection.
+def _client(args):
+    port, paths, headers, duration, connections, offset = args
+    deadline = time.perf_counter() + duration
+    results = [None] * connections
+    def run(n):
+        results[n] = _connection(port, paths, headers, deadline, offset + n)
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [latency for latencies, _ in results for latency in latencies], sum(errors for _, errors in results)
+
+def wait_until_ready(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            connection.request('GET', '/api/server_connectivity')
+            if connection.getresponse().status == 200:
+                return
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.2)
+    raise RuntimeError(f'The server did not start on port {port}')
+
+'''
+This function starts gunicorn with the given number of workers, runs the clients against it for the duration
+and stops it gracefully. Returns the requests per second, the p50 and p99 latencies and the number of errors.
+'''
+def run(workers, args, paths, headers):
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), WEB_THREADS=str(args.threads),
+               BIND=f'127.0.0.1:{args.port}', WEB_MAX_REQUESTS='0')
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'index:app'], cwd=API_DIR, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_ready(args.port)
+        jobs = [(args.port, paths, headers, args.duration, args.connections, n * args.connections) for n in range(args.clients)]
+        start = time.perf_counter()
+        with multiprocessing.Pool(args.clients) as pool:
+            results = pool.map(_client, jobs)
+        elapsed = time.perf_counter() - start
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+    latencies = [latency for client_latencies, _ in results for latency in client_latencies]
+    return len(latencies) / elapsed, percentile(latencies, 50), percentile(latencies, 99), sum(errors for _, errors in results)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', default=None, help='comma separated numbers of workers (default: 1, 2, 4... up to the cores)')
+    parser.add_argument('--threads', type=int, default=4, help='threads per worker')
+    parser.add_argument('--clients', type=int, default=max(1, multiprocessing.cpu_count() // 2), help='client processes')
+    parser.add_argument('--connections', type=int, default=16, help='connections per client process')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per number of workers')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--path', action='append', default=None, help='path to request, can be repeated')
+    parser.add_argument('--seed', action='store_true', help='seed the database and send authenticated requests')
+    parser.add_argument('--force', action='store_true', help='allow seeding the TouristTalks database')
+    args = parser.parse_args()
+
+    if args.workers:
+        worker_counts = [int(count) for count in args.workers.split(',')]
+    else:
+        worker_counts = [1]
+        while worker_counts[-1] * 2 <= multiprocessing.cpu_count():
+            worker_counts.append(worker_counts[-1] * 2)
+
+    headers = {}
+    paths = args.path or ['/api/server_connectivity']
+    if args.seed:
+        os.environ.setdefault('MONGO_DB', 'TouristTalksBench')
+        os.environ.setdefault('SECRET_KEY', 'benchmark')
+        if os.environ['MONGO_DB'] == 'TouristTalks' and not args.force:
+            sys.exit('Refusing to empty the TouristTalks database, set MONGO_DB or pass --force.')
+        import index
+        import seed
+        from bench_endpoints import context
+        dataset = seed.seed(index)
+        print(f'Seeded {dataset}')
+        headers = context(index, dataset, 42)['user_headers']
+        paths = args.path or list(SEEDED_PATHS)
+
+    print(f'{multiprocessing.cpu_count()} cores, {args.clients} client processes with {args.connections} connections each')
+    # The workers and the clients share the cores, so the speedup only means something with cores to spare.
+    if max(worker_counts) + args.clients > multiprocessing.cpu_count():
+        print('Warning: the workers share the cores with the client processes, so the speedup understates the scaling.')
+    print(f'{"workers":>8}{"req/s":>10}{"speedup":>9}{"p50 ms":>9}{"p99 ms":>9}{"errors":>8}')
+    baseline = None
+    for workers in worker_counts:
+        rps, p50, p99, errors = run(workers, args, paths, headers)
+        baseline = baseline or rps
+        print(f'{workers:8d}{rps:10.0f}{rps / baseline:9.2f}{p50:9.2f}{p99:9.2f}{errors:8d}')
+
+if __name__ == '__main__':
+    main()
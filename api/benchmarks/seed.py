@@ -0,0 +1,139 @@
+# Synthetic dataset of the benchmarks.
+# It fills the database of the app with places, users, reviews and likes shaped like the real ones,
+# then builds the derived collections (search index, review read model, rating aggregates) and the indexes.
+# The same seed and sizes always give the same dataset, so benchmark runs can be compared.
+import datetime
+import random
+import bcrypt
+from bson import Decimal128
+
+# Password of every user of the dataset.
+PASSWORD = 'benchmark-password'
+
+# Username of the admin of the dataset.
+ADMIN_USERNAME = 'bench-admin'
+
+WORDS = (
+    'castle', 'abbey', 'garden', 'museum', 'gallery', 'park', 'tower', 'bridge', 'harbour', 'cathedral',
+    'market', 'palace', 'lake', 'forest', 'beach', 'theatre', 'mill', 'priory', 'manor', 'station',
+)
+ADJECTIVES = ('old', 'royal', 'grand', 'little', 'north', 'south', 'hidden', 'great', 'green', 'red')
+CATEGORIES = ('Heritage', 'Nature', 'Museums', 'Family', 'Food', 'Shopping', 'Arts', 'Outdoors', 'Nightlife', 'Sport')
+TAGS = ('free', 'dog friendly', 'wheelchair access', 'cafe', 'parking', 'guided tours', 'indoor', 'views')
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS + ADJECTIVES) for _ in range(words)).capitalize() + '.'
+
+'''
+This function returns the body of an add_place request for the i-th place.
+'''
+def place_data(rng, i):
+    name = f'{rng.choice(ADJECTIVES).title()} {rng.choice(WORDS).title()} {i}'
+    return {
+        'site_name': name,
+        'summary': _sentence(rng, 12),
+        'description': ' '.join(_sentence(rng, 15) for _ in range(6)),
+        'location': {'latitude': round(rng.uniform(50.0, 56.0), 6), 'longitude': round(rng.uniform(-5.0, 1.5), 6)},
+        'type': [rng.choice(WORDS)],
+        'tags': rng.sample(TAGS, 3),
+        'address': {'address_1': f'{i} High Street', 'address_2': None, 'address_3': None, 'postcode': f'AB{i % 100} {i % 10}CD'},
+        'website': [f'https://example.com/places/{i}'],
+        'email': f'info{i}@example.com',
+        'phone': f'0100 {i:06d}',
+        'categories': rng.sample(CATEGORIES, rng.randint(1, 3)),
+        'venue_description': ' '.join(_sentence(rng, 15) for _ in range(3)),
+        'all_weather': rng.choice(('Yes', 'No')),
+        'opening_times': 'Monday to Friday 9am to 5pm. Saturday 10am to 4pm. Closed on Sundays and bank holidays.',
+        'accessibility': _sentence(rng, 10),
+        'pet_friendly': rng.choice(('Yes', 'No')),
+        'parking': _sentence(rng, 8),
+        'visit_time': f'{rng.randint(1, 4)} hours',
+        'uprn': str(100000000 + i),
+        'google_map_link': f'https://maps.example.com/?q={i}',
+        'walk_time_bus': f'{rng.randint(1, 20)} minutes',
+        'nearest_bus_stop': _sentence(rng, 3),
+        'walk_time_train': f'{rng.randint(5, 40)} minutes',
+        'nearest_train_station': _sentence(rng, 2),
+        'directions': ' '.join(_sentence(rng, 15) for _ in range(4)),
+        'nearest_bus_service': f'Bus {rng.randint(1, 99)}',
+        'image': f'https://example.com/images/{i}.jpg',
+        'cost_free': rng.choice(('Yes', 'No')),
+        'cost_details': _sentence(rng, 8),
+        'rating': round(rng.uniform(1, 5), 1),
+    }
+
+'''
+This function fills the database of the app with the synthetic dataset.
+All the collections of the app are emptied first.
+app is the index module. Returns the sizes of the dataset.
+'''
+def seed(app, places=500, users=100, reviews=5000, likes_per_review=3, random_seed=42):
+    import place_documents, search_index, review_details, rating_aggregates
+
+    rng = random.Random(random_seed)
+    db = app.db
+    for name in ('Places', 'Reviews', 'Users', 'blacklist', 'SearchIndex', 'Counters', 'CacheVersions',
+                 review_details.REVIEW_DETAILS_COLLECTION, rating_aggregates.PLACE_RATINGS_COLLECTION, 'Likes'):
+        db[name].delete_many({})
+    app.upgrade_schema()
+
+    app.places_collection.insert_many([place_documents.build_place_document(place_data(rng, i), i) for i in range(1, places + 1)])
+
+    # Hashing is slow on purpose, so every user shares the same hash, with the work factor of the app.
+    password = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt(app.password_hasher.rounds)).decode('utf-8')
+    app.users_collection.insert_many([{
+        'fullname': f'User {i}',
+        'user_id': f'u{i}',
+        'username': ADMIN_USERNAME if i == 1 else f'user{i}',
+        'role': 'admin' if i == 1 else 'user',
+        'password': password,
+        'email': f'user{i}@example.com',
+        'profile_photo': f'https://example.com/users/{i}.jpg',
+    } for i in range(1, users + 1)])
+
+    now = datetime.datetime(2024, 6, 1)
+    like_documents = []
+    review_documents = []
+    for i in range(1, reviews + 1):
+        timestamp = now - datetime.timedelta(minutes=i)
+        likers = rng.sample(range(1, users + 1), min(users, rng.randint(0, likes_per_review * 2)))
+        # Like the likes of the app, every like has the time it was given, after the review was written.
+        # The liked reviews pages are sorted by it.
+        like_documents.extend({
+            'user_id': f'u{user}',
+            'review_id': f'r{i}',
+            'created_at': timestamp + datetime.timedelta(seconds=rng.randint(1, i * 60)),
+        } for user in likers)
+        review_documents.append({
+            'place_id': rng.randint(1, places),
+            'review_id': f'r{i}',
+            'text': ' '.join(_sentence(rng, 12) for _ in range(rng.randint(1, 4))),
+            'rating': Decimal128(str(rng.randint(1, 5))),
+            'user_id': f'u{rng.randint(1, users)}',
+            'likes': len(likers),
+            'timestamp': timestamp,
+        })
+    app.reviews_collection.insert_many(review_documents)
+    if like_documents:
+        app.likes_collection.insert_many(like_documents)
+
+    # The id sequences continue after the dataset.
+    app.counters_collection.insert_many([
+        {'_id': 'place_id', 'seq': places}, {'_id': 'review_id', 'seq': reviews}, {'_id': 'user_id', 'seq': users},
+    ])
+
+    search_index.rebuild(app.search_index_collection, app.places_collection.find())
+    review_details.rebuild(db)
+    # The rating aggregates are built from the generated reviews, as mongomock (--in-memory) can not run
+    # the grouping of rating_aggregates.rebuild.
+    aggregates = {}
+    for review in review_documents:
+        place = aggregates.setdefault(review['place_id'], {
+            '_id': review['place_id'], 'review_count': 0, 'rating_sum': 0.0,
+            'histogram': {star: 0 for star in rating_aggregates.STARS}})
+        place['review_count'] += 1
+        place['rating_sum'] += rating_aggregates.to_float(review['rating'])
+        place['histogram'][rating_aggregates.star(review['rating'])] += 1
+    if aggregates:
+        db[rating_aggregates.PLACE_RATINGS_COLLECTION].insert_many(list(aggregates.values()))
+    return {'places': places, 'users': users, 'reviews': reviews, 'likes': len(like_documents), 'seed': random_seed}
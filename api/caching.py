@@ -0,0 +1,83 @@
+# In-process caches.
+# A TTLCache keeps at most maxsize entries, evicting the least recently used one when full.
+# Every entry also expires after a time to live, so data changed by another worker process
+# is never served for longer than that.
+from collections import OrderedDict
+import threading
+import time
+
+class TTLCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    '''
+    This function returns the cached value of a key, or None if it is missing or expired.
+    '''
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    '''
+    This function caches a value.
+    A ttl shorter than the default one can be given, e.g. to not outlive the expiry of a token.
+    '''
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    # Removes a single key from the cache.
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    '''
+    This function removes all the entries for which predicate(key, value) is true.
+    It goes through the whole cache, so it is meant for rare writes like a profile update.
+    '''
+    def invalidate_if(self, predicate):
+        with self._lock:
+            for key in [key for key, (_, value) in self._entries.items() if predicate(key, value)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    '''
+    This function returns the hit/miss counters of the cache.
+    '''
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
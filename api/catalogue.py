@@ -0,0 +1,253 @@
+# In-process replica of the places catalogue.
+# The Places collection is small and rarely written, so when enabled every process keeps a snapshot of it
+# in memory and serves the places listing and place lookups from it, without a database round trip.
+#
+# A snapshot is immutable and holds:
+# - the places by place_id,
+# - every sort order of the listing precomputed, with the sort keys for the cursors of the pages,
+# - a bitmap of the places of every category, so a filter on several categories is a bitwise AND.
+#
+# The snapshot is tagged with the version of the "places" resource (see response_cache.py), which
+# add_place, delete_place and the imports bump. The version is polled at most every poll interval,
+# and a new snapshot is loaded when it changed. So other processes see a write after at most one interval.
+# While a snapshot is loading, the other threads keep reading the previous one.
+import datetime
+import heapq
+import math
+import threading
+import time
+from bisect import bisect_right
+from pagination import cursor_values, decode_cursor, encode_cursor
+
+class Descending:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+'''
+This function returns a key comparing values the way MongoDB sorts them:
+missing and null first, then numbers (NaN before the others), strings, booleans, dates, and anything else.
+Missing and null are equal, so the ties are broken by the next keys of the sort order like in MongoDB.
+Ascending orders put them first and descending orders last, the same as the keyset filters, see pagination.py
+'''
+def _value_key(value):
+    if value is None:
+        return (0, 0)
+    if hasattr(value, 'to_decimal'):
+        value = float(value.to_decimal())
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (1, 0, 0) if isinstance(value, float) and math.isnan(value) else (1, 1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, bool):
+        return (3, value)
+    if isinstance(value, datetime.datetime):
+        return (4, value)
+    return (5, str(value))
+
+# Returns the key of a document in a sort order, e.g. [('rating', -1), ('place_id', 1)]
+def sort_key(document, sort_order):
+    return tuple(_value_key(document.get(field)) if direction == 1 else Descending(_value_key(document.get(field)))
+                 for field, direction in sort_order)
+
+'''
+This function returns the fields of a document selected by a MongoDB projection, e.g. {'site_name': 1, '_id': 0}.
+Exclusion projections can only name top level fields, e.g. {'geo': 0}, as built by projections.to_projection.
+The document is copied in any case, so callers may change the result.
+'''
+def project(document, projection):
+    if projection is None:
+        return dict(document)
+    if not any(include for field, include in projection.items() if field != '_id'):
+        return {key: value for key, value in document.items() if projection.get(key, 1)}
+    paths = [field.split('.') for field, include in projection.items() if include and field != '_id']
+    result = _include(document, paths)
+    if projection.get('_id', 1) and '_id' in document:
+        result['_id'] = document['_id']
+    return result
+
+def _include(document, paths):
+    result = {}
+    for key, value in document.items():
+        rests = [path[1:] for path in paths if path[0] == key]
+        if not rests:
+            continue
+        if any(not rest for rest in rests):
+            result[key] = value
+        elif isinstance(value, dict):
+            result[key] = _include(value, rests)
+    return result
+
+# Yields the slots set in a bitmap, lowest first.
+def _set_slots(bits):
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+def _bitmap(slots, size):
+    bits = bytearray((size + 7) // 8)
+    for slot in slots:
+        bits[slot >> 3] |= 1 << (slot & 7)
+    return int.from_bytes(bits, 'little')
+
+'''
+This class is a snapshot of the catalogue at a version.
+Every place has a slot, its position in place_id order. The orders are lists of slots,
+with the sort keys of the slots next to them, so the start of a page is found by bisection.
+The rank of every slot in each order is kept as well, to sort the places matching a filter.
+'''
+class Snapshot:
+    def __init__(self, version, documents, sort_orders):
+        self.version = version
+        self.documents = sorted(documents, key=lambda document: document['place_id'])
+        self.slots = {document['place_id']: slot for slot, document in enumerate(self.documents)}
+        self.loaded_at = time.time()
+
+        members = {}
+        for slot, document in enumerate(self.documents):
+            categories = document.get('categories') or []
+            for category in [categories] if isinstance(categories, str) else categories:
+                members.setdefault(category, []).append(slot)
+        self.categories = {category: _bitmap(slots, len(self.documents)) for category, slots in members.items()}
+
+        self.orders = {}
+        for name, sort_order in sort_orders.items():
+            keys = [sort_key(document, sort_order) for document in self.documents]
+            order = sorted(range(len(self.documents)), key=keys.__getitem__)
+            ranks = [0] * len(order)
+            for rank, slot in enumerate(order):
+                ranks[slot] = rank
+            self.orders[name] = (sort_order, order, [keys[slot] for slot in order], ranks)
+
+    '''
+    This function returns the bitmap of the places matching the filter, an int with the bits of their slots set,
+    or None if every place matches.
+    A place matches if it has all the categories (like $all) and its place_id is one of place_ids.
+    '''
+    def matching(self, categories=None, place_ids=None):
+        if not categories and place_ids is None:
+            return None
+        mask = (1 << len(self.documents)) - 1
+        for category in categories or []:
+            mask &= self.categories.get(category, 0)
+        if place_ids is not None:
+            mask &= _bitmap([self.slots[place_id] for place_id in place_ids if place_id in self.slots], len(self.documents))
+        return mask
+
+    '''
+    This function returns the slots of the places matching the filter in the named sort order,
+    starting at the given position of the order. At most limit slots are returned if a limit is given.
+
+    Implementation:
+    Without a filter, it is a slice of the order. Otherwise only the set bits of the bitmap are visited,
+    and the matching slots are sorted by their rank in the order, so a selective filter never walks
+    the whole catalogue.
+    '''
+    def ordered(self, sort, categories=None, place_ids=None, start=0, limit=None):
+        _, order, _, ranks = self.orders[sort]
+        bits = self.matching(categories, place_ids)
+        if bits is None:
+            return order[start:] if limit is None else order[start:start + limit]
+        slots = [slot for slot in _set_slots(bits) if ranks[slot] >= start]
+        if limit is None:
+            return sorted(slots, key=ranks.__getitem__)
+        return heapq.nsmallest(limit, slots, key=ranks.__getitem__)
+
+class PlaceCatalogue:
+    def __init__(self, collection, versions, sort_orders, resource='places', poll_interval=1.0):
+        self.collection = collection
+        self.versions = versions
+        self.sort_orders = sort_orders
+        self.resource = resource
+        self.poll_interval = poll_interval
+        self.loads = 0
+        self.load_seconds = 0.0
+        self._snapshot = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    '''
+    This function returns the current snapshot, loading a new one if the version of the catalogue changed.
+
+    Implementation:
+    Only one thread polls the version at a time. The others return the current snapshot meanwhile,
+    unless there is none yet. The version is read before the places, so a write landing in between
+    makes the next poll load the catalogue again, instead of keeping newer places under an older version.
+    '''
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked < self.poll_interval:
+            return snapshot
+        if not self._lock.acquire(blocking=snapshot is None):
+            return snapshot
+        try:
+            if self._snapshot is not None and time.monotonic() - self._checked < self.poll_interval:
+                return self._snapshot
+            version = self.versions.get([self.resource])[0]
+            if self._snapshot is None or self._snapshot.version != version:
+                started = time.perf_counter()
+                self._snapshot = Snapshot(version, list(self.collection.find()), self.sort_orders)
+                self.loads += 1
+                self.load_seconds += time.perf_counter() - started
+            self._checked = time.monotonic()
+            return self._snapshot
+        finally:
+            self._lock.release()
+
+    # Makes the next read poll the version, e.g. after this process changed the places.
+    def invalidate(self):
+        self._checked = 0.0
+
+    # Returns the place with the given place_id, or None.
+    def get(self, place_id, projection=None):
+        snapshot = self.snapshot()
+        slot = snapshot.slots.get(place_id)
+        return project(snapshot.documents[slot], projection) if slot is not None else None
+
+    '''
+    This function returns the places matching the filter, see Snapshot.matching.
+    They are sorted by the named sort order, or by place_id if sort is None.
+    '''
+    def find(self, categories=None, place_ids=None, sort=None, projection=None):
+        snapshot = self.snapshot()
+        return [project(snapshot.documents[slot], projection) for slot in snapshot.ordered(sort, categories, place_ids)]
+
+    '''
+    This function returns a page of the places matching the filter, like pagination.paginate.
+    The cursors are the same as the ones of the database queries, so a client can page across
+    a process with the catalogue and one without.
+    Returns a tuple of (places, next_cursor).
+    '''
+    def paginate(self, sort, limit, after=None, categories=None, place_ids=None, projection=None):
+        snapshot = self.snapshot()
+        sort_order, _, keys, _ = snapshot.orders[sort]
+        start = 0
+        if after:
+            values = decode_cursor(after, len(sort_order))
+            start = bisect_right(keys, sort_key(dict(zip([field for field, _ in sort_order], values)), sort_order))
+
+        page = [snapshot.documents[slot] for slot in snapshot.ordered(sort, categories, place_ids, start, limit + 1)]
+
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor(cursor_values(page[-1], sort_order))
+        return [project(document, projection) for document in page], next_cursor
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'version': snapshot.version if snapshot else None,
+            'places': len(snapshot.documents) if snapshot else 0,
+            'loaded_at': snapshot.loaded_at if snapshot else None,
+            'loads': self.loads,
+            'load_seconds': self.load_seconds,
+        }
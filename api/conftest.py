@@ -0,0 +1,52 @@
+# Fixtures shared by the tests of the endpoints which run against an in-process stand-in for MongoDB.
+import datetime
+import uuid
+import jwt
+import pytest
+
+'''
+This fixture runs the app against an empty mongomock database, see database.use_client.
+The caches and in-memory state of the app are replaced for the test, so nothing is shared
+with the tests using a real database. Yields the index module.
+'''
+@pytest.fixture
+def mock_app(monkeypatch):
+    mongomock = pytest.importorskip('mongomock')
+    import database
+    import index
+    from caching import TTLCache
+    from id_allocator import IdAllocator
+    from revocation import RevokedTokens
+
+    database.use_client(mongomock.MongoClient())
+    monkeypatch.setitem(index.app.config, 'SECRET_KEY', 'test-secret')
+    monkeypatch.setattr(index, 'AUTO_ENSURE_INDEXES', True)
+    monkeypatch.setattr(index, 'schema_ready', False)
+    monkeypatch.setattr(index, 'schema_retry_at', 0.0)
+    monkeypatch.setattr(index, 'id_allocator', IdAllocator(index.counters_collection))
+    monkeypatch.setattr(index, 'token_cache', TTLCache(maxsize=100, ttl=60))
+    monkeypatch.setattr(index, 'user_cache', TTLCache(maxsize=100, ttl=60))
+    monkeypatch.setattr(index, 'revoked_tokens', RevokedTokens(index.blacklist))
+    monkeypatch.setattr(index.response_cache, 'payloads', TTLCache(maxsize=100, ttl=60))
+    monkeypatch.setattr(index, 'like_counter', None)
+    monkeypatch.setattr(index, 'place_catalogue', None)
+    try:
+        yield index
+    finally:
+        database.use_client(None)
+
+'''
+This function adds a user and returns the headers of requests logged in as them.
+'''
+def login_headers(index, user_id, fullname='User', role='user'):
+    user = {'user_id': user_id, 'fullname': fullname, 'username': user_id, 'email': user_id + '@example.com',
+            'profile_photo': 'photo.png', 'role': role, 'password': ''}
+    index.users_collection.insert_one(user)
+    token = jwt.encode({
+        'jti': uuid.uuid4().hex,
+        'id': str(user['_id']),
+        'user': user['username'],
+        'role': role,
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=1),
+    }, index.app.config['SECRET_KEY'])
+    return {'x-access-token': token}
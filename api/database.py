@@ -0,0 +1,122 @@
+# Lazy access to the MongoDB client, database and collections.
+# Nothing here talks to MongoDB when the app is imported: the client is created the first time
+# a collection is actually used. A fresh serverless instance can therefore start serving requests
+# right away, and endpoints which do not need the database never wait for it.
+#
+# Indexes are not created at import time either, see the ensure-indexes command in index.py,
+# and ensure_schema, which creates them before the first request of a process if AUTO_ENSURE_INDEXES is set.
+import os
+import threading
+from pymongo import MongoClient
+
+# Name of the database used by the app, unless MONGO_DB names another one (e.g. for tests).
+DEFAULT_DB_NAME = 'TouristTalks'
+
+# Options of the client which can be set from the environment, e.g. MONGO_MAX_POOL_SIZE=16.
+# Connection pools are per process, so a server with several worker processes opens up to
+# workers * maxPoolSize connections.
+CLIENT_OPTIONS = {
+    'MONGO_MAX_POOL_SIZE': 'maxPoolSize',
+    'MONGO_MIN_POOL_SIZE': 'minPoolSize',
+    'MONGO_MAX_IDLE_TIME_MS': 'maxIdleTimeMS',
+    'MONGO_CONNECT_TIMEOUT_MS': 'connectTimeoutMS',
+    'MONGO_SOCKET_TIMEOUT_MS': 'socketTimeoutMS',
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': 'serverSelectionTimeoutMS',
+    'MONGO_WAIT_QUEUE_TIMEOUT_MS': 'waitQueueTimeoutMS',
+}
+
+_client = None
+_client_pid = None
+_lock = threading.Lock()
+
+# Incremented when the client is swapped with use_client, so the lazy objects look up their target again.
+_generation = 0
+
+# Returns the options of the client set in the environment.
+def client_options():
+    return {option: int(os.environ[name]) for name, option in CLIENT_OPTIONS.items() if os.getenv(name)}
+
+'''
+This function returns the MongoDB client, creating it on first use.
+A MongoClient must not be used across a fork, so a forked worker process gets a client of its own.
+'''
+def get_client():
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = MongoClient(os.getenv('MONGO_URI'), **client_options())
+                _client_pid = os.getpid()
+    return _client
+
+'''
+This function drops the client inherited from the parent process, right after a fork.
+The lock is replaced too, as it may have been held by another thread of the parent when it forked.
+The client of the parent is not closed, its sockets belong to the parent.
+'''
+def reset_after_fork():
+    global _client, _client_pid, _lock
+    _lock = threading.Lock()
+    _client = None
+    _client_pid = None
+
+# Closes the client of this process, e.g. when a server worker exits.
+def close_client():
+    global _client, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+'''
+This function makes the app use the given client, e.g. an in-process stand-in for MongoDB in the benchmarks
+and tests. The lazy client, database and collections use it from then on, even if they were used before.
+None goes back to the client of MONGO_URI, created on next use.
+'''
+def use_client(client):
+    global _client, _client_pid, _generation
+    with _lock:
+        _client = client
+        _client_pid = os.getpid() if client is not None else None
+        _generation += 1
+
+# Returns the database of the app.
+# The environment is read on first use, after index.py has loaded the .env file.
+def get_db():
+    return get_client()[os.getenv('MONGO_DB', DEFAULT_DB_NAME)]
+
+'''
+This class stands in for a MongoDB object (client, database or collection) until it is first used.
+Attributes and items are looked up on the real object, which is created by the factory on first access.
+So module level code can hold on to collections without connecting to the database.
+'''
+class LazyProxy:
+    def __init__(self, factory):
+        self._factory = factory
+        self._target = None
+        self._pid = None
+        self._generation = None
+
+    def _resolve(self):
+        if self._target is None or self._pid != os.getpid() or self._generation != _generation:
+            self._target = self._factory()
+            self._pid = os.getpid()
+            self._generation = _generation
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __getitem__(self, name):
+        return self._resolve()[name]
+
+    def __repr__(self):
+        return f'LazyProxy({self._target!r})'
+
+# Lazy client, database and collection, e.g. db['Places'] only connects when it is queried.
+client = LazyProxy(get_client)
+db = LazyProxy(get_db)
+
+def collection(name):
+    return LazyProxy(lambda: get_db()[name])
@@ -0,0 +1,50 @@
+# Streaming export of collections.
+# The documents are read from a MongoDB cursor in batches and written to the response as they come,
+# so the memory used does not depend on the size of the collection, and the client starts receiving
+# data right away instead of waiting for the whole body to be built.
+from json_provider import dumps
+
+# Number of documents read from the database, and written to the response, at a time.
+EXPORT_BATCH_SIZE = 1000
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+}
+
+'''
+This function writes the documents as NDJSON, one document per line.
+Every chunk yielded holds up to batch_size documents.
+'''
+def ndjson_chunks(documents, batch_size=EXPORT_BATCH_SIZE):
+    lines = []
+    for document in documents:
+        lines.append(dumps(document) + '\n')
+        if len(lines) >= batch_size:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+'''
+This function writes the documents as a single JSON array.
+Every chunk yielded holds up to batch_size documents.
+'''
+def json_array_chunks(documents, batch_size=EXPORT_BATCH_SIZE):
+    yield '['
+    items = []
+    first = True
+    for document in documents:
+        items.append(dumps(document))
+        if len(items) >= batch_size:
+            yield ('' if first else ',') + ','.join(items)
+            first = False
+            items = []
+    if items:
+        yield ('' if first else ',') + ','.join(items)
+    yield ']'
+
+CHUNKS = {
+    'ndjson': ndjson_chunks,
+    'json': json_array_chunks,
+}
@@ -0,0 +1,224 @@
+# Geospatial queries on places.
+# Every place stores its location as a GeoJSON point in the "geo" field, next to the
+# latitude and longitude fields the frontend reads. The 2dsphere index on it lets MongoDB
+# find the places near a point, or inside a map viewport, without scanning the catalogue.
+import math
+from pymongo import UpdateOne
+
+# Default and largest search radius of the nearby search, in metres.
+DEFAULT_RADIUS = 5000
+MAX_RADIUS = 50000
+
+# Default and largest number of cells on each side of the cluster grid.
+DEFAULT_GRID_SIZE = 8
+MAX_GRID_SIZE = 32
+
+# The viewport of the clusters is searched with polygons of at most POLYGON_WIDTH degrees of longitude,
+# with a vertex every EDGE_STEP degrees along their southern and northern edges.
+POLYGON_WIDTH = 90
+EDGE_STEP = 10
+
+# Degrees of latitude added to the south and north of the polygons, more than an edge of EDGE_STEP degrees
+# bends away from its parallel, and the latitude the polygons stop at, short of the poles.
+LATITUDE_MARGIN = 0.25
+MAX_LATITUDE = 89.9
+
+'''
+This function returns the GeoJSON point of a latitude and longitude.
+GeoJSON stores the longitude first.
+Returns None if the coordinates are missing or not valid, such places are left out of the geospatial queries.
+'''
+def point(latitude, longitude):
+    try:
+        latitude = float(latitude)
+        longitude = float(longitude)
+    except (TypeError, ValueError):
+        return None
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        return None
+    return {'type': 'Point', 'coordinates': [longitude, latitude]}
+
+'''
+This function creates the index used by the geospatial queries.
+categories is part of the index, so that the category filter is answered by the index as well.
+Places without a point are not part of a 2dsphere index.
+'''
+def create_indexes(collection):
+    collection.create_index([('geo', '2dsphere'), ('categories', 1)])
+
+'''
+This function parses a latitude and longitude sent by a client.
+It raises a ValueError if they are missing or not valid.
+'''
+def parse_point(latitude, longitude):
+    geo = point(latitude, longitude)
+    if geo is None:
+        raise ValueError('lat and lng must be a valid latitude and longitude')
+    return geo
+
+'''
+This function parses a search radius in metres.
+It raises a ValueError if it is not a positive number up to MAX_RADIUS.
+'''
+def parse_radius(value):
+    if value is None:
+        return DEFAULT_RADIUS
+    try:
+        radius = float(value)
+    except ValueError:
+        raise ValueError('radius must be a number of metres')
+    if not math.isfinite(radius) or radius <= 0 or radius > MAX_RADIUS:
+        raise ValueError(f'radius must be between 0 and {MAX_RADIUS} metres')
+    return radius
+
+'''
+This function parses a bounding box, given as "west,south,east,north" in degrees.
+It raises a ValueError if it is not valid.
+'''
+def parse_bbox(value):
+    try:
+        west, south, east, north = (float(part) for part in (value or '').split(','))
+    except ValueError:
+        raise ValueError('bbox must be west,south,east,north')
+    if not (-180 <= west < east <= 180 and -90 <= south < north <= 90):
+        raise ValueError('bbox must be west,south,east,north with west < east and south < north')
+    return west, south, east, north
+
+'''
+This function returns the query matching the points inside a bounding box, or a little around it.
+
+Implementation:
+The edges of a GeoJSON polygon are great circle arcs, not parallels, and a polygon must be smaller
+than a hemisphere, so the box itself cannot be the polygon when it is large (e.g. the whole world).
+The box is cut into polygons at most POLYGON_WIDTH degrees wide, whose southern and northern edges
+have a vertex every EDGE_STEP degrees and are moved LATITUDE_MARGIN degrees outwards, so that the
+polygons cover the box. Their latitudes are clamped to MAX_LATITUDE, as a polygon cannot have a pole
+as a vertex. The caller trims the places outside the box itself.
+'''
+def within_bbox(bbox):
+    west, south, east, north = bbox
+    south = max(south - LATITUDE_MARGIN, -MAX_LATITUDE)
+    north = min(north + LATITUDE_MARGIN, MAX_LATITUDE)
+    count = math.ceil((east - west) / POLYGON_WIDTH)
+    queries = []
+    for i in range(count):
+        left = west + (east - west) * i / count
+        right = west + (east - west) * (i + 1) / count
+        steps = math.ceil((right - left) / EDGE_STEP)
+        longitudes = [left + (right - left) * j / steps for j in range(steps + 1)]
+        ring = [[longitude, south] for longitude in longitudes] + [[longitude, north] for longitude in reversed(longitudes)]
+        ring.append(ring[0])
+        queries.append({'geo': {'$geoWithin': {'$geometry': {'type': 'Polygon', 'coordinates': [ring]}}}})
+    return queries[0] if len(queries) == 1 else {'$or': queries}
+
+'''
+This function parses the number of cells on each side of the cluster grid.
+'''
+def parse_grid_size(value):
+    if value is None:
+        return DEFAULT_GRID_SIZE
+    try:
+        grid_size = int(value)
+    except ValueError:
+        raise ValueError('grid must be an integer')
+    if grid_size < 1 or grid_size > MAX_GRID_SIZE:
+        raise ValueError(f'grid must be between 1 and {MAX_GRID_SIZE}')
+    return grid_size
+
+'''
+This function finds the places near a point, nearest first.
+
+Implementation:
+$geoNear uses the 2dsphere index to read the places in distance order, stopping at the radius.
+The categories filter is part of the $geoNear query, so it is applied while walking the index.
+Every place gets a "distance" field, in metres.
+'''
+def nearby(collection, geo, radius, limit, categories=None, projection=None):
+    query = {'categories': {'$all': categories}} if categories else {}
+    pipeline = [
+        {'$geoNear': {
+            'near': geo,
+            'key': 'geo',
+            'distanceField': 'distance',
+            'maxDistance': radius,
+            'spherical': True,
+            'query': query,
+        }},
+        {'$limit': limit},
+    ]
+    if projection is not None:
+        # An exclusion projection keeps the distance anyway, and can not be mixed with an inclusion.
+        exclusion = not any(include for field, include in projection.items() if field != '_id')
+        pipeline.append({'$project': projection if exclusion else dict(projection, distance=1)})
+    return list(collection.aggregate(pipeline))
+
+'''
+This function groups the places inside a map viewport into clusters.
+
+Implementation:
+The viewport is split into a grid of grid_size x grid_size cells.
+The places inside the viewport are found with the 2dsphere index (see within_bbox) and grouped by cell in the database,
+so only one document per cell is sent back however many places the viewport holds.
+Every cluster has the number of places in the cell and their mean position, where the marker is drawn.
+A cluster of a single place also carries its place_id and site_name, so it can be drawn as the place itself.
+'''
+def clusters(collection, bbox, grid_size=DEFAULT_GRID_SIZE, categories=None):
+    west, south, east, north = bbox
+    cell_width = (east - west) / grid_size
+    cell_height = (north - south) / grid_size
+
+    match = within_bbox(bbox)
+    if categories:
+        match['categories'] = {'$all': categories}
+
+    longitude = {'$arrayElemAt': ['$geo.coordinates', 0]}
+    latitude = {'$arrayElemAt': ['$geo.coordinates', 1]}
+    pipeline = [
+        {'$match': match},
+        {'$project': {
+            '_id': 0, 'place_id': 1, 'site_name': 1, 'longitude': longitude, 'latitude': latitude,
+        }},
+        {'$match': {'longitude': {'$gte': west, '$lte': east}, 'latitude': {'$gte': south, '$lte': north}}},
+        {'$group': {
+            '_id': {'x': _cell('$longitude', west, cell_width, grid_size), 'y': _cell('$latitude', south, cell_height, grid_size)},
+            'count': {'$sum': 1},
+            'latitude': {'$avg': '$latitude'},
+            'longitude': {'$avg': '$longitude'},
+            'place_id': {'$first': '$place_id'},
+            'site_name': {'$first': '$site_name'},
+        }},
+        {'$sort': {'_id.y': 1, '_id.x': 1}},
+    ]
+
+    results = []
+    for group in collection.aggregate(pipeline):
+        cluster = {'count': group['count'], 'latitude': group['latitude'], 'longitude': group['longitude']}
+        if group['count'] == 1:
+            cluster['place_id'] = group['place_id']
+            cluster['site_name'] = group['site_name']
+        results.append(cluster)
+    return results
+
+# Index of the grid cell of a coordinate. The last cell also holds the places on the east or north edge.
+def _cell(value, start, size, grid_size):
+    return {'$min': [grid_size - 1, {'$floor': {'$divide': [{'$subtract': [value, start]}, size]}}]}
+
+'''
+This function adds the GeoJSON point to the places stored before it existed.
+Returns the number of places updated.
+'''
+def migrate(collection, batch_size=1000):
+    updated = 0
+    requests = []
+    for place in collection.find({'geo': {'$exists': False}}, {'location': 1}):
+        location = place.get('location') or {}
+        geo = point(location.get('latitude'), location.get('longitude'))
+        if geo is None:
+            continue
+        requests.append(UpdateOne({'_id': place['_id']}, {'$set': {'geo': geo}}))
+        if len(requests) >= batch_size:
+            updated += collection.bulk_write(requests, ordered=False).modified_count
+            requests = []
+    if requests:
+        updated += collection.bulk_write(requests, ordered=False).modified_count
+    return updated
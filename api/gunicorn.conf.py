@@ -0,0 +1,62 @@
+# Production server configuration.
+# The app runs in several worker processes, each serving requests from a few threads.
+# Gunicorn reads this file from the working directory:
+#   cd api && gunicorn index:app
+#
+# Settings come from the environment:
+#   PORT or BIND                 address to listen on (default 0.0.0.0:8000)
+#   WEB_CONCURRENCY              worker processes (default: one per CPU core)
+#   WEB_THREADS                  threads per worker (default 4)
+#   WEB_TIMEOUT                  seconds before a stuck worker is killed and replaced (default 30)
+#   WEB_GRACEFUL_TIMEOUT         seconds a worker has to finish its requests on restart (default 30)
+#   WEB_KEEPALIVE                seconds a keep-alive connection is held open (default 5)
+#   WEB_MAX_REQUESTS             requests after which a worker is replaced, 0 never (default 5000)
+#   WEB_PRELOAD                  import the app once in the master process (default off)
+# The MongoDB connection pool and timeouts are set with the MONGO_* variables, see database.py.
+#
+# Restarts are graceful: on SIGHUP the master starts new workers, with the new code unless the app
+# is preloaded, and the old ones finish their requests before exiting. SIGTERM stops the server the same way.
+import multiprocessing
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:' + os.getenv('PORT', '8000'))
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', 4))
+timeout = int(os.getenv('WEB_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('WEB_KEEPALIVE', 5))
+
+# Workers are replaced after a number of requests, at random points so they do not all restart at once.
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', 5000))
+max_requests_jitter = max_requests // 10
+
+# Preloading starts the workers faster and shares the memory of the app between them,
+# but a restart on SIGHUP then keeps the old code.
+preload_app = os.getenv('WEB_PRELOAD', '').lower() in ('1', 'true', 'yes')
+
+accesslog = os.getenv('WEB_ACCESS_LOG')
+errorlog = '-'
+
+'''
+This hook runs in each worker right after it is forked.
+A MongoClient is not fork safe: with a preloaded app, the client of the master must not be used by the workers.
+The database module already creates a new client in a process with another pid, this makes it explicit
+and also replaces a lock the master may have held when it forked.
+'''
+def post_fork(server, worker):
+    import database
+    database.reset_after_fork()
+
+'''
+This hook runs in a worker when it exits, e.g. on a graceful restart.
+The like counts buffered by the worker are written before its client is closed.
+'''
+def worker_exit(server, worker):
+    import sys
+    index = sys.modules.get('index')
+    if index is not None and index.like_counter is not None:
+        index.like_counter.flush()
+
+    import database
+    database.close_client()
@@ -0,0 +1,117 @@
+# Allocation of unique ids for places, reviews and users.
+# Each kind of id has a sequence in the Counters collection. Instead of incrementing it for
+# every new document, a worker process leases a block of ids with one atomic $inc and then
+# hands them out from memory. Two workers can never lease the same block, so ids never collide.
+# Ids left in a block when a worker stops are simply skipped.
+import os
+import threading
+from pymongo import ReturnDocument
+
+class IdAllocator:
+    def __init__(self, collection, block_size=50):
+        self.collection = collection
+        self.block_size = block_size
+        self.leases = 0
+        self.allocated = 0
+        self._blocks = {}
+        self._seeded = set()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._lease_locks = {}
+
+    '''
+    This function makes sure a sequence starts after the ids already in use.
+    The seed function returns the highest id in use. It is only called when the sequence does not exist yet.
+    $max never moves a sequence backwards, so seeding again (e.g. from another worker) is harmless.
+    '''
+    def _ensure_seeded(self, name, seed):
+        if name in self._seeded:
+            return
+        if seed is not None and self.collection.find_one({'_id': name}) is None:
+            self.collection.update_one({'_id': name}, {'$max': {'seq': int(seed() or 0)}}, upsert=True)
+        self._seeded.add(name)
+
+    # Leases the next block of at least count ids from the database.
+    def _lease(self, name, count):
+        size = max(count, self.block_size)
+        counter = self.collection.find_one_and_update(
+            {'_id': name},
+            {'$inc': {'seq': size}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER)
+        return [counter['seq'] - size + 1, counter['seq']]
+
+    # A forked worker must not reuse the blocks of its parent, so they are dropped when the process id changes.
+    # The caller holds the lock.
+    def _check_pid(self):
+        if os.getpid() != self._pid:
+            self._blocks = {}
+            self._lease_locks = {}
+            self._pid = os.getpid()
+
+    # Takes count ids from the block of a sequence, or returns None if it does not have enough left.
+    # The caller holds the lock.
+    def _take(self, name, count):
+        self._check_pid()
+        block = self._blocks.get(name)
+        if block is None or block[1] - block[0] + 1 < count:
+            return None
+        ids = list(range(block[0], block[0] + count))
+        block[0] += count
+        self.allocated += count
+        return ids
+
+    # Returns the lock serialising the database calls of a sequence.
+    def _lease_lock(self, name):
+        with self._lock:
+            self._check_pid()
+            return self._lease_locks.setdefault(name, threading.Lock())
+
+    '''
+    This function returns count new ids of a sequence.
+
+    Implementation:
+    The ids are taken from the block leased by this process.
+    If the block does not have enough ids left, a new block is leased.
+    The lock of the allocator is not held during the database calls, so the other sequences keep
+    handing out ids meanwhile. The threads needing a block of the same sequence wait for the lease
+    and take their ids from the new block, rather than leasing one each.
+    '''
+    def next_ids(self, name, count=1, seed=None):
+        with self._lock:
+            ids = self._take(name, count)
+        if ids is not None:
+            return ids
+
+        with self._lease_lock(name):
+            with self._lock:
+                ids = self._take(name, count)
+            if ids is not None:
+                return ids
+            self._ensure_seeded(name, seed)
+            block = self._lease(name, count)
+            with self._lock:
+                self._blocks[name] = block
+                self.leases += 1
+                return self._take(name, count)
+
+    '''
+    This function makes sure a sequence never returns ids up to the given value, e.g. after places were
+    imported with their own place_id. The part of the leased block below that value is skipped.
+    It holds the lease lock of the sequence, so a block leased before the update is not stored after it.
+    '''
+    def reserve_up_to(self, name, value, seed=None):
+        with self._lease_lock(name):
+            self._ensure_seeded(name, seed)
+            self.collection.update_one({'_id': name}, {'$max': {'seq': int(value)}}, upsert=True)
+            with self._lock:
+                block = self._blocks.get(name)
+                if block is not None and block[0] <= value:
+                    block[0] = value + 1
+
+    # Returns a single new id of a sequence.
+    def next_id(self, name, seed=None):
+        return self.next_ids(name, 1, seed)[0]
+
+    def stats(self):
+        return {'block_size': self.block_size, 'leases': self.leases, 'allocated': self.allocated}
@@ -1,15 +1,42 @@
+# Import time of the app, to measure its cold start, see /api/stats and benchmarks/bench_cold_start.py
+import time
+IMPORT_STARTED = time.perf_counter()
+
 # Import the necessary modules
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 from functools import wraps
-import random
-import bcrypt
+import hmac
+import threading
 from dotenv import load_dotenv
-from flask import Flask, make_response, request, jsonify
+from flask import Flask, Response, g, make_response, request, jsonify, stream_with_context
 from flask_cors import CORS
+import click
 import jwt
-from pymongo import MongoClient
 from bson import Decimal128, ObjectId
 import os
+import uuid
+import database
+from caching import TTLCache
+from pagination import decode_cursor, encode_cursor, paginate, parse_limit
+from projections import HIDDEN_PLACE_FIELDS, PLACE_VIEWS, REVIEW_VIEWS, requested_fields, to_projection, trim
+import search_index
+import geospatial
+import review_details
+from revocation import RevokedTokens
+from id_allocator import IdAllocator
+from response_cache import ResourceVersions, ResponseCache
+import rating_aggregates
+import likes
+import place_documents
+import place_import
+import export
+import batch_requests
+from json_provider import BSONJSONProvider
+from like_counter import LikeCounterBuffer
+from passwords import PasswordHasher, PasswordPoolBusy
+from metrics import Metrics
+from catalogue import PlaceCatalogue
 
 # Load environment variables file.
 # Here, for security reasons, we are storing the database credentials in a .env file.
@@ -17,38 +44,360 @@ import os
 load_dotenv()
 
 # Create the Flask app.
+# The JSON provider serialises ObjectIds, decimals and datetimes, see json_provider.py
 app = Flask(__name__)
+app.json = BSONJSONProvider(app)
 CORS(app)
 
-# Connect to MongoDB
-uri = os.getenv('MONGO_URI')
-client = MongoClient(uri)
+'''
+Instrumentation of the requests, see metrics.py
+If METRICS_ENABLED is set, the latency, response size and MongoDB commands of every request are recorded
+and served in the Prometheus format on /api/metrics. Requests slower than SLOW_REQUEST_MS are logged
+with their MongoDB commands. Otherwise nothing is hooked into the requests or the MongoDB client.
+'''
+metrics = Metrics(slow_request_seconds=float(os.getenv('SLOW_REQUEST_MS', 1000)) / 1000)
+if os.getenv('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes'):
+    metrics.init_app(app)
+
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 
 # Connecting to the database and its collections.
-db = client['TouristTalks']
-places_collection = db['Places']
-reviews_collection = db['Reviews']
-users_collection = db['Users']
-blacklist = db['blacklist']
+# The connection is made when the database is first used, not when the app is imported, see database.py
+client = database.client
+db = database.db
+places_collection = database.collection('Places')
+reviews_collection = database.collection('Reviews')
+users_collection = database.collection('Users')
+blacklist = database.collection('blacklist')
+search_index_collection = database.collection('SearchIndex')
+review_details_collection = database.collection(review_details.REVIEW_DETAILS_COLLECTION)
+counters_collection = database.collection('Counters')
+cache_versions_collection = database.collection('CacheVersions')
+place_ratings_collection = database.collection(rating_aggregates.PLACE_RATINGS_COLLECTION)
+likes_collection = database.collection(likes.LIKES_COLLECTION)
 
 '''
+This function creates all the indexes of the app. Creating an index which already exists does nothing.
+It is not called when the app is imported, so cold starts do not wait for it.
+The ensure-indexes command runs it, or each process before its first request if AUTO_ENSURE_INDEXES is set, see ensure_schema.
+
 Creates unique index for username and email in users collection.
 This ensures that no two admins can have the same username or email.
 Create unique index for review_id in reviews collection.
 This ensures that no two reviews can have the same review_id.
 Create unique index for place_id in places collection.
 This ensures that no two places can have the same place_id.
+
+Compound indexes backing the sort orders of the paginated places listing.
+place_id is always the last key, so that every document has a unique position in the sort order.
+The category variants serve the same sort orders when filtering by categories.
+'''
+def ensure_indexes():
+    users_collection.create_index([('username', 1)], unique=True)
+    users_collection.create_index([('email', 1)], unique=True)
+    users_collection.create_index([('user_id', 1)], unique=True)
+    reviews_collection.create_index([('review_id', 1)], unique=True)
+    places_collection.create_index([('place_id', 1)], unique=True)
+
+    places_collection.create_index([('site_name', 1), ('place_id', 1)])
+    places_collection.create_index([('rating', -1), ('place_id', 1)])
+    places_collection.create_index([('categories', 1), ('site_name', 1), ('place_id', 1)])
+    places_collection.create_index([('categories', 1), ('rating', -1), ('place_id', 1)])
+
+    # Index backing the sort order of the review feeds.
+    # The read model has the same index, see review_details.py
+    reviews_collection.create_index(REVIEW_SORT_ORDER)
+
+    # Indexes backing the reviews of a place and the removal of the reviews of a user.
+    reviews_collection.create_index([('place_id', 1)])
+    reviews_collection.create_index([('user_id', 1)])
+
+    # Index used by the nearby places and map clusters, see geospatial.py
+    geospatial.create_indexes(places_collection)
+
+    # Indexes used by the places search, see search_index.py
+    search_index.create_indexes(search_index_collection)
+
+    # Indexes used by the likes, see likes.py
+    likes.create_indexes(likes_collection)
+
+    # Indexes used by the review feeds, see review_details.py
+    review_details.create_indexes(review_details_collection)
+
+    # Indexes used by the revoked tokens, see revocation.py
+    revoked_tokens.create_indexes()
+
+'''
+Version of the indexes and data migrations of the app. Raise it when an index or a migration is added,
+so the running deployments apply it. The version the database is at is stored in the SchemaVersion collection.
+'''
+SCHEMA_VERSION = 6
+schema_collection = database.collection('SchemaVersion')
+
+'''
+The indexes and migrations are applied by the ensure-indexes command, as a deployment step.
+Set AUTO_ENSURE_INDEXES=1 to have each process apply them before its first request instead, e.g. on a
+deployment without a release step. A failed upgrade is tried again after SCHEMA_RETRY_SECONDS,
+and the endpoints in SCHEMA_FREE_ENDPOINTS, which do not use the database, never wait for it.
+'''
+AUTO_ENSURE_INDEXES = os.getenv('AUTO_ENSURE_INDEXES', '0').lower() in ('1', 'true', 'yes')
+SCHEMA_RETRY_SECONDS = float(os.getenv('SCHEMA_RETRY_SECONDS', 30))
+SCHEMA_FREE_ENDPOINTS = {'serverStats', 'get_metrics', 'static'}
+schema_ready = False
+schema_retry_at = 0.0
+schema_lock = threading.Lock()
+
+'''
+This function converts the timestamps of existing reviews from strings to native datetimes.
+Reviews used to store the timestamp sent by the client as a string. MongoDB sorts strings before dates,
+so these reviews came last in the feeds, and the keyset filters on dates ($lt) never matched them,
+so they were missing from the pages.
+
+Timestamps which can not be parsed are set to null, which the keyset filters do reach, at the end
+of the feeds. The original string is kept in invalid_timestamp.
+Returns a tuple of (number of reviews converted, review ids of the timestamps set to null).
+'''
+def migrate_review_timestamps():
+    converted = 0
+    invalid = []
+    for review in reviews_collection.find({"timestamp": {"$type": "string"}}, {"review_id": 1, "timestamp": 1}):
+        try:
+            timestamp = datetime.datetime.fromisoformat(review['timestamp'].replace('Z', '+00:00'))
+            # Store naive UTC datetimes, like the ones returned by pymongo.
+            if timestamp.tzinfo is not None:
+                timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+            update = {"$set": {"timestamp": timestamp}}
+            converted += 1
+        except ValueError:
+            update = {"$set": {"timestamp": None, "invalid_timestamp": review['timestamp']}}
+            invalid.append(review['review_id'])
+        reviews_collection.update_one({"_id": review['_id']}, update)
+        review_details.update_review(db, review['review_id'], {"$set": {"timestamp": update["$set"]["timestamp"]}})
+    return converted, invalid
+
+# Returns the version the database is at, 0 if it was never upgraded.
+def schema_version():
+    marker = schema_collection.find_one({'_id': 'schema'})
+    return marker.get('version', 0) if marker else 0
+
+'''
+This function creates the indexes, runs the data migrations and records the version of the database.
+The cheap migrations do nothing on data already migrated, so they run on every upgrade.
+The ones reading whole collections only run when the database is at an older version.
 '''
-users_collection.create_index([('username', 1)], unique=True)
-users_collection.create_index([('email', 1)], unique=True)
-users_collection.create_index([('user_id', 1)], unique=True)
-reviews_collection.create_index([('review_id', 1)], unique=True)
-places_collection.create_index([('place_id', 1)], unique=True)
+def upgrade_schema():
+    version = schema_version()
+    ensure_indexes()
+    # Version 2: the legacy {"token": ...} blacklist documents get an expiry.
+    revoked_tokens.migrate()
+    # Version 3: the string timestamps of the reviews become dates.
+    converted, invalid = migrate_review_timestamps()
+    if invalid:
+        app.logger.warning('Set the invalid timestamps of %d reviews to null: %s', len(invalid), ', '.join(invalid))
+    if converted or invalid:
+        resource_versions.bump('reviews')
+    # Version 5: the liked reviews of the user documents move to the likes collection, the like counts
+    # are recounted from it, and the review read model is built for the reviews written before it existed.
+    if version < 5:
+        likes.migrate(db)
+        likes.recount(db)
+        review_details.rebuild(db)
+        resource_versions.bump('reviews')
+    # Version 6: the search terms keep the letters outside of a-z, so the places are indexed again.
+    if version < 6:
+        search_index.rebuild(search_index_collection, places_collection.find())
+        places_changed()
+    schema_collection.update_one({'_id': 'schema'}, {'$max': {'version': SCHEMA_VERSION}}, upsert=True)
 
+'''
+This function makes sure the database has the indexes and migrations of this version of the app, once per process.
+The endpoints rely on some of them, e.g. the unique index of the likes prevents double likes.
+
+Implementation:
+The first request of a process reads the version of the database, a single round trip when it is up to date.
+Otherwise it is upgraded first, so a fresh deployment never serves requests without the indexes.
+The other requests of the process wait meanwhile. Processes racing on an upgrade are harmless,
+creating an existing index does nothing.
+If the upgrade fails, e.g. because the database is unreachable, the error is raised once and the
+next SCHEMA_RETRY_SECONDS of requests do not try again, so they do not each wait for the database to time out.
+'''
+def ensure_schema():
+    global schema_ready, schema_retry_at
+    if schema_ready:
+        return
+    with schema_lock:
+        if schema_ready or time.monotonic() < schema_retry_at:
+            return
+        try:
+            if schema_version() < SCHEMA_VERSION:
+                upgrade_schema()
+        except Exception:
+            schema_retry_at = time.monotonic() + SCHEMA_RETRY_SECONDS
+            raise
+        schema_ready = True
+
+# If the database can not be upgraded, the request is still served.
+@app.before_request
+def ensure_schema_before_request():
+    if AUTO_ENSURE_INDEXES and not schema_ready and request.endpoint not in SCHEMA_FREE_ENDPOINTS:
+        try:
+            ensure_schema()
+        except Exception:
+            app.logger.exception('Could not create the indexes of the database')
+
+'''
+Allocator of the ids of new places, reviews and users, see id_allocator.py
+The seed functions return the highest id in use, so that the sequences start after the existing ids.
+They only run the first time a sequence is used.
+'''
+id_allocator = IdAllocator(counters_collection, block_size=int(os.getenv('ID_BLOCK_SIZE', 50)))
+
+def max_place_id():
+    place = places_collection.find_one({}, {'place_id': 1}, sort=[('place_id', -1)])
+    return place['place_id'] if place else 0
+
+# Reviews and users have string ids like "r123" and "u123", so the numbers are extracted by the database.
+def max_prefixed_id(collection, field):
+    result = list(collection.aggregate([
+        {"$group": {"_id": None, "max": {"$max": {"$convert": {
+            "input": {"$substrCP": ["$" + field, 1, 20]}, "to": "long", "onError": None, "onNull": None}}}}}
+    ]))
+    return result[0]['max'] if result else 0
+
+def new_place_id():
+    return id_allocator.next_id('place_id', seed=max_place_id)
+
+def new_review_id():
+    return 'r' + str(id_allocator.next_id('review_id', seed=lambda: max_prefixed_id(reviews_collection, 'review_id')))
+
+def new_user_id():
+    return 'u' + str(id_allocator.next_id('user_id', seed=lambda: max_prefixed_id(users_collection, 'user_id')))
+
+'''
+Cache of the read endpoint responses, see response_cache.py
+The cached endpoints depend on these resources:
+"places" - the places catalogue, written by add_place, delete_place, the imports and the search index rebuild.
+"reviews:<place_id>" - the reviews of a place, written by the review endpoints.
+"reviews" - all reviews, for writes spanning many places like deleting a user account,
+the migrations and the commands rebuilding the read model, the rating aggregates and the like counts.
+"users" - the user details joined into reviews, written by update_user_profile.
+'''
+resource_versions = ResourceVersions(cache_versions_collection)
+response_cache = ResponseCache(resource_versions, maxsize=int(os.getenv('RESPONSE_CACHE_SIZE', 256)))
+
+'''
+Optional write-behind mode for the like counts of reviews, see like_counter.py
+If LIKE_WRITE_BEHIND is set, likes are added up in memory and written every LIKE_FLUSH_INTERVAL seconds.
+After a flush, the reviews of the places with changed like counts are invalidated in the response cache.
+'''
+def bump_liked_reviews(review_ids):
+    place_ids = reviews_collection.distinct("place_id", {"review_id": {"$in": review_ids}})
+    resource_versions.bump(*['reviews:' + str(place_id) for place_id in place_ids])
+
+like_counter = None
+if os.getenv('LIKE_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes'):
+    like_counter = LikeCounterBuffer(db, flush_interval=float(os.getenv('LIKE_FLUSH_INTERVAL', 1.0)),
+                                     on_flush=bump_liked_reviews, logger=app.logger)
+
+# Sort orders supported by the places listing. Names are ascending and ratings are descending.
+PLACE_SORT_ORDERS = {
+    'site_name': [('site_name', 1), ('place_id', 1)],
+    'rating': [('rating', -1), ('place_id', 1)],
+    None: [('place_id', 1)],
+}
+
+'''
+Optional in-process replica of the places catalogue, see catalogue.py
+If PLACE_CATALOGUE is set, the places listing and the place lookups are served from memory.
+Each process polls the version of the catalogue at most every PLACE_CATALOGUE_POLL_SECONDS,
+and loads it again after places are added, deleted or imported.
+The nearby places and map clusters still use the geospatial index of the database.
+'''
+place_catalogue = None
+if os.getenv('PLACE_CATALOGUE', '').lower() in ('1', 'true', 'yes'):
+    place_catalogue = PlaceCatalogue(places_collection, resource_versions, PLACE_SORT_ORDERS,
+                                     poll_interval=float(os.getenv('PLACE_CATALOGUE_POLL_SECONDS', 1.0)))
+
+# Bumps the version of the places, so the cached responses and the catalogues of all processes are refreshed.
+# This process reloads its catalogue on the next read.
+def places_changed():
+    resource_versions.bump('places')
+    if place_catalogue is not None:
+        place_catalogue.invalidate()
+
+# Sort order of the paginated review feeds, newest first.
+REVIEW_SORT_ORDER = [('timestamp', -1), ('review_id', 1)]
+
+# Maximum number of review ids accepted by the batched liked lookup.
+MAX_LIKED_LOOKUP_IDS = 100
+
+'''
+Caches used by the authentication decorators.
+The token cache holds the decoded claims of a token, so a token is verified once and not on every request.
+The user cache holds the user documents (without password and liked reviews) by their ObjectId,
+so admin_required and get_logged_in_user do not query the users collection on every request.
+The user cache is invalidated when a user changes their profile, password or deletes their account.
+Other worker processes see such changes once their entry expires.
+'''
+token_cache = TTLCache(maxsize=int(os.getenv('AUTH_CACHE_SIZE', 10000)), ttl=int(os.getenv('AUTH_CACHE_TTL', 300)))
+user_cache = TTLCache(maxsize=int(os.getenv('AUTH_CACHE_SIZE', 10000)), ttl=int(os.getenv('USER_CACHE_TTL', 60)))
+
+# Tokens revoked on logout, see revocation.py
+revoked_tokens = RevokedTokens(blacklist, sync_interval=int(os.getenv('REVOCATION_SYNC_INTERVAL', 5)), logger=app.logger)
+
+'''
+Hashing and verification of passwords, in a pool of processes of their own, see passwords.py
+BCRYPT_ROUNDS is the work factor of new hashes. Stored hashes are moved to it when their user logs in.
+PASSWORD_WORKERS processes run bcrypt and PASSWORD_QUEUE more requests can wait for them,
+further requests get a 503 response until the pool catches up.
+'''
+password_hasher = PasswordHasher(rounds=int(os.getenv('BCRYPT_ROUNDS', 12)),
+                                 max_workers=int(os.getenv('PASSWORD_WORKERS', 2)),
+                                 max_pending=int(os.getenv('PASSWORD_QUEUE', 32)),
+                                 timeout=float(os.getenv('PASSWORD_TIMEOUT', 10)))
+
+# Response of the password endpoints when the password pool is saturated.
+def password_pool_busy_response(e):
+    response = make_response(jsonify({'message': str(e)}), 503)
+    response.headers['Retry-After'] = '1'
+    return response
+
+'''
+This function decodes and verifies a token, using the token cache.
+It raises the jwt exceptions if the token is invalid or expired.
+'''
+def decode_token(token):
+    data = token_cache.get(token)
+    if data is None:
+        data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
+        # Never keep the claims for longer than the token is valid.
+        token_cache.set(token, data, ttl=data['exp'] - time.time() if 'exp' in data else None)
+    elif 'exp' in data and data['exp'] <= time.time():
+        raise jwt.ExpiredSignatureError('Signature has expired')
+    return data
+
+'''
+This function gets a user by the ObjectId stored in the token, using the user cache.
+Returns None if the user does not exist.
+'''
+def get_cached_user(id):
+    user = user_cache.get(id)
+    if user is None:
+        user = users_collection.find_one({'_id': ObjectId(id)}, {'password': 0, 'liked_reviews': 0})
+        if user is not None:
+            user_cache.set(id, user)
+    return user
+
+'''
+This function drops a user from the authentication caches.
+It is called whenever a user document changes.
+'''
+def invalidate_user_cache(user_id):
+    user_cache.invalidate_if(lambda _, user: user.get('user_id') == user_id)
 
 # JWT Authentication, A decorator to check for a valid token.
 # Here, we are using JWT authentication to ensure that only logged in admins can access the endpoints.
+# The decoded token is stored in g.token_data, so the endpoints do not need to decode it again.
 def jwt_required(func):
     @wraps(func)
     def jwt_required_wrapper(*args, **kwargs):
@@ -58,14 +407,17 @@ def jwt_required(func):
         if not token:
             return jsonify({'message': 'Token is missing'}), 401
         try:
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
+            g.token_data = decode_token(token)
         except Exception as e:
             return jsonify({'message': 'Token is invalid', 'error': str(e)}), 401
+        if revoked_tokens.is_revoked(token, g.token_data):
+            return jsonify({'message': 'Token has been revoked'}), 401
         return func(*args, **kwargs)
     return jwt_required_wrapper
 
 # Admin Authentication, A decorator to check for a valid admin token.
 # Here, we are usiong JWT authentication to ensure only admins can access certain endpoints.
+# The decoded token and the user are stored in g.token_data and g.current_user.
 def admin_required(func):
     @wraps(func)
     def admin_required_wrapper(*args, **kwargs):
@@ -75,11 +427,14 @@ def admin_required(func):
         if not token:
             return jsonify({'message': 'Token is missing'}), 401
         try:
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=["HS256"])
-            user_id = data['id']
-            user = users_collection.find_one({'_id': ObjectId(user_id)})
+            data = decode_token(token)
+            if revoked_tokens.is_revoked(token, data):
+                return jsonify({'message': 'Token has been revoked'}), 401
+            user = get_cached_user(data['id'])
             if user['role'] != 'admin':
                 return jsonify({'message': 'You are not authorized to access this endpoint'}), 401
+            g.token_data = data
+            g.current_user = user
         except Exception as e:
             return jsonify({'message': 'Token is invalid', 'error': str(e)}), 401
         return func(*args, **kwargs)
@@ -97,58 +452,251 @@ def databaseStats():
 def serverStats():
     return make_response(jsonify({'message': 'Flask API is working!'}))
 
+'''
+This endpoint serves the request metrics of this worker in the Prometheus text format.
+It is only available if METRICS_ENABLED is set.
+If METRICS_TOKEN is set, the scraper must send it as "Authorization: Bearer <token>".
+'''
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    if not metrics.enabled:
+        return make_response(jsonify({'error': 'Metrics are disabled'}), 404)
+    token = os.getenv('METRICS_TOKEN')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + token):
+        return make_response(jsonify({'message': 'Token is invalid'}), 401)
+    return metrics.response()
+
+# Statistics of the in-process caches of this worker, e.g. to check their hit ratio.
+@app.route('/api/stats', methods=['GET'])
+@admin_required
+def cacheStats():
+    return make_response(jsonify({
+        'token_cache': token_cache.stats(),
+        'user_cache': user_cache.stats(),
+        'revoked_tokens': revoked_tokens.stats(),
+        'id_allocator': id_allocator.stats(),
+        'response_cache': response_cache.stats(),
+        'like_counter': like_counter.stats() if like_counter else None,
+        'password_hasher': password_hasher.stats(),
+        'place_catalogue': place_catalogue.stats() if place_catalogue else None,
+        'startup': {'import_seconds': IMPORT_SECONDS},
+    }), 200)
+
+
+'''
+This function returns a page of search results ranked by relevance.
+
+Implementation:
+The search results are already ranked by the search index.
+If categories are provided, the results not matching them are dropped.
+The cursor holds the score and place_id of the last place of the page,
+so the next page starts right after it in the ranking.
+The places are read with the given projection, which must include place_id.
+'''
+def get_ranked_places_page(ranked, categories, limit, after, projection=None):
+    if categories:
+        ranked_ids = [place_id for _, place_id, _ in ranked]
+        if place_catalogue is not None:
+            matching = place_catalogue.find(categories, ranked_ids, projection={"_id": 0, "place_id": 1})
+        else:
+            matching = places_collection.find({"place_id": {"$in": ranked_ids}, "categories": {"$all": categories}}, {"_id": 0, "place_id": 1})
+        matching_ids = {place['place_id'] for place in matching}
+        ranked = [result for result in ranked if result[1] in matching_ids]
+
+    if after:
+        score, place_id = decode_cursor(after, 2)
+        if not isinstance(score, (int, float)) or not isinstance(place_id, int):
+            raise ValueError('Invalid cursor')
+        ranked = [result for result in ranked if (-result[0], result[1]) > (-score, place_id)]
+
+    page = ranked[:limit]
+    next_cursor = encode_cursor([page[-1][0], page[-1][1]]) if len(ranked) > limit else None
+
+    page_ids = [place_id for _, place_id, _ in page]
+    if place_catalogue is not None:
+        places = {place['place_id']: place for place in place_catalogue.find(place_ids=page_ids, projection=projection)}
+    else:
+        places = {place['place_id']: place for place in places_collection.find({"place_id": {"$in": page_ids}}, projection)}
+    return [places[place_id] for _, place_id, _ in page if place_id in places], next_cursor
 
 '''
 This endpoint gets all places based on the query parameters.
 
 Implementation:
 If categories are provided, filter by categories
-If a search term is provided, filter by name
+If a search term is provided, filter by name, summary, tags and categories using the search index
 If a sort order is provided, sort the results
 If all three are provided, filter by all of them.
 
 If no filter is provided, return all places.
+If a search term is provided without a sort order, the results are ranked by relevance.
+
+Pagination:
+If a limit is provided, the endpoint returns a single page of places,
+sorted and limited by the database using the indexes defined above.
+The response then looks like {"places": [...], "next": <cursor>}.
+To get the next page, pass the cursor back as the "after" query parameter.
+"next" is null on the last page.
+
+Fields:
+If fields (e.g. fields=site_name,image) or a view (e.g. view=card) is provided,
+only those fields are read from the database and returned, see projections.py
+The sort keys are read as well to build the cursor, but are only returned if requested.
 '''
 @app.route('/api/places', methods=['GET'])
 @jwt_required
+@response_cache.cached(lambda: ['places'])
 def get_places():
     try:
         sort = request.args.get('sort')
         search = request.args.get('search')
         categories = request.args.getlist('categories')
+        limit = request.args.get('limit')
+        after = request.args.get('after')
+        try:
+            fields = requested_fields(request.args, PLACE_VIEWS)
+        except ValueError as e:
+            return make_response(jsonify({'error': str(e)}), 400)
 
         # Build the query
         query = {}
+        ranked = None
+        search_ids = None
         if categories:
             query["categories"] = {"$all": categories}
         if search:
-            # case insensitive search
-            query["site_name"] = {"$regex": search, "$options": "i"}
+            # Search the inverted index, the results come back ranked by relevance.
+            ranked = search_index.search(search_index_collection, search)
+            search_ids = [place_id for _, place_id, _ in ranked]
+            query["place_id"] = {"$in": search_ids}
+
+        # Paginated mode, the database sorts and limits the results.
+        if limit is not None or after is not None:
+            try:
+                limit = parse_limit(limit)
+                if ranked is not None and sort not in ('site_name', 'rating'):
+                    keys = ['place_id']
+                    places, next_cursor = get_ranked_places_page(ranked, categories, limit, after, to_projection(fields, keys, HIDDEN_PLACE_FIELDS))
+                else:
+                    sort_order = PLACE_SORT_ORDERS.get(sort, PLACE_SORT_ORDERS[None])
+                    keys = [field for field, _ in sort_order]
+                    if place_catalogue is not None:
+                        places, next_cursor = place_catalogue.paginate(sort if sort in PLACE_SORT_ORDERS else None, limit, after,
+                                                                       categories, search_ids, to_projection(fields, keys, HIDDEN_PLACE_FIELDS))
+                    else:
+                        places, next_cursor = paginate(places_collection, query, sort_order, limit, after, to_projection(fields, keys, HIDDEN_PLACE_FIELDS))
+            except ValueError as e:
+                return make_response(jsonify({'error': str(e)}), 400)
+
+            return make_response(jsonify({'places': trim(places, fields, keys), 'next': next_cursor}), 200)
 
         # Execute the query and sort the results
-        places = list(places_collection.find(query))
-
-         # Sort the results
-        if sort == 'site_name':
-            places.sort(key=lambda x: x.get(sort), reverse=False)  # Ascending order for names
-        elif sort == 'rating':
-            places.sort(key=lambda x: x.get(sort), reverse=True)  # Descending order for ratings
-       
-        # Convert ObjectId to string
-        for place in places:
-            place['_id'] = str(place['_id'])
+        # Names are sorted in ascending order and ratings in descending order.
+        if place_catalogue is not None:
+            places = place_catalogue.find(categories, search_ids, sort if sort in ('site_name', 'rating') else None,
+                                          to_projection(fields, ['place_id'], HIDDEN_PLACE_FIELDS))
+        else:
+            places = places_collection.find(query, to_projection(fields, ['place_id'], HIDDEN_PLACE_FIELDS))
+            if sort in ('site_name', 'rating'):
+                places = places.sort(PLACE_SORT_ORDERS[sort])
+            places = list(places)
+
+        # Search results without a sort order are ranked by relevance.
+        if ranked is not None and sort not in ('site_name', 'rating'):
+            positions = {place_id: position for position, (_, place_id, _) in enumerate(ranked)}
+            places.sort(key=lambda x: positions[x['place_id']])
+
+        return make_response(jsonify(trim(places, fields, ['place_id'])), 200)
+    except Exception as e:
+        return make_response(jsonify({'error': str(e)}), 500)
+
+'''
+This endpoint suggests places while the user is typing in the search box.
+
+Implementation:
+It searches the inverted index with the last word of the query matched as a prefix.
+The place names are stored in the index itself, so this is answered by a single indexed
+query on the search index without touching the places collection.
+'''
+@app.route('/api/places/suggest', methods=['GET'])
+@jwt_required
+def suggest_places():
+    try:
+        q = request.args.get('q', '')
+        try:
+            limit = parse_limit(request.args.get('limit'), default=8, maximum=20)
+        except ValueError as e:
+            return make_response(jsonify({'error': str(e)}), 400)
+
+        results = search_index.search(search_index_collection, q, limit)
+        suggestions = [{'place_id': place_id, 'site_name': site_name} for _, place_id, site_name in results]
+        return make_response(jsonify(suggestions), 200)
+    except Exception as e:
+        return make_response(jsonify({'error': str(e)}), 500)
+
+'''
+This endpoint gets the places near a point, nearest first.
 
+Implementation:
+It gets the point from the lat and lng query parameters, and the search radius in metres
+from the radius parameter (5 km by default, at most 50 km).
+The places are found with the 2dsphere index of the places collection, see geospatial.py
+Like the places listing, the results can be filtered by categories and limited to some fields.
+Every place has a "distance" field with its distance from the point in metres.
+'''
+@app.route('/api/places/nearby', methods=['GET'])
+@jwt_required
+@response_cache.cached(lambda: ['places'])
+def get_nearby_places():
+    try:
+        try:
+            geo = geospatial.parse_point(request.args.get('lat'), request.args.get('lng'))
+            radius = geospatial.parse_radius(request.args.get('radius'))
+            limit = parse_limit(request.args.get('limit'))
+            fields = requested_fields(request.args, PLACE_VIEWS)
+        except ValueError as e:
+            return make_response(jsonify({'error': str(e)}), 400)
+
+        places = geospatial.nearby(places_collection, geo, radius, limit,
+                                   request.args.getlist('categories'), to_projection(fields, hidden=HIDDEN_PLACE_FIELDS))
         return make_response(jsonify(places), 200)
     except Exception as e:
         return make_response(jsonify({'error': str(e)}), 500)
 
+'''
+This endpoint groups the places inside a map viewport into clusters.
+
+Implementation:
+It gets the viewport from the bbox query parameter as west,south,east,north,
+and splits it into a grid of grid x grid cells (8 by default, at most 32).
+The places are grouped by cell in the database, see geospatial.py
+So the map gets one marker per cell, with the number of places in it, instead of every place.
+A cell with a single place also has its place_id and site_name.
+Returns {"clusters": [...]}.
+'''
+@app.route('/api/places/clusters', methods=['GET'])
+@jwt_required
+@response_cache.cached(lambda: ['places'])
+def get_place_clusters():
+    try:
+        try:
+            bbox = geospatial.parse_bbox(request.args.get('bbox'))
+            grid_size = geospatial.parse_grid_size(request.args.get('grid'))
+        except ValueError as e:
+            return make_response(jsonify({'error': str(e)}), 400)
+
+        clusters = geospatial.clusters(places_collection, bbox, grid_size, request.args.getlist('categories'))
+        return make_response(jsonify({'clusters': clusters}), 200)
+    except Exception as e:
+        return make_response(jsonify({'error': str(e)}), 500)
+
 '''
 This function returns all reviews with user and place details.
 
 Implementation:
-It performs left outer join on reviews and users collection
-And deconstructs the user array to get the user details
-And in the end combines the user details with the reviews.
+It reads the ReviewDetails read model, which already holds the user and place details
+of every review (see review_details.py), so this is a single indexed find.
+The read model is kept up to date by the endpoints writing reviews, users and places.
 
 This function contains a parameter called user_id,
 Now that is used here to get the reviews for a particular user.
@@ -156,71 +704,32 @@ but this is for internal use only, so it is not exposed to the frontend.
 This function is called in the get_my_reviews function and get_all_reviews function.
 
 Note: This function is overloaded, if the user_id is not provided, it returns all the reviews(to the caller).
+The fields parameter limits the fields read and returned, see projections.py
 '''
-def get_reviews_with_details(user_id = None):
+def get_reviews_with_details(user_id = None, fields = None):
     try:
-        pipeline = [
-            {
-                "$lookup": {
-                    "from": "Users",
-                    "localField": "user_id",
-                    "foreignField": "user_id",
-                    "as": "user"
-                }
-            },
-            {
-                "$lookup": {
-                    "from": "Places",
-                    "localField": "place_id",
-                    "foreignField": "place_id",
-                    "as": "place"
-                }
-            },
-            {"$unwind": "$user"},
-            {"$unwind": "$place"},
-            {
-                "$project": {
-                    "_id": 1,
-                    "review_id": 1,
-                    "rating": 1,
-                    "timestamp": 1,
-                    "user_id": 1,
-                    "place_id": 1,
-                    "text": 1,
-                    "user_name": "$user.fullname",
-                    "user_profile_photo": "$user.profile_photo",
-                    "place_name": "$place.site_name",
-                    "likes": 1,
-                    "edited": 1
-                }
-            },
-            {
-                "$sort": {"timestamp": -1}
-            }
-        ]
-
         # If user_id is provided, filter by user_id
+        query = {}
         if user_id is not None:
-            pipeline.insert(0, {"$match": {"user_id": user_id}})
-
-        reviews = list(reviews_collection.aggregate(pipeline))
+            query["user_id"] = user_id
 
-        # Convert ObjectId to string and Decimal to float
-        for review in reviews:
-           review['_id'] = str(review['_id'])
-           review['rating'] = float(Decimal128.to_decimal(review['rating']))
-
-        return reviews
+        return list(review_details_collection.find(query, to_projection(fields)).sort(REVIEW_SORT_ORDER))
     except Exception as e:
         print(e)
         return (str(e))
 
 
+# The review endpoints support the fields and view query parameters, see projections.py
 @app.route('/api/reviews', methods=['GET'])
 @jwt_required
 def get_all_reviews():
     try:
-        reviews = get_reviews_with_details()
+        try:
+            fields = requested_fields(request.args, REVIEW_VIEWS)
+        except ValueError as e:
+            return make_response(jsonify({'error': str(e)}), 400)
+
+        reviews = get_reviews_with_details(fields=fields)
         return make_response(jsonify(reviews), 200)
     except Exception as e:
         return make_response(jsonify({"error": str(e)}), 500)
@@ -230,45 +739,117 @@ def get_all_reviews():
 @jwt_required
 def get_my_reviews(user_id):
     try:
-        reviews = get_reviews_with_details(user_id)
+        try:
+            fields = requested_fields(request.args, REVIEW_VIEWS)
+        except ValueError as e:
+            return make_response(jsonify({'error': str(e)}), 400)
+
+        reviews = get_reviews_with_details(user_id, fields)
         return make_response(jsonify(reviews), 200)
     except Exception as e:
         return make_response(jsonify({"error": str(e)}), 500)
 
 '''
-This endpoint gets the reviews liked by a user.
-This endpoint performs iterative queries to get the reviews liked by a user.
+This endpoint gets the latest reviews, one page at a time.
 
 Implementation:
-At first, it gets the user details from the users collection.
-Then it gets the review ids of liked reviews from the user details.
-Then it gets the reviews from the reviews collection using the review ids.
+It reads a page of the review read model, newest first, using the (timestamp, review_id) index.
+The response looks like {"reviews": [...], "next": <cursor>}.
+To get the next page, pass the cursor back as the "after" query parameter.
+As pages continue from the last review seen, a page costs the same however many reviews exist.
+'''
+@app.route('/api/reviews/feed', methods=['GET'])
+@jwt_required
+def get_reviews_feed():
+    try:
+        keys = [field for field, _ in REVIEW_SORT_ORDER]
+        try:
+            fields = requested_fields(request.args, REVIEW_VIEWS)
+            reviews, next_cursor = paginate(review_details_collection, {}, REVIEW_SORT_ORDER,
+                                            parse_limit(request.args.get('limit')), request.args.get('after'),
+                                            to_projection(fields, keys))
+        except ValueError as e:
+            return make_response(jsonify({'error': str(e)}), 400)
+
+        return make_response(jsonify({'reviews': trim(reviews, fields, keys), 'next': next_cursor}), 200)
+    except Exception as e:
+        return make_response(jsonify({"error": str(e)}), 500)
+
+'''
+This endpoint gets the reviews liked by a user, most recently liked first.
+
+Implementation:
+It reads the likes of the user from the likes collection, joined with their reviews
+from the review read model, see likes.liked_reviews.
+
+Pagination:
+If a limit is provided, the endpoint returns a single page of reviews.
+The response then looks like {"reviews": [...], "next": <cursor>}.
+To get the next page, pass the cursor back as the "after" query parameter.
 '''
 @app.route('/api/liked-reviews/<user_id>', methods=['GET'])
 @jwt_required
 def get_liked_reviews(user_id):
     try:
-        user = users_collection.find_one({"user_id": user_id})
-        liked_reviews_ids = user.get('liked_reviews', [])
-        all_reviews = get_reviews_with_details()
+        limit = request.args.get('limit')
+        after = request.args.get('after')
+        try:
+            fields = requested_fields(request.args, REVIEW_VIEWS)
+        except ValueError as e:
+            return make_response(jsonify({'error': str(e)}), 400)
+
+        if limit is not None or after is not None:
+            try:
+                reviews, next_cursor = likes.liked_reviews(db, user_id, parse_limit(limit), after, to_projection(fields))
+            except ValueError as e:
+                return make_response(jsonify({'error': str(e)}), 400)
+            return make_response(jsonify({'reviews': reviews, 'next': next_cursor}), 200)
+
+        reviews, _ = likes.liked_reviews(db, user_id, projection=to_projection(fields))
+        return make_response(jsonify(reviews), 200)
+    except Exception as e:
+        return make_response(jsonify({"error": str(e)}), 500)
+
+'''
+This endpoint tells which of the given reviews are liked by the logged in user.
+The frontend can mark a whole page of the feed with one call.
+
+Implementation:
+It gets the review ids from the request body, e.g. {"review_ids": ["r1", "r2"]}.
+Then it looks up the likes of the user for only those reviews,
+so the full list of liked reviews never leaves the database.
+Returns {"liked": [...]} with the liked review ids.
+'''
+@app.route('/api/reviews/liked-status', methods=['POST'])
+@jwt_required
+def get_liked_status():
+    try:
+        data = request.get_json()
+        review_ids = data.get('review_ids', [])
+        if not isinstance(review_ids, list) or len(review_ids) > MAX_LIKED_LOOKUP_IDS:
+            return make_response(jsonify({'error': f'review_ids must be a list of at most {MAX_LIKED_LOOKUP_IDS} ids'}), 400)
 
-        # Filtering the reviews to get the reviews liked by the user
-        liked_reviews = [review for review in all_reviews if review['review_id'] in liked_reviews_ids]
+        user = get_cached_user(g.token_data['id'])
+        if user is None:
+            return make_response(jsonify({'message': 'user not found'}), 404)
+        liked = likes.liked_among(db, user['user_id'], review_ids)
 
-        return make_response(jsonify(liked_reviews), 200)
+        # Keep the order of the request
+        return make_response(jsonify({'liked': [review_id for review_id in review_ids if review_id in liked]}), 200)
     except Exception as e:
         return make_response(jsonify({"error": str(e)}), 500)
 
 # Get reviews for a place by place_id.
 @app.route('/api/places/<place_id>/reviews', methods=['GET'])
+@response_cache.cached(lambda place_id: ['reviews', 'reviews:' + place_id])
 def get_reviews_for_place(place_id):
     try:
-        reviews = list(reviews_collection.find({"place_id": int(place_id)}))
+        try:
+            fields = requested_fields(request.args, REVIEW_VIEWS)
+        except ValueError as e:
+            return make_response(jsonify({'error': str(e)}), 400)
 
-        # Convert ObjectId to string and Decimal to float (This fixes the JSON serializable error)
-        for review in reviews:
-           review['_id'] = str(review['_id'])
-           review['rating'] = float(Decimal128.to_decimal(review['rating']))
+        reviews = list(reviews_collection.find({"place_id": int(place_id)}, to_projection(fields)))
 
         return make_response(jsonify(reviews), 200)
     except Exception as e:
@@ -279,10 +860,9 @@ def get_reviews_for_place(place_id):
 @jwt_required
 def get_user_by_id(user_id):
     try:
-        user = users_collection.find_one({"user_id": user_id})
+        # The password hash never leaves the server.
+        user = users_collection.find_one({"user_id": user_id}, {"password": 0})
         if user:
-            # Convert ObjectId to string
-            user['_id'] = str(user['_id'])
             return make_response(jsonify(user))
         else:
             return make_response(jsonify({'error': 'User not found'}), 404)
@@ -294,11 +874,13 @@ def get_user_by_id(user_id):
 @jwt_required
 def get_review_by_id(review_id):    
     try:
-        data = reviews_collection.find_one({"review_id": review_id})
-        if data:
-            # Convert ObjectId to string
-            data['_id'] = str(data['_id'])
-            data['rating'] = float(Decimal128.to_decimal(data['rating']))
+        try:
+            fields = requested_fields(request.args, REVIEW_VIEWS)
+        except ValueError as e:
+            return make_response(jsonify({'error': str(e)}), 400)
+
+        data = reviews_collection.find_one({"review_id": review_id}, to_projection(fields))
+        if data is not None:
             return make_response(jsonify(data))
         else:
             return make_response(jsonify({'error': 'Review not found'}), 404)
@@ -312,11 +894,18 @@ Implementation:
 This perform left outer join on reviews and users collection
 And deconstructs the user array to get the user details
 And in the end combines the user details with the reviews.
+If fields or a view are provided, a last stage projects the reviews to those fields.
 '''
 @app.route('/api/places/<place_id>/reviews-with-user-details', methods=['GET'])
 @jwt_required
+@response_cache.cached(lambda place_id: ['reviews', 'reviews:' + place_id, 'users'])
 def get_reviews_with_user_details(place_id):
     try:
+        try:
+            fields = requested_fields(request.args, REVIEW_VIEWS)
+        except ValueError as e:
+            return make_response(jsonify({'error': str(e)}), 400)
+
         pipeline = [
             {"$match": {"place_id": int(place_id)}},
             {"$lookup": {
@@ -326,37 +915,58 @@ def get_reviews_with_user_details(place_id):
                 "as": "user"
             }},
             {"$unwind": "$user"},
-            {"$addFields": {
-                "user._id": {"$toString": "$user._id"},
-                "rating": {"$toDouble": "$rating"}
-            }}
+            {"$project": {"user.password": 0}}
         ]
+        if fields is not None:
+            pipeline.append({"$project": to_projection(fields)})
 
         reviews = list(reviews_collection.aggregate(pipeline))
 
-        # Convert ObjectId to string and Decimal to float
-        for review in reviews:
-            review['_id'] = str(review['_id'])
-            review['rating'] = float(review['rating'])
-
         return make_response(jsonify(reviews), 200)
     except Exception as e:
         return make_response(jsonify({"error": str(e)}), 500)
 
 # Get place by place_id
+# Supports the fields and view query parameters of the places listing.
 @app.route('/api/place/<place_id>', methods=['GET'])
 @jwt_required
+@response_cache.cached(lambda place_id: ['places'])
 def get_place_by_place_id(place_id):
     try:
-        place = places_collection.find_one({"place_id": int(place_id)})
-        if place:
-            # Convert ObjectId to string
-            place['_id'] = str(place['_id'])
+        try:
+            fields = requested_fields(request.args, PLACE_VIEWS)
+        except ValueError as e:
+            return make_response(jsonify({'error': str(e)}), 400)
+
+        if place_catalogue is not None:
+            place = place_catalogue.get(int(place_id), to_projection(fields, hidden=HIDDEN_PLACE_FIELDS))
+        else:
+            place = places_collection.find_one({"place_id": int(place_id)}, to_projection(fields, hidden=HIDDEN_PLACE_FIELDS))
+        if place is not None:
             return make_response(jsonify(place))
         else:
             return make_response(jsonify({'error': 'Place not found'}), 404)
     except Exception as e:
         return make_response(jsonify({'error': str(e)}), 500)
+
+'''
+This endpoint gets the rating summary of a place.
+
+Implementation:
+It reads the running aggregates of the place, which the review endpoints keep up to date (see rating_aggregates.py).
+So the summary is a single document lookup, however many reviews the place has.
+Returns the number of reviews, the average rating and the number of reviews for every star.
+'''
+@app.route('/api/places/<place_id>/summary', methods=['GET'])
+@jwt_required
+@response_cache.cached(lambda place_id: ['reviews', 'reviews:' + place_id])
+def get_place_rating_summary(place_id):
+    try:
+        aggregates = place_ratings_collection.find_one({"_id": int(place_id)})
+        return make_response(jsonify(rating_aggregates.summary(int(place_id), aggregates)), 200)
+    except Exception as e:
+        return make_response(jsonify({'error': str(e)}), 500)
+
 '''
 This endpoint adds a new review to the reviews collection.
 
@@ -373,25 +983,35 @@ def add_review():
         text = data.get('text')
         rating = data.get('rating')
         user_id = data.get('user_id')
-        likes = data.get('likes')
-        timestamp = data.get('timestamp')
+        like_count = data.get('likes')
+
+        # The rating is checked before the review is stored, so the aggregates can always count it.
+        try:
+            rating_aggregates.validate_rating(rating)
+        except ValueError as e:
+            return make_response(jsonify({'error': str(e)}), 400)
+        inc = rating_aggregates.increments(rating)
 
         # Create a new review in reviews collection
-        review_id = 'r'+ str(reviews_collection.count_documents({}) + random.randint(1, 1000000))
+        # The timestamp is assigned by the server, so that reviews sort in the order they were written.
+        review_id = new_review_id()
         new_review = {
             'place_id': place_id,
             'review_id' : review_id,
             'text': text,
             'rating': Decimal128(str(rating)),
             'user_id': user_id,
-            'likes': likes,
-            'timestamp': str(timestamp)
+            'likes': like_count,
+            'timestamp': datetime.datetime.utcnow()
         }
         reviews_collection.insert_one(new_review)
+        review_details.refresh_review(db, review_id)
+        rating_aggregates.apply(db, place_id, inc)
+        resource_versions.bump('reviews:' + str(place_id))
         return make_response(jsonify({'message': 'Review added successfully', 
                                       'review_id': review_id}), 201)
     except Exception as e:
-        return make_response(jsonify({'error': e}), 500)
+        return make_response(jsonify({'error': str(e)}), 500)
 
 '''
 This endpoint deletes a review from the reviews collection.
@@ -404,7 +1024,12 @@ Then it deletes the review from the reviews collection by using the review_id.
 @jwt_required
 def delete_review(review_id):
     try:
-        reviews_collection.delete_one({"review_id": review_id})
+        review = reviews_collection.find_one_and_delete({"review_id": review_id}, {"place_id": 1, "rating": 1})
+        review_details.delete_reviews(db, {"review_id": review_id})
+        likes.remove_reviews(db, [review_id])
+        if review is not None:
+            rating_aggregates.remove_review(db, review.get('place_id'), review.get('rating'))
+            resource_versions.bump('reviews:' + str(review.get('place_id')))
         return make_response(jsonify({'message': 'Review deleted successfully'}), 200)
     except Exception as e:
         return make_response(jsonify({'error': str(e)}), 500)
@@ -424,20 +1049,27 @@ def update_review():
         review_id = data.get('review_id')
         text = data.get('text')
         rating = data.get('rating')
-        timestamp = data.get('timestamp')
+        try:
+            rating_aggregates.validate_rating(rating)
+        except ValueError as e:
+            return make_response(jsonify({'error': str(e)}), 400)
 
         # Update the review in reviews collection
         # Here I have added a new field called edited to keep track of the reviews that have been edited.
-        result = reviews_collection.update_one({
-            "review_id": review_id}, 
-            {"$set": {
-                "text": text,
-                "rating": Decimal128(str(rating)), 
-                "timestamp": str(timestamp),
-                "edited": True
-                }
-            })
-        if result.matched_count > 0:
+        # The timestamp stays the creation time, which the feeds are sorted by, the edit time is updated_at.
+        update = {"$set": {
+            "text": text,
+            "rating": Decimal128(str(rating)), 
+            "updated_at": datetime.datetime.utcnow(),
+            "edited": True
+            }
+        }
+        # The review is returned as it was before the update, so its old rating can be replaced in the aggregates.
+        review = reviews_collection.find_one_and_update({"review_id": review_id}, update, {"place_id": 1, "rating": 1})
+        if review is not None:
+            review_details.update_review(db, review_id, update)
+            rating_aggregates.change_review(db, review.get('place_id'), review.get('rating'), rating)
+            resource_versions.bump('reviews:' + str(review.get('place_id')))
             return make_response(jsonify({'message': 'Review updated successfully'}), 201)
         else:
             return make_response(jsonify({'message': 'No matching review found'}), 404)
@@ -450,36 +1082,42 @@ def update_review():
 This endpoint sets the likes for a review.
 
 Implementation:
-It gets the user details from the users collection.
-Then it checks if the user has already liked the review.
-If the user has already liked the review, it returns an error.
-If the user has not liked the review, it increments the likes by 1.
+In case of like, it adds a like to the likes collection.
+The unique index on (user_id, review_id) rejects the like if the user has already liked the review.
+In case of dislike, it removes the like from the likes collection, if there is one.
+If nothing changed, it returns an error.
 
-In case of dislike, it decrements the likes by 1.
+Only the request which changed the likes collection updates the like count of the review,
+so concurrent requests (e.g. a double click) can not count twice.
 In case of like, it increments the likes by 1.
+In case of dislike, it decrements the likes by 1.
+If the write-behind mode is enabled, the change is buffered and written with the next flush.
 '''
 @app.route('/api/user-review-feedback', methods=['PUT'])
 @jwt_required
 def user_review_feedback():
     try:
-        # Factor to increment or decrement the likes by.
-        factor = 1
         data = request.get_json()
         user_id = data.get('user_id')
         review_id = data.get('review_id')
         feedback = data.get('feedback')
 
-        # Set the factor based on the feedback
-        if (feedback == 'Like') and (review_id not in users_collection.find_one({"user_id": user_id})['liked_reviews']):
+        # Set the factor to increment or decrement the likes by, based on the feedback
+        if (feedback == 'Like') and likes.like(db, user_id, review_id):
             factor = 1
-            users_collection.update_one({"user_id": user_id}, {"$push": {"liked_reviews": review_id}})
-        elif (feedback == 'Dislike') and (review_id in users_collection.find_one({"user_id": user_id})['liked_reviews']):
+        elif (feedback == 'Dislike') and likes.unlike(db, user_id, review_id):
             factor = -1
-            users_collection.update_one({"user_id": user_id}, {"$pull": {"liked_reviews": review_id}})
         else:
-            return make_response(jsonify({'message': 'Review '+ feedback +' failed'}), 400)
+            return make_response(jsonify({'message': 'Review '+ str(feedback) +' failed'}), 400)
 
-        reviews_collection.update_one({"review_id": review_id}, {"$inc": {"likes": factor}})
+        # In write-behind mode the like count is updated by the next flush of the buffer.
+        if like_counter is not None:
+            like_counter.add(review_id, factor)
+        else:
+            review = reviews_collection.find_one_and_update({"review_id": review_id}, {"$inc": {"likes": factor}}, {"place_id": 1})
+            review_details.update_review(db, review_id, {"$inc": {"likes": factor}})
+            if review is not None:
+                resource_versions.bump('reviews:' + str(review.get('place_id')))
         return make_response(jsonify({'message': 'Review '+ feedback +' success'}), 200)
     except Exception as e:
         return make_response(jsonify({'error': str(e)}), 500)
@@ -490,100 +1128,28 @@ def user_review_feedback():
 This endpoint adds a new place to the places collection.
 
 Implementation:
-It gets the place details from the front end.
+It gets the place details from the front end and validates them (see place_documents.py).
 Then it creates a new place in the places collection.
 '''
 @app.route('/api/add-place', methods=['POST'])
 @admin_required
 def add_place():
-    # Generate a unique place_id
-    while True:
-        place_id = places_collection.count_documents({}) + random.randint(1, 1000000)
-        if not places_collection.find_one({'place_id': place_id}):  # If the place_id is not already used
-            break
     try:
         data = request.get_json()
-        site_name = data.get('site_name')
-        summary = data.get('summary')
-        description = data.get('description')
-        location = data.get('location')
-        latitude = location.get('latitude')
-        longitude = location.get('longitude')
-        type = data.get('type', [])
-        tags = data.get('tags', [])
-        address = data.get('address')
-        address_1 = address.get('address_1')
-        address_2 = address.get('address_2')
-        address_3 = address.get('address_3')
-        postcode = address.get('postcode')
-        website = data.get('website', [])
-        email = data.get('email')
-        phone = data.get('phone')
-        categories = data.get('categories', [])
-        venue_description = data.get('venue_description')
-        all_weather = data.get('all_weather')
-        opening_times = data.get('opening_times')
-        accessibility = data.get('accessibility')
-        pet_friendly = data.get('pet_friendly')
-        parking = data.get('parking')
-        visit_time = data.get('visit_time')
-        uprn = data.get('uprn')
-        google_map_link = data.get('google_map_link')
-        walk_time_bus = data.get('walk_time_bus')
-        nearest_bus_stop = data.get('nearest_bus_stop')
-        walk_time_train = data.get('walk_time_train')
-        nearest_train_station = data.get('nearest_train_station')
-        directions = data.get('directions')
-        nearest_bus_service = data.get('nearest_bus_service')
-        image = data.get('image')
-        cost_free = data.get('cost_free')
-        cost_details = data.get('cost_details')
-        rating = float(data.get('rating'))
-        
+        try:
+            new_place = place_documents.build_place_document(data, None)
+        except ValueError as e:
+            return make_response(jsonify({'error': str(e)}), 400)
+
+        # Generate a unique place_id
+        place_id = new_place_id()
+        new_place['place_id'] = place_id
+        new_place['location_id'] = place_id
+
         # Create a new place in places collection
-        new_place = {
-            'site_name': site_name,
-            'place_id': place_id,
-            'location_id': place_id,
-            'summary': summary,
-            'description': description,
-            'location': {
-                'latitude': latitude,
-                'longitude': longitude,
-            },
-            'type': type,
-            'tags': tags,
-            'address': {
-                'address_1': address_1,
-                'address_2': address_2,
-                'address_3': address_3,
-                'postcode': postcode,
-            },
-            'website': website,
-            'email': email,
-            'phone': phone,
-            'categories': categories,
-            'venue_description': venue_description,
-            'all_weather': all_weather,
-            'opening_times': opening_times,
-            'accessibility': accessibility,
-            'pet_friendly': pet_friendly,
-            'parking': parking,
-            'visit_time': visit_time,
-            'uprn': uprn,
-            'google_map_link': google_map_link,
-            'walk_time_bus': walk_time_bus,
-            'nearest_bus_stop': nearest_bus_stop,
-            'walk_time_train': walk_time_train,
-            'nearest_train_station': nearest_train_station,
-            'directions': directions,
-            'nearest_bus_service': nearest_bus_service,
-            'image': image,
-            'cost_free': cost_free,
-            'cost_details': cost_details,
-            'rating': rating,
-        }
         places_collection.insert_one(new_place)
+        search_index.index_place(search_index_collection, new_place)
+        places_changed()
 
         return make_response(jsonify({'message': 'Place added successfully', 'place_id': place_id}), 201)
     except Exception as e:
@@ -600,14 +1166,103 @@ Then it deletes the place from the places collection by using the place_id.
 @admin_required
 def delete_place(place_id):
     try:
-        # Delete the place from places collection
+        # Delete the place from places collection and the search index
         places_collection.delete_one({"place_id": int(place_id)})
+        search_index.remove_place(search_index_collection, int(place_id))
+
+        # Reviews of a deleted place are no longer shown in the feeds.
+        review_details.delete_reviews(db, {"place_id": int(place_id)})
+        rating_aggregates.remove_place(db, int(place_id))
+        resource_versions.bump('reviews:' + str(int(place_id)))
+        places_changed()
 
         return make_response(jsonify({'message': 'Place deleted successfully'}), 200)
     except Exception as e:
         return make_response(jsonify({'error': str(e)}), 500)
 
 
+'''
+This endpoint imports places in bulk, e.g. to load the catalogue of a region.
+
+Implementation:
+It reads the request body as a stream of NDJSON (default) or CSV places, see place_import.py
+The places are validated like in add_place and written in batches, so the memory used stays
+constant however big the body is. New places get their ids in blocks from the id allocator.
+Returns the number of places inserted, updated and failed, with the error of every failed row.
+
+Usage: POST /api/import-places?format=csv
+'''
+@app.route('/api/import-places', methods=['POST'])
+@admin_required
+def import_places():
+    try:
+        format = request.args.get('format', 'ndjson')
+        if format not in place_import.READERS:
+            return make_response(jsonify({'error': 'format must be one of: ' + ', '.join(place_import.READERS)}), 400)
+
+        report = run_place_import(place_import.READERS[format](request.stream))
+        return make_response(jsonify(report.to_dict()), 200)
+    except Exception as e:
+        return make_response(jsonify({'error': str(e)}), 500)
+
+'''
+This function imports places and keeps the search index and the response cache up to date.
+It is shared by the import endpoint and command.
+'''
+def run_place_import(records):
+    def allocate_ids(count):
+        return id_allocator.next_ids('place_id', count, seed=max_place_id)
+
+    def on_batch(written, replaced):
+        search_index.index_places(search_index_collection, written)
+        # The reviews of the replaced places show their new names.
+        if replaced:
+            review_details.update_places(db, replaced)
+            resource_versions.bump(*['reviews:' + str(place['place_id']) for place in replaced])
+        # Places imported with their own place_id must not collide with the ids allocated later.
+        id_allocator.reserve_up_to('place_id', max(place['place_id'] for place in written), seed=max_place_id)
+
+    report = place_import.import_places(places_collection, records, allocate_ids, on_batch=on_batch)
+    if report.inserted or report.updated:
+        places_changed()
+    return report
+
+
+'''
+These endpoints export all reviews (with their user and place details) or all places.
+
+Implementation:
+The documents are streamed from the database cursor to the response in batches (see export.py),
+so the whole dataset is never held in memory and the client receives data right away.
+The format is NDJSON by default, or a JSON array with ?format=json.
+'''
+def export_response(cursor, name):
+    format = request.args.get('format', 'ndjson')
+    if format not in export.FORMATS:
+        return make_response(jsonify({'error': 'format must be one of: ' + ', '.join(export.FORMATS)}), 400)
+
+    response = Response(stream_with_context(export.CHUNKS[format](cursor)), mimetype=export.FORMATS[format])
+    response.headers['Content-Disposition'] = f'attachment; filename={name}.{format}'
+    return response
+
+@app.route('/api/export/reviews', methods=['GET'])
+@admin_required
+def export_reviews():
+    try:
+        return export_response(review_details_collection.find().batch_size(export.EXPORT_BATCH_SIZE), 'reviews')
+    except Exception as e:
+        return make_response(jsonify({'error': str(e)}), 500)
+
+@app.route('/api/export/places', methods=['GET'])
+@admin_required
+def export_places():
+    try:
+        places = places_collection.find({}, to_projection(None, hidden=HIDDEN_PLACE_FIELDS))
+        return export_response(places.batch_size(export.EXPORT_BATCH_SIZE), 'places')
+    except Exception as e:
+        return make_response(jsonify({'error': str(e)}), 500)
+
+
 ############################ Authentication Endpoints ############################
 
 '''
@@ -644,6 +1299,9 @@ def update_user_profile():
                 }
             })
         if result.matched_count > 0:
+            invalidate_user_cache(user_id)
+            review_details.update_user(db, user_id, fullname)
+            resource_versions.bump('users')
             return make_response(jsonify({'message': 'User updated successfully'}), 200)
         else:
             return make_response(jsonify({'message': 'No matching user found'}), 404)
@@ -671,15 +1329,16 @@ def change_password():
         # Check if the old password is correct
         user = users_collection.find_one({'user_id': user_id})
         if user is not None:
-            if bcrypt.checkpw(current_password.encode('utf-8'), user['password'].encode('utf-8')):
-                hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
+            if password_hasher.verify(current_password, user['password']):
+                hashed_password = password_hasher.hash(new_password)
                 result = users_collection.update_one({
                     "user_id": user_id}, 
                     {"$set": {
-                        "password": hashed_password.decode('utf-8')
+                        "password": hashed_password
                         }
                     })
                 if result.matched_count > 0:
+                    invalidate_user_cache(user_id)
                     return make_response(jsonify({'message': 'Password changed successfully'}), 200)
                 else:
                     return make_response(jsonify({'message': 'No matching user found'}), 404)
@@ -687,6 +1346,8 @@ def change_password():
                 return make_response(jsonify({'message': 'Password is incorrect'}), 401)
         else:
             return make_response(jsonify({'message': 'User not found'}), 404)
+    except PasswordPoolBusy as e:
+        return password_pool_busy_response(e)
     except Exception as e:
         return make_response(jsonify({'error': str(e)}), 500)
 
@@ -704,7 +1365,13 @@ We could also update the reviews collection to assign the reviews to a placehold
 def delete_user_account(user_id):
     try:
         users_collection.delete_one({"user_id": user_id})
+        invalidate_user_cache(user_id)
+        rating_aggregates.remove_user_reviews(db, user_id)
+        likes.remove_user(db, user_id)
+        likes.remove_reviews(db, reviews_collection.distinct("review_id", {"user_id": user_id}))
         reviews_collection.delete_many({"user_id": user_id})
+        review_details.delete_reviews(db, {"user_id": user_id})
+        resource_versions.bump('reviews', 'users')
         return make_response(jsonify({'message': 'User deleted successfully'}), 200)
     except Exception as e:
         return make_response(jsonify({'error': str(e)}), 500)
@@ -733,18 +1400,20 @@ def signup():
     if not password:
         return jsonify({'message': 'Password is required.'}), 400
 
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    try:
+        hashed_password = password_hasher.hash(password)
+    except PasswordPoolBusy as e:
+        return password_pool_busy_response(e)
 
     # Create a new user in users collection
     new_user = {
         'fullname': fullname,
-        'user_id' : 'u'+ str(users_collection.count_documents({}) + random.randint(1, 1000000)),
+        'user_id' : new_user_id(),
         'username': username,
         'role': role,
-        'password': hashed_password.decode('utf-8'),
+        'password': hashed_password,
         'email': email,
-        'profile_photo': profile_photo,
-        'liked_reviews': []
+        'profile_photo': profile_photo
     }
     result = users_collection.insert_one(new_user)
     return make_response(jsonify({'message': 'user created successfully!', 'user_id': str(result.inserted_id)}), 201)
@@ -756,6 +1425,7 @@ This endpoint logs in an existing user.
 Implementation:
 It checks if the username or email exists in the users collection.
 If the username or email exists, it checks if the password is correct. 
+If the stored hash does not use the current work factor (BCRYPT_ROUNDS), it is replaced with a new hash.
 '''
 @app.route('/api/login', methods=['POST'])
 def login():
@@ -769,9 +1439,13 @@ def login():
             user = users_collection.find_one({'email': username})
 
         if user is not None:
-            if bcrypt.checkpw(password.encode('utf-8'), user['password'].encode('utf-8')):
+            valid, new_hash = password_hasher.verify_and_rehash(password, user['password'])
+            if valid:
+                if new_hash is not None:
+                    users_collection.update_one({'_id': user['_id'], 'password': user['password']}, {'$set': {'password': new_hash}})
 
                 token = jwt.encode({
+                    'jti': uuid.uuid4().hex,  # Unique id of the token, used to revoke it
                     'id': str(user['_id']),  # Convert ObjectId to string
                     'user': user['username'],
                     'role': user['role'],
@@ -783,6 +1457,8 @@ def login():
                 return make_response(jsonify({'message': 'Password is incorrect'}), 401)
         else:
             return make_response(jsonify({'message': 'Username or email not found. Please check your credentials or sign up to create a new account.'}), 401)
+    except PasswordPoolBusy as e:
+        return password_pool_busy_response(e)
     except Exception as e:
         return make_response(jsonify({'error': str(e)}), 500)
 
@@ -790,36 +1466,33 @@ def login():
 This endpoint logs out a user.
 
 Implementation:
-It logs out a user by invalidating the token and adding to the blacklist collection.
-This way we can keep track of the invalidated tokens.
+It logs out a user by revoking the token, which adds it to the blacklist collection until it expires.
+jwt_required rejects revoked tokens from then on, see revocation.py
 '''
 @app.route('/api/logout', methods=['GET'])
 @jwt_required
 def logout():
     token = request.headers['x-access-token']
-    blacklist.insert_one({"token": token})
+    revoked_tokens.revoke(token, g.token_data)
+    token_cache.invalidate(token)
     return make_response(jsonify({'message': 'Logout successful'}),200)
 
 '''
 This endpoint retrieves and returns the logged in user details.
 
 Implementation:
-It gets the token from the headers and then decode and validates it.
-If valid, decode the token and get the user_id.
-Then fetch the user data from the users collection by using that user_id.
+The token has already been decoded and validated by jwt_required, which stores it in g.token_data.
+Then fetch the user data by using the user_id of the token, from the user cache if possible.
+The liked reviews are read from the likes collection, as they change with every like.
 '''
 @app.route('/api/logged-in-user', methods=['GET'])
 @jwt_required
 def get_logged_in_user():
     try:
-        token = request.headers.get('x-access-token')  #    Get the token from the headers
-
-        # Decode the token and get the user_id
-        data = jwt.decode(token, app.config ['SECRET_KEY'], algorithms=["HS256"])
-        user_id = data['id']
+        user_id = g.token_data['id']
 
-        # Fetch the user data from your database
-        user = users_collection.find_one({'_id':  ObjectId(user_id)})
+        # Fetch the user data from the cache or the database
+        user = get_cached_user(user_id)
 
         if user:
             # If the user exists, return their data
@@ -832,14 +1505,159 @@ def get_logged_in_user():
                 'role': user['role'],
                 'email': user['email'],
                 'profile_photo': user['profile_photo'],
-                'liked_reviews': user['liked_reviews'] if 'liked_reviews' in user else []
+                'liked_reviews': likes.liked_review_ids(db, user['user_id'])
             }), 200
         else:
             # If the user does not exist, return an     error
             return make_response(jsonify({'message': 'user not found'}), 404)
     except Exception as e:
         return make_response(jsonify({'error': str(e)}), 500)
+
+# Threads running the sub-requests of batches, see batch_requests.py
+batch_executor = ThreadPoolExecutor(max_workers=int(os.getenv('BATCH_WORKERS', 8)), thread_name_prefix='batch')
+
+'''
+This endpoint runs several GET requests at once, so a page can load everything it needs in one round trip.
+
+Implementation:
+It gets the sub-requests from the request body, e.g.
+{"requests": [{"id": "place", "path": "/api/place/1"}, {"id": "me", "path": "/api/logged-in-user"}]}
+Only the read-only endpoints of batch_requests.BATCH_ENDPOINTS can be called.
+The token is verified once here. The sub-requests carry the same token and find it in the token cache,
+so they only check that it has not been revoked.
+The sub-requests run concurrently and go through the same endpoints, caches and errors as separate requests.
+Returns {"responses": [{"id": ..., "status": ..., "body": ...}]} in the order of the sub-requests.
+A failing sub-request only has its own error status, the batch itself returns 200.
+'''
+@app.route('/api/batch', methods=['POST'])
+@jwt_required
+def run_batch():
+    try:
+        try:
+            items = batch_requests.parse_batch(request.get_json(silent=True), app.url_map)
+        except ValueError as e:
+            return make_response(jsonify({'error': str(e)}), 400)
+
+        headers = [(name, request.headers[name]) for name in batch_requests.FORWARDED_HEADERS if name in request.headers]
+        responses = batch_requests.run_batch(app, batch_executor, items, headers, request.host_url, request.environ)
+        return make_response(jsonify({'responses': responses}), 200)
+    except Exception as e:
+        return make_response(jsonify({'error': str(e)}), 500)
     
 
+############################ Maintenance Commands ############################
+
+'''
+This command rebuilds the places search index from the places collection.
+It is needed once for the existing places, add_place and delete_place keep it up to date afterwards.
+
+Usage: FLASK_APP=index.py flask rebuild-search-index
+'''
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    count = search_index.rebuild(search_index_collection, places_collection.find())
+    places_changed()
+    print(f'Indexed {count} places.')
+
+'''
+This command rebuilds the review read model from the reviews, users and places collections.
+The upgrade of the schema builds it once for the existing reviews, see upgrade_schema,
+and the endpoints keep it up to date afterwards. The command can fix any drift.
+
+Usage: FLASK_APP=index.py flask backfill-review-details
+'''
+@app.cli.command('backfill-review-details')
+def backfill_review_details_command():
+    count = review_details.rebuild(db)
+    resource_versions.bump('reviews')
+    print(f'Built the read model of {count} reviews.')
+
+'''
+This command converts the timestamps of existing reviews from strings to native datetimes, see migrate_review_timestamps.
+The schema upgrade runs it as well.
+
+Usage: FLASK_APP=index.py flask migrate-review-timestamps
+'''
+@app.cli.command('migrate-review-timestamps')
+def migrate_review_timestamps_command():
+    converted, invalid = migrate_review_timestamps()
+    resource_versions.bump('reviews')
+    print(f'Converted the timestamps of {converted} reviews.')
+    if invalid:
+        print(f'Set the invalid timestamps of {len(invalid)} reviews to null: {", ".join(invalid)}')
+
+'''
+This command rebuilds the rating aggregates of all places from their reviews.
+It is needed once for the existing reviews, and can be run again at any time to fix any drift.
+
+Usage: FLASK_APP=index.py flask reconcile-rating-aggregates
+'''
+@app.cli.command('reconcile-rating-aggregates')
+def reconcile_rating_aggregates_command():
+    count = rating_aggregates.rebuild(db)
+    resource_versions.bump('reviews')
+    print(f'Rebuilt the rating aggregates of {count} places.')
+
+'''
+This command moves the liked reviews stored in the user documents to the likes collection,
+and then sets the like count of every review to its number of likes.
+The upgrade of the schema to version 5 runs it once, see upgrade_schema. The command can fix any drift.
+
+Usage: FLASK_APP=index.py flask migrate-likes
+'''
+@app.cli.command('migrate-likes')
+def migrate_likes_command():
+    inserted = likes.migrate(db)
+    updated = likes.recount(db)
+    resource_versions.bump('reviews')
+    print(f'Migrated {inserted} likes and fixed the like count of {updated} reviews.')
+
+'''
+This command imports places in bulk from a NDJSON or CSV file, like the import endpoint.
+The format is taken from the file extension unless it is given.
+
+Usage: FLASK_APP=index.py flask import-places places.csv [--format csv]
+'''
+@app.cli.command('import-places')
+@click.argument('file', type=click.File('rb'))
+@click.option('--format', type=click.Choice(list(place_import.READERS)), default=None)
+def import_places_command(file, format):
+    format = format or ('csv' if file.name.endswith('.csv') else 'ndjson')
+    report = run_place_import(place_import.READERS[format](file))
+    print(f'Inserted {report.inserted}, updated {report.updated} and failed {report.failed} places.')
+    for error in report.errors:
+        print(f"Row {error['row']}: {error['error']}")
+
+'''
+This command adds the GeoJSON point used by the geospatial queries to the existing places.
+New places get it when they are added or imported.
+
+Usage: FLASK_APP=index.py flask migrate-place-locations
+'''
+@app.cli.command('migrate-place-locations')
+def migrate_place_locations_command():
+    count = geospatial.migrate(places_collection)
+    places_changed()
+    print(f'Added the location point of {count} places.')
+
+'''
+This command creates the indexes of all the collections, see ensure_indexes.
+It also runs the data migrations, see upgrade_schema. Deployments run it before switching traffic
+to a new version, unless AUTO_ENSURE_INDEXES is set.
+
+Usage: FLASK_APP=index.py flask ensure-indexes
+'''
+@app.cli.command('ensure-indexes')
+def ensure_indexes_command():
+    started = time.perf_counter()
+    upgrade_schema()
+    print(f'Indexes are up to date ({time.perf_counter() - started:.2f}s).')
+
+# Time taken to import the app, reported in /api/stats.
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+
+
+# Development server. In production the app runs under gunicorn, see gunicorn.conf.py
 if __name__ == '__main__':
+    ensure_schema()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,88 @@
+# JSON serialisation of the API responses.
+# The provider knows about the BSON types returned by pymongo, so the endpoints can return
+# documents as they come from the database without converting them first:
+# ObjectIds become strings, decimals become floats and datetimes become ISO 8601 strings (UTC).
+# The other types Flask knows about (decimal.Decimal, date, UUID, dataclasses) are converted like Flask does.
+#
+# orjson is used if it is installed, as it is several times faster than the json module.
+# Otherwise the provider falls back to the json module, set up to give the same output:
+# UTF-8 text rather than \u escapes, and null for NaN and infinite numbers.
+import datetime
+import json
+import math
+from bson import Decimal128, ObjectId
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+'''
+This function converts the types which JSON does not know about.
+BSON types are converted here, the others are left to Flask's default conversion.
+'''
+def bson_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        number = float(value.to_decimal())
+        return number if math.isfinite(number) else None
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(timespec='milliseconds') + 'Z'
+    return DefaultJSONProvider.default(value)
+
+if orjson is not None:
+    # Dates and dataclasses go through bson_default as well, so both encoders convert them the same way.
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+# orjson writes NaN and infinite numbers as null, the json module would write NaN and Infinity.
+def _finite(obj):
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    return obj
+
+def _json_dumps(obj):
+    try:
+        return json.dumps(obj, default=bson_default, separators=(',', ':'), ensure_ascii=False, allow_nan=False)
+    except ValueError:
+        # Only documents with a NaN or infinite number are walked through.
+        return json.dumps(_finite(obj), default=bson_default, separators=(',', ':'), ensure_ascii=False)
+
+'''
+This function serialises an object to JSON bytes.
+'''
+def dumps_bytes(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, default=bson_default, option=ORJSON_OPTIONS)
+    return _json_dumps(obj).encode('utf-8')
+
+'''
+This function serialises an object to a JSON string.
+'''
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, default=bson_default, option=ORJSON_OPTIONS).decode('utf-8')
+    return _json_dumps(obj)
+
+class BSONJSONProvider(DefaultJSONProvider):
+    # Used by jsonify and every other JSON response of the app.
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            kwargs.setdefault('default', bson_default)
+            return json.dumps(obj, **kwargs)
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    # Builds the response from the bytes directly, instead of encoding a string again.
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj) + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,145 @@
+# Write-behind buffer for the like counts of reviews.
+# When a review gets a burst of likes, every like would otherwise be its own $inc on the same
+# review document. The buffer adds the deltas up per review in memory and a background thread
+# writes them with a single bulk_write every flush interval, so a burst of likes becomes one update.
+# The buffer is also flushed when the process exits.
+#
+# Like counts are eventually consistent in this mode: they show up after at most one flush interval.
+# The deltas of the updates which failed are kept per collection and retried with the next flush.
+import atexit
+import logging
+import os
+import threading
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+# Collections holding the like count of a review: the reviews and their read model.
+COLLECTIONS = ('Reviews', 'ReviewDetails')
+
+class LikeCounterBuffer:
+    def __init__(self, db, flush_interval=1.0, max_pending=1000, on_flush=None, logger=None):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.on_flush = on_flush
+        self.logger = logger or logging.getLogger(__name__)
+        self.received = 0
+        self.written = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self._pending = {}
+        self._pending_adds = 0
+        self._failed = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.flush)
+
+    # Starts the flush thread, again after a fork as threads do not survive it.
+    def _ensure_thread(self):
+        if self._pid != os.getpid():
+            # Deltas buffered by the parent process are flushed by the parent.
+            self._pending = {}
+            self._pending_adds = 0
+            self._failed = {}
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='like-counter-flush', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.logger.exception('Could not flush the like counts')
+
+    '''
+    This function buffers a change of the like count of a review.
+    If too many reviews are pending, the flush thread is woken up early.
+    '''
+    def add(self, review_id, delta):
+        with self._lock:
+            self._ensure_thread()
+            self._pending[review_id] = self._pending.get(review_id, 0) + delta
+            self.received += 1
+            self._pending_adds += 1
+            if len(self._pending) >= self.max_pending:
+                self._wakeup.set()
+
+    '''
+    This function writes the buffered deltas to the reviews and their read model with one bulk write each.
+    Deltas which cancel out (a like and an unlike) are not written at all.
+
+    Implementation:
+    Both collections get the same deltas, plus the deltas which failed for that collection in earlier flushes.
+    The updates are unordered, so a failing update does not stop the others. Only the deltas of the
+    failed updates are kept for the next flush, the ones written are not written twice.
+    '''
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                adds, self._pending_adds = self._pending_adds, 0
+            deltas = {review_id: delta for review_id, delta in pending.items() if delta != 0}
+            self.coalesced += adds - len(deltas)
+
+            changed = {}
+            for name in COLLECTIONS:
+                batch = dict(deltas)
+                for review_id, delta in self._failed.pop(name, {}).items():
+                    batch[review_id] = batch.get(review_id, 0) + delta
+                review_ids = [review_id for review_id, delta in batch.items() if delta != 0]
+                if not review_ids:
+                    continue
+                failed = self._write(name, [UpdateOne({'review_id': review_id}, {'$inc': {'likes': batch[review_id]}})
+                                            for review_id in review_ids])
+                if failed:
+                    self._failed[name] = {review_ids[index]: batch[review_ids[index]] for index in failed}
+                for index, review_id in enumerate(review_ids):
+                    if index not in failed:
+                        changed[review_id] = True
+                self.written += len(review_ids) - len(failed)
+
+            if changed:
+                self.flushes += 1
+                if self.on_flush is not None:
+                    self.on_flush(list(changed))
+
+    '''
+    This function runs the updates of a collection.
+    Returns the set of the indexes of the updates which failed.
+    A bulk write error lists the updates which failed, any other error fails all of them.
+    '''
+    def _write(self, name, updates):
+        try:
+            self.db[name].bulk_write(updates, ordered=False)
+            return set()
+        except BulkWriteError as e:
+            error = e
+            failed = {write_error['index'] for write_error in e.details.get('writeErrors', [])}
+        except PyMongoError as e:
+            error = e
+            failed = set(range(len(updates)))
+        if failed:
+            self.logger.error('Could not write %d of %d like counts to %s, they are retried with the next flush: %s',
+                              len(failed), len(updates), name, error)
+        return failed
+
+    '''
+    This function returns the counters of the buffer.
+    coalesced is the number of like count updates saved by buffering.
+    '''
+    def stats(self):
+        return {
+            'flush_interval': self.flush_interval,
+            'pending': len(self._pending),
+            'failed': sum(len(deltas) for deltas in self._failed.values()),
+            'received': self.received,
+            'written': self.written,
+            'coalesced': self.coalesced,
+            'flushes': self.flushes,
+        }
@@ -0,0 +1,157 @@
+# Likes of reviews.
+# Every like is a document of the Likes collection, with a unique index on (user_id, review_id).
+# Liking is a single insert and unliking a single delete, so two concurrent clicks can never
+# count twice: only one of them changes the collection, and only that one updates the like count.
+# This also keeps the liked reviews out of the user documents, which would otherwise grow forever.
+# Without the unique index a double click would count twice, so the app creates it before its
+# first request (see ensure_schema in index.py).
+import datetime
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from pagination import decode_cursor, encode_cursor, keyset_filter
+
+LIKES_COLLECTION = 'Likes'
+
+# Order of the liked reviews of a user: most recently liked first.
+LIKE_SORT_ORDER = [('created_at', -1), ('review_id', 1)]
+
+'''
+This function creates the indexes of the likes collection.
+The (user_id, review_id) index also serves the liked review ids of a user without reading the documents,
+and the (user_id, created_at, review_id) index serves the pages of liked reviews.
+'''
+def create_indexes(collection):
+    collection.create_index([('user_id', 1), ('review_id', 1)], unique=True)
+    collection.create_index([('user_id', 1), ('created_at', -1), ('review_id', 1)])
+    collection.create_index([('review_id', 1)])
+
+'''
+This function likes a review.
+Returns True if the like was added, False if the user already liked the review.
+'''
+def like(db, user_id, review_id):
+    try:
+        db[LIKES_COLLECTION].insert_one({'user_id': user_id, 'review_id': review_id, 'created_at': datetime.datetime.utcnow()})
+        return True
+    except DuplicateKeyError:
+        return False
+
+'''
+This function removes the like of a review.
+Returns True if the like was removed, False if the user did not like the review.
+'''
+def unlike(db, user_id, review_id):
+    return db[LIKES_COLLECTION].delete_one({'user_id': user_id, 'review_id': review_id}).deleted_count == 1
+
+'''
+This function returns the ids of all reviews liked by a user.
+'''
+def liked_review_ids(db, user_id):
+    return [like['review_id'] for like in db[LIKES_COLLECTION].find({'user_id': user_id}, {'_id': 0, 'review_id': 1})]
+
+'''
+This function returns the reviews liked by a user, most recently liked first.
+The reviews are read from the review read model (ReviewDetails), with the given projection.
+
+Implementation:
+The likes of the user are read in LIKE_SORT_ORDER from their index, starting after the cursor,
+and each like is joined with its review by a $lookup on the unique review_id index.
+So a page costs the same whatever the number of likes of the user, and their review ids
+are never sent back to the database as a $in list.
+One like more than the limit is read to know whether there is a next page. The cursor is the
+sort key of the last like of the page. Likes of reviews which no longer exist are skipped.
+
+Returns a tuple of (reviews, next_cursor). If limit is None, every liked review is returned and next_cursor is None.
+'''
+def liked_reviews(db, user_id, limit=None, after=None, projection=None):
+    query = {'user_id': user_id}
+    if after:
+        query = {'$and': [query, keyset_filter(LIKE_SORT_ORDER, decode_cursor(after, len(LIKE_SORT_ORDER)))]}
+
+    pipeline = [{'$match': query}, {'$sort': dict(LIKE_SORT_ORDER)}]
+    if limit is not None:
+        pipeline.append({'$limit': limit + 1})
+    pipeline += [
+        {'$lookup': {'from': 'ReviewDetails', 'localField': 'review_id', 'foreignField': 'review_id', 'as': 'review'}},
+        {'$unwind': {'path': '$review', 'preserveNullAndEmptyArrays': True}},
+        {'$project': _review_projection(projection)},
+    ]
+    found = list(db[LIKES_COLLECTION].aggregate(pipeline))
+
+    next_cursor = None
+    if limit is not None and len(found) > limit:
+        found = found[:limit]
+        next_cursor = encode_cursor([found[-1].get(field) for field, _ in LIKE_SORT_ORDER])
+    return [like['review'] for like in found if 'review' in like], next_cursor
+
+# Returns the projection of the joined likes, keeping the sort keys of the likes and the projected review fields.
+def _review_projection(projection):
+    fields = {'_id': 0, 'created_at': 1, 'review_id': 1}
+    if projection is None:
+        fields['review'] = 1
+        return fields
+    fields.update({'review.' + field: 1 for field, include in projection.items() if include and field != '_id'})
+    if projection.get('_id', 1):
+        fields['review._id'] = 1
+    return fields
+
+'''
+This function returns which of the given reviews are liked by a user.
+'''
+def liked_among(db, user_id, review_ids):
+    return {like['review_id'] for like in db[LIKES_COLLECTION].find(
+        {'user_id': user_id, 'review_id': {'$in': review_ids}}, {'_id': 0, 'review_id': 1})}
+
+'''
+This function removes the likes of the given reviews, e.g. when they are deleted.
+'''
+def remove_reviews(db, review_ids):
+    db[LIKES_COLLECTION].delete_many({'review_id': {'$in': review_ids}})
+
+'''
+This function removes the likes of a user, e.g. when their account is deleted.
+The like counts of the reviews they liked are decremented accordingly.
+'''
+def remove_user(db, user_id):
+    review_ids = liked_review_ids(db, user_id)
+    db[LIKES_COLLECTION].delete_many({'user_id': user_id})
+    if review_ids:
+        for collection in ('Reviews', 'ReviewDetails'):
+            db[collection].update_many({'review_id': {'$in': review_ids}}, {'$inc': {'likes': -1}})
+
+'''
+This function moves the liked reviews stored in the user documents to the likes collection.
+
+Implementation:
+It inserts a like for every entry of the liked_reviews arrays, skipping the ones already migrated,
+and then removes the arrays from the user documents.
+Returns the number of likes inserted.
+'''
+def migrate(db):
+    inserted = 0
+    for user in db['Users'].find({'liked_reviews.0': {'$exists': True}}, {'user_id': 1, 'liked_reviews': 1}):
+        updates = [UpdateOne(
+            {'user_id': user['user_id'], 'review_id': review_id},
+            {'$setOnInsert': {'created_at': datetime.datetime.utcnow()}},
+            upsert=True) for review_id in set(user['liked_reviews'])]
+        inserted += db[LIKES_COLLECTION].bulk_write(updates, ordered=False).upserted_count
+    db['Users'].update_many({'liked_reviews': {'$exists': True}}, {'$unset': {'liked_reviews': ''}})
+    return inserted
+
+'''
+This function sets the like count of every review to its number of likes.
+It fixes counts which drifted before likes had their own collection.
+Returns the number of reviews updated.
+'''
+def recount(db):
+    counts = {count['_id']: count['likes'] for count in db[LIKES_COLLECTION].aggregate([
+        {'$group': {'_id': '$review_id', 'likes': {'$sum': 1}}}
+    ])}
+    updated = 0
+    for review in db['Reviews'].find({}, {'review_id': 1, 'likes': 1}):
+        likes = counts.get(review['review_id'], 0)
+        if review.get('likes') != likes:
+            db['Reviews'].update_one({'_id': review['_id']}, {'$set': {'likes': likes}})
+            db['ReviewDetails'].update_one({'review_id': review['review_id']}, {'$set': {'likes': likes}})
+            updated += 1
+    return updated
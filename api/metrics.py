@@ -0,0 +1,220 @@
+# Request instrumentation.
+# When enabled, every request records its latency, response size, the MongoDB commands it ran
+# (through pymongo command monitoring) and the time spent serialising the response.
+# The numbers are kept per route in histograms, exposed in the Prometheus text format,
+# and requests slower than a threshold are logged with the list of their commands.
+#
+# When disabled, nothing is registered: no listener, no request hooks, so there is no overhead.
+# The metrics are kept per worker process; Prometheus adds the workers up when scraping each of them.
+#
+# The sub-requests of a batch (see batch_requests.py) are not counted as requests of their own:
+# their commands and serialisation time add up to the batch request, which is the one the client sent.
+import threading
+import time
+from flask import Response, g, has_request_context, request
+from pymongo import monitoring
+from batch_requests import PARENT_ENVIRON_KEY
+
+# Key of the WSGI environment holding the metrics of the request, so its sub-requests can find them.
+STATE_ENVIRON_KEY = 'metrics.request'
+
+# Upper bounds of the latency buckets, in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the response size buckets, in bytes.
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+# Maximum number of commands kept per request for the slow request log.
+MAX_LOGGED_COMMANDS = 50
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+
+    # Records a value for the given label values. The caller holds the lock of the metrics.
+    def observe(self, label_values, value):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series['buckets'][index] += 1
+                break
+        series['sum'] += value
+        series['count'] += 1
+
+    # Prometheus buckets are cumulative, the last one (+Inf) counts every value.
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for label_values, series in sorted(self.series.items()):
+            labels = _labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip(self.buckets, series['buckets']):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {series["count"]}')
+            lines.append(f'{self.name}_sum{{{labels}}} {series["sum"]}')
+            lines.append(f'{self.name}_count{{{labels}}} {series["count"]}')
+        return lines
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for label_values, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{{{_labels(self.labels, label_values)}}} {value}')
+        return lines
+
+# Formats the labels of a series, e.g. route="/api/places",method="GET"
+def _labels(names, values):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+'''
+This class records the MongoDB commands run by the current request.
+pymongo calls it on the thread running the command, which is the thread of the request.
+Commands run outside of a request (e.g. by the like counter flush thread) are not recorded.
+'''
+class CommandRecorder(monitoring.CommandListener):
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def _state(self):
+        return g.get('request_metrics') if has_request_context() else None
+
+    def started(self, event):
+        state = self._state()
+        if state is not None:
+            state['pending'][event.request_id] = event.command.get(event.command_name)
+
+    def succeeded(self, event):
+        self._finished(event, 'ok')
+
+    def failed(self, event):
+        self._finished(event, 'error')
+
+    def _finished(self, event, outcome):
+        state = self._state()
+        if state is None:
+            return
+        collection = state['pending'].pop(event.request_id, None)
+        seconds = event.duration_micros / 1e6
+        # The sub-requests of a batch share its state from several threads.
+        with self.metrics._lock:
+            state['db_seconds'] += seconds
+            state['commands'] += 1
+            if len(state['log']) < MAX_LOGGED_COMMANDS:
+                state['log'].append(f'{event.command_name} {collection} {seconds * 1000:.1f}ms {outcome}')
+            self.metrics.commands.observe((event.command_name, outcome), seconds)
+
+class Metrics:
+    def __init__(self, slow_request_seconds=1.0):
+        self.slow_request_seconds = slow_request_seconds
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.request_latency = Histogram('http_request_duration_seconds', 'Latency of the requests.',
+                                         ('route', 'method'), LATENCY_BUCKETS)
+        self.request_db = Histogram('http_request_db_duration_seconds', 'Time spent in MongoDB commands per request.',
+                                    ('route', 'method'), LATENCY_BUCKETS)
+        self.request_serialize = Histogram('http_request_serialize_duration_seconds', 'Time spent serialising the JSON response.',
+                                           ('route', 'method'), LATENCY_BUCKETS)
+        self.response_size = Histogram('http_response_size_bytes', 'Size of the response bodies.',
+                                       ('route', 'method'), SIZE_BUCKETS)
+        self.requests = Counter('http_requests_total', 'Requests by status code.', ('route', 'method', 'status'))
+        self.request_commands = Counter('http_request_mongodb_commands_total', 'MongoDB commands run by the requests.',
+                                        ('route', 'method'))
+        self.commands = Histogram('mongodb_command_duration_seconds', 'Latency of the MongoDB commands.',
+                                  ('command', 'outcome'), LATENCY_BUCKETS)
+        self.slow_requests = Counter('http_slow_requests_total', 'Requests slower than the slow request threshold.',
+                                     ('route', 'method'))
+
+    '''
+    This function enables the metrics for the app.
+
+    Implementation:
+    It registers the command listener with pymongo, which applies to the clients created afterwards
+    (the client of the app is created lazily, see database.py).
+    It adds request hooks to time the requests, and wraps the JSON provider to time the serialisation.
+    '''
+    def init_app(self, app):
+        self.enabled = True
+        self.logger = app.logger
+        monitoring.register(CommandRecorder(self))
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+        respond = app.json.response
+        def timed_response(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return respond(*args, **kwargs)
+            finally:
+                state = g.get('request_metrics')
+                if state is not None:
+                    with self._lock:
+                        state['serialize_seconds'] += time.perf_counter() - started
+        app.json.response = timed_response
+
+    # A sub-request of a batch records into the state of the batch request instead of its own.
+    def _before_request(self):
+        parent = request.environ.get(PARENT_ENVIRON_KEY)
+        if parent is not None and parent.get(STATE_ENVIRON_KEY) is not None:
+            g.request_metrics = parent[STATE_ENVIRON_KEY]
+            g.batch_sub_request = True
+            return
+        g.request_metrics = request.environ[STATE_ENVIRON_KEY] = {
+            'started': time.perf_counter(), 'pending': {}, 'log': [], 'commands': 0,
+            'db_seconds': 0.0, 'serialize_seconds': 0.0}
+
+    def _after_request(self, response):
+        state = g.get('request_metrics')
+        if state is None or g.get('batch_sub_request'):
+            return response
+        seconds = time.perf_counter() - state['started']
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        labels = (route, request.method)
+        # Streamed responses (e.g. the exports) have no length until they are sent.
+        size = response.calculate_content_length() if not response.is_streamed else None
+
+        with self._lock:
+            self.request_latency.observe(labels, seconds)
+            self.request_db.observe(labels, state['db_seconds'])
+            self.request_serialize.observe(labels, state['serialize_seconds'])
+            if size is not None:
+                self.response_size.observe(labels, size)
+            self.requests.inc(labels + (response.status_code,))
+            self.request_commands.inc(labels, state['commands'])
+            if seconds >= self.slow_request_seconds:
+                self.slow_requests.inc(labels)
+
+        if seconds >= self.slow_request_seconds:
+            self.logger.warning('Slow request %s %s: %.0fms, %d MongoDB commands in %.0fms, serialised in %.0fms\n  %s',
+                                request.method, request.full_path, seconds * 1000, state['commands'],
+                                state['db_seconds'] * 1000, state['serialize_seconds'] * 1000, '\n  '.join(state['log']))
+        return response
+
+    # Returns all the metrics in the Prometheus text format.
+    def render(self):
+        with self._lock:
+            lines = []
+            for metric in (self.requests, self.request_latency, self.request_db, self.request_serialize,
+                           self.response_size, self.request_commands, self.slow_requests, self.commands):
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def response(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
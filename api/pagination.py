@@ -0,0 +1,131 @@
+# Helpers for keyset (cursor based) pagination.
+# Instead of skip/offset, every page remembers the sort key of its last document
+# and the next page starts strictly after it. This lets MongoDB walk an index
+# from that point onwards, so the cost of a page does not grow with its position.
+import base64
+import datetime
+import json
+import math
+
+# Default and maximum page sizes for paginated endpoints.
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+'''
+This function parses the limit query parameter.
+
+Implementation:
+If no limit is provided, it returns the default page size.
+If the limit is not a positive integer, it raises a ValueError.
+Limits bigger than the maximum page size are capped.
+'''
+def parse_limit(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    if value is None or value == '':
+        return default
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('limit must be a positive integer')
+    return min(limit, maximum)
+
+# JSON does not know about datetimes, so we tag them while encoding the cursor.
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'$date': value.isoformat()}
+    return value
+
+# The values of a cursor come from the client and end up in a query, so only plain values are accepted.
+# Anything else, e.g. {"$ne": null}, would be read by MongoDB as a query operator.
+def _decode_value(value):
+    if isinstance(value, dict):
+        if list(value) != ['$date'] or not isinstance(value['$date'], str):
+            raise ValueError('Invalid cursor')
+        try:
+            return datetime.datetime.fromisoformat(value['$date'])
+        except ValueError:
+            raise ValueError('Invalid cursor')
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ValueError('Invalid cursor')
+    if value is not None and not isinstance(value, (str, int, float, bool)):
+        raise ValueError('Invalid cursor')
+    return value
+
+'''
+This function encodes the sort key values of the last document of a page into an opaque token.
+The token is url safe so it can be passed back as the "after" query parameter.
+'''
+def encode_cursor(values):
+    payload = json.dumps([_encode_value(value) for value in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+'''
+This function decodes a token created by encode_cursor back into sort key values.
+It raises a ValueError if the token is malformed or holds anything but strings, numbers, booleans, null and dates.
+'''
+def decode_cursor(token, size):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Invalid cursor')
+    return [_decode_value(value) for value in values]
+
+'''
+This function builds the filter that selects the documents after the given sort key values.
+
+Implementation:
+For a sort order of [(a, 1), (b, -1)] and values (x, y), it builds
+{"$or": [{a: {"$gt": x}}, {a: x, b: {"$lt": y}}]}
+The last key of the sort order must be unique, so that no two documents share the same position.
+
+Null and missing values sort before any other value, but MongoDB only compares values of the same type,
+so {a: {"$lt": 4}} never matches a null. In descending order, the nulls come after every other value,
+so they are added with {"$or": [{a: {"$lt": x}}, {a: null}]}. After a null value, ascending order
+continues with every value which is not null, and descending order has nothing left for that key.
+'''
+def keyset_filter(sort_order, values):
+    clauses = []
+    for position, (field, direction) in enumerate(sort_order):
+        clause = {prefix_field: values[index] for index, (prefix_field, _) in enumerate(sort_order[:position])}
+        value = values[position]
+        if value is None:
+            if direction == -1:
+                continue
+            clause[field] = {'$ne': None}
+        elif direction == 1:
+            clause[field] = {'$gt': value}
+        else:
+            clause['$or'] = [{field: {'$lt': value}}, {field: None}]
+        clauses.append(clause)
+    return clauses[0] if len(clauses) == 1 else {'$or': clauses}
+
+'''
+This function returns the sort key values of a document for the given sort order.
+Nested fields (e.g. "user.fullname") are not supported as they are not used as sort keys.
+'''
+def cursor_values(document, sort_order):
+    return [document.get(field) for field, _ in sort_order]
+
+'''
+This function runs a paginated find query.
+
+Implementation:
+It combines the query with the keyset filter (if a cursor is provided),
+sorts by the given sort order and fetches one document more than the page size.
+If that extra document exists, there is a next page and a cursor for it is returned.
+
+Returns a tuple of (documents, next_cursor). next_cursor is None on the last page.
+'''
+def paginate(collection, query, sort_order, limit, after=None, projection=None):
+    if after:
+        values = decode_cursor(after, len(sort_order))
+        query = {'$and': [query, keyset_filter(sort_order, values)]} if query else keyset_filter(sort_order, values)
+
+    documents = list(collection.find(query, projection).sort(sort_order).limit(limit + 1))
+
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_cursor = encode_cursor(cursor_values(documents[-1], sort_order))
+    return documents, next_cursor
@@ -0,0 +1,174 @@
+# Password hashing and verification.
+# bcrypt is slow on purpose, a hash takes tens of milliseconds of CPU. Run on the request threads,
+# a burst of logins would hold up every other request of the worker. Instead, the bcrypt work runs in
+# a small pool of processes of its own, and the requests only wait for their result.
+#
+# The pool is bounded: at most max_workers hashes run at once and at most max_pending more wait.
+# When both are full, new requests are rejected right away with PasswordPoolBusy, so the endpoint
+# can answer 503 instead of piling up requests which would all time out anyway.
+# A request which times out gets PasswordPoolBusy too. Its work keeps its slot until it is cancelled
+# or finished, so requests given up on still count towards the bound.
+#
+# The pool processes are forked from a fork server rather than from the app, as forking a process
+# running threads (e.g. the ones of the MongoDB client) is not safe. Platforms without a fork server
+# spawn them. Either way they import the main module again, so it must guard its entry point
+# with if __name__ == '__main__', like index.py does.
+import multiprocessing
+import os
+import threading
+import concurrent.futures
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+
+# Default work factor of new hashes, 2^rounds iterations.
+DEFAULT_ROUNDS = 12
+
+'''
+This function returns the multiprocessing context of the pool.
+The fork server imports this module (and bcrypt) once, the pool processes are forked from it.
+'''
+def _pool_context():
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context('spawn')
+
+class PasswordPoolBusy(Exception):
+    pass
+
+# The functions below run in the pool processes.
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+def _verify(password, hashed):
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+# Verifies a password, and hashes it again if the stored hash does not use the current work factor.
+def _verify_and_rehash(password, hashed, rounds):
+    if not _verify(password, hashed):
+        return False, None
+    if hash_rounds(hashed) != rounds:
+        return True, _hash(password, rounds)
+    return True, None
+
+'''
+This function returns the work factor of a bcrypt hash, e.g. 12 for "$2b$12$...".
+Returns None if the hash is not a bcrypt hash.
+'''
+def hash_rounds(hashed):
+    parts = hashed.split('$')
+    try:
+        return int(parts[2])
+    except (IndexError, ValueError):
+        return None
+
+class PasswordHasher:
+    '''
+    rounds - work factor of new hashes
+    max_workers - number of pool processes, 0 runs bcrypt on the calling thread (e.g. for tests)
+    max_pending - number of requests which can wait for a free process
+    timeout - seconds to wait for the result of a request
+    '''
+    def __init__(self, rounds=DEFAULT_ROUNDS, max_workers=2, max_pending=32, timeout=10):
+        self.rounds = rounds
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.rehashed = 0
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending) if max_workers else None
+
+    # Creates the pool on first use, and again in a forked worker as the processes belong to the parent.
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=_pool_context())
+                self._pid = os.getpid()
+            return self._executor
+
+    '''
+    This function runs a function in the pool and waits for its result.
+
+    Implementation:
+    Every request takes a slot for as long as its work runs or waits in the pool.
+    If no slot is free, the pool is saturated and PasswordPoolBusy is raised without waiting.
+    The slot is released when the work is done, not when the request stops waiting for it.
+    So after a timeout the work is cancelled if it has not started, and otherwise keeps its slot until it finishes.
+    A pool broken by a crashed process is replaced for the next request.
+    '''
+    def _run(self, function, *args):
+        if self._slots is None:
+            result = function(*args)
+            self.completed += 1
+            return result
+
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PasswordPoolBusy('Too many password requests, try again later')
+        executor = None
+        try:
+            executor = self._get_executor()
+            future = executor.submit(function, *args)
+        except BaseException as e:
+            self._slots.release()
+            self._discard_if_broken(executor, e)
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            result = future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            self.timed_out += 1
+            raise PasswordPoolBusy('The password request timed out, try again later')
+        except BrokenProcessPool as e:
+            self._discard_if_broken(executor, e)
+            raise
+        self.completed += 1
+        return result
+
+    # Drops a pool broken by a crashed process, so the next request creates a new one.
+    def _discard_if_broken(self, executor, error):
+        if isinstance(error, BrokenProcessPool):
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+
+    # Returns the bcrypt hash of a password, as a string.
+    def hash(self, password):
+        return self._run(_hash, password, self.rounds)
+
+    # Returns whether a password matches a hash.
+    def verify(self, password, hashed):
+        return self._run(_verify, password, hashed)
+
+    '''
+    This function checks a password at login.
+    Returns a tuple of (valid, new_hash). new_hash is only set when the stored hash uses another
+    work factor than the current one, so the caller can store it and upgrade (or downgrade) the hash.
+    Both happen in a single round trip to the pool.
+    '''
+    def verify_and_rehash(self, password, hashed):
+        valid, new_hash = self._run(_verify_and_rehash, password, hashed, self.rounds)
+        if new_hash is not None:
+            self.rehashed += 1
+        return valid, new_hash
+
+    def stats(self):
+        return {
+            'rounds': self.rounds,
+            'max_workers': self.max_workers,
+            'max_pending': self.max_pending,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+            'rehashed': self.rehashed,
+        }
@@ -0,0 +1,139 @@
+# The place documents of the places collection.
+# add_place and the bulk import both build places with build_place_document,
+# so every place has the same fields, whichever way it was created.
+import geospatial
+import rating_aggregates
+
+# Fields a client can provide for a place. place_id and location_id are assigned by the server.
+PLACE_FIELDS = (
+    'site_name', 'summary', 'description', 'location', 'type', 'tags', 'address', 'website', 'email',
+    'phone', 'categories', 'venue_description', 'all_weather', 'opening_times', 'accessibility',
+    'pet_friendly', 'parking', 'visit_time', 'uprn', 'google_map_link', 'walk_time_bus', 'nearest_bus_stop',
+    'walk_time_train', 'nearest_train_station', 'directions', 'nearest_bus_service', 'image', 'cost_free',
+    'cost_details', 'rating',
+)
+
+# Fields holding lists of strings.
+LIST_FIELDS = ('type', 'tags', 'website', 'categories')
+
+'''
+This function validates the place details sent by a client.
+If strict is True, fields which are not part of a place are rejected as well,
+and a place_id, which the imports accept, must be a positive integer.
+It raises a ValueError describing the first problem found.
+'''
+def validate_place(data, strict=False):
+    if not isinstance(data, dict):
+        raise ValueError('A place must be an object')
+    if not data.get('site_name'):
+        raise ValueError('site_name is required')
+    if not isinstance(data.get('location'), dict):
+        raise ValueError('location must be an object with latitude and longitude')
+    if not isinstance(data.get('address'), dict):
+        raise ValueError('address must be an object')
+    # Same range as the ratings of the reviews, so "nan", "inf" or 11 are rejected.
+    rating_aggregates.validate_rating(data.get('rating'))
+    for field in LIST_FIELDS:
+        if data.get(field) is not None and not isinstance(data.get(field), list):
+            raise ValueError(f'{field} must be a list')
+    if strict:
+        unknown = sorted(set(data) - set(PLACE_FIELDS) - {'place_id'})
+        if unknown:
+            raise ValueError('Unknown fields: ' + ', '.join(unknown))
+        place_id = data.get('place_id')
+        # bool is a subclass of int, but true is not a place_id.
+        if place_id is not None and (not isinstance(place_id, int) or isinstance(place_id, bool) or place_id <= 0):
+            raise ValueError('place_id must be a positive integer')
+
+'''
+This function builds a place document from the place details sent by a client.
+It raises a ValueError if the details are not valid, see validate_place.
+'''
+def build_place_document(data, place_id, strict=False):
+    validate_place(data, strict)
+    site_name = data.get('site_name')
+    summary = data.get('summary')
+    description = data.get('description')
+    location = data.get('location')
+    latitude = location.get('latitude')
+    longitude = location.get('longitude')
+    type = data.get('type', [])
+    tags = data.get('tags', [])
+    address = data.get('address')
+    address_1 = address.get('address_1')
+    address_2 = address.get('address_2')
+    address_3 = address.get('address_3')
+    postcode = address.get('postcode')
+    website = data.get('website', [])
+    email = data.get('email')
+    phone = data.get('phone')
+    categories = data.get('categories', [])
+    venue_description = data.get('venue_description')
+    all_weather = data.get('all_weather')
+    opening_times = data.get('opening_times')
+    accessibility = data.get('accessibility')
+    pet_friendly = data.get('pet_friendly')
+    parking = data.get('parking')
+    visit_time = data.get('visit_time')
+    uprn = data.get('uprn')
+    google_map_link = data.get('google_map_link')
+    walk_time_bus = data.get('walk_time_bus')
+    nearest_bus_stop = data.get('nearest_bus_stop')
+    walk_time_train = data.get('walk_time_train')
+    nearest_train_station = data.get('nearest_train_station')
+    directions = data.get('directions')
+    nearest_bus_service = data.get('nearest_bus_service')
+    image = data.get('image')
+    cost_free = data.get('cost_free')
+    cost_details = data.get('cost_details')
+    rating = float(data.get('rating'))
+
+    place = {
+        'site_name': site_name,
+        'place_id': place_id,
+        'location_id': place_id,
+        'summary': summary,
+        'description': description,
+        'location': {
+            'latitude': latitude,
+            'longitude': longitude,
+        },
+        'type': type,
+        'tags': tags,
+        'address': {
+            'address_1': address_1,
+            'address_2': address_2,
+            'address_3': address_3,
+            'postcode': postcode,
+        },
+        'website': website,
+        'email': email,
+        'phone': phone,
+        'categories': categories,
+        'venue_description': venue_description,
+        'all_weather': all_weather,
+        'opening_times': opening_times,
+        'accessibility': accessibility,
+        'pet_friendly': pet_friendly,
+        'parking': parking,
+        'visit_time': visit_time,
+        'uprn': uprn,
+        'google_map_link': google_map_link,
+        'walk_time_bus': walk_time_bus,
+        'nearest_bus_stop': nearest_bus_stop,
+        'walk_time_train': walk_time_train,
+        'nearest_train_station': nearest_train_station,
+        'directions': directions,
+        'nearest_bus_service': nearest_bus_service,
+        'image': image,
+        'cost_free': cost_free,
+        'cost_details': cost_details,
+        'rating': rating,
+    }
+
+    # GeoJSON point of the location, used by the geospatial queries (see geospatial.py).
+    # Places without valid coordinates are stored without it.
+    geo = geospatial.point(latitude, longitude)
+    if geo is not None:
+        place['geo'] = geo
+    return place
@@ -0,0 +1,188 @@
+# Bulk import of places from NDJSON or CSV.
+# The input is read one record at a time and written in batches, so the memory used does not
+# depend on the size of the input. Every record is validated like a place sent to add_place.
+# Records are reported back by row number, with the error of every row which was not imported.
+#
+# NDJSON: one place per line, in the same format as the body of add_place.
+# CSV: one place per row. Nested fields use dotted column names (e.g. location.latitude,
+# address.postcode) and list fields (e.g. categories) separate their items with "|".
+#
+# Records with a place_id replace (or create) that place; the others get a new place_id.
+import csv
+import io
+import json
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+from place_documents import LIST_FIELDS, build_place_document
+
+DEFAULT_BATCH_SIZE = 500
+
+# Only the first errors are reported in full, the others are only counted.
+MAX_REPORTED_ERRORS = 1000
+
+INVALID_UTF8 = 'Invalid UTF-8'
+
+'''
+This function reads NDJSON places from a binary or text stream.
+It yields (row, record, error) tuples, with either a record or the error parsing it.
+Empty lines are skipped. A line which is not valid UTF-8 is an error of its row.
+'''
+def read_ndjson(stream):
+    for row, line in enumerate(stream, start=1):
+        if isinstance(line, bytes):
+            try:
+                line = line.decode('utf-8')
+            except UnicodeDecodeError:
+                yield row, None, INVALID_UTF8
+                continue
+        if not line.strip():
+            continue
+        try:
+            yield row, json.loads(line), None
+        except ValueError as e:
+            yield row, None, f'Invalid JSON: {e}'
+
+'''
+This function converts a CSV row into a place, e.g. {"location.latitude": "51.5"} into {"location": {"latitude": 51.5}}.
+Empty cells are left out, list fields are split on "|" and coordinates are converted to numbers.
+'''
+def csv_row_to_place(row):
+    place = {}
+    for column, value in row.items():
+        if column is None or value is None or value == '':
+            continue
+        if column in LIST_FIELDS:
+            value = [item.strip() for item in value.split('|') if item.strip()]
+        elif column in ('location.latitude', 'location.longitude'):
+            value = float(value)
+        elif column == 'place_id':
+            value = int(value)
+        target = place
+        *parents, field = column.split('.')
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[field] = value
+    return place
+
+'''
+This function reads CSV places from a binary or text stream.
+It yields (row, record, error) tuples, with either a record or the error parsing it.
+Rows are numbered from 1, not counting the header.
+
+Implementation:
+Bytes which are not valid UTF-8 are decoded to lone surrogates (surrogateescape), which no valid text holds,
+so the rows holding them are reported as errors and the reading goes on with the next row.
+'''
+def read_csv(stream):
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding='utf-8', errors='surrogateescape', newline='')
+    for row, values in enumerate(csv.DictReader(stream), start=1):
+        if any(_has_surrogates(text) for item in values.items() for text in _texts(item)):
+            yield row, None, INVALID_UTF8
+            continue
+        try:
+            yield row, csv_row_to_place(values), None
+        except ValueError as e:
+            yield row, None, str(e)
+
+# Returns the strings of a (column, value) item of a CSV row. DictReader puts the extra cells of a row in a list.
+def _texts(item):
+    for value in item:
+        if isinstance(value, list):
+            yield from value
+        elif value is not None:
+            yield value
+
+def _has_surrogates(text):
+    return any('\udc80' <= char <= '\udcff' for char in text)
+
+READERS = {
+    'ndjson': read_ndjson,
+    'csv': read_csv,
+}
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, row, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row, 'error': message})
+
+    def to_dict(self):
+        return {'inserted': self.inserted, 'updated': self.updated, 'failed': self.failed, 'errors': self.errors}
+
+'''
+This function imports places into the places collection.
+
+Implementation:
+It builds and validates the place of every record, collecting them into batches.
+The ids of the new places of a batch are allocated in one block.
+New places are written with an unordered insert_many and places with a place_id with replace upserts,
+so a failing row does not stop the rest of the batch.
+After each batch, on_batch is called with the places written and the ones of them which replaced
+an existing place_id, e.g. to update the search index and the copies of the place names.
+
+records - iterable of (row, record, error) tuples, see read_ndjson and read_csv
+allocate_ids - function returning a list of n new place ids
+Returns an ImportReport.
+'''
+def import_places(collection, records, allocate_ids, batch_size=DEFAULT_BATCH_SIZE, on_batch=None):
+    report = ImportReport()
+    batch = []
+    for row, record, error in records:
+        if error is not None:
+            report.error(row, error)
+            continue
+        try:
+            place_id = record.get('place_id') if isinstance(record, dict) else None
+            batch.append((row, place_id is not None, build_place_document(record, place_id, strict=True)))
+        except ValueError as e:
+            report.error(row, str(e))
+            continue
+        if len(batch) >= batch_size:
+            _write_batch(collection, batch, allocate_ids, report, on_batch)
+            batch = []
+    if batch:
+        _write_batch(collection, batch, allocate_ids, report, on_batch)
+    return report
+
+def _write_batch(collection, batch, allocate_ids, report, on_batch):
+    new_places = [(row, place) for row, upsert, place in batch if not upsert]
+    upserts = [(row, place) for row, upsert, place in batch if upsert]
+    written = []
+    replaced = []
+
+    if new_places:
+        for (_, place), place_id in zip(new_places, allocate_ids(len(new_places))):
+            place['place_id'] = place_id
+            place['location_id'] = place_id
+        failed = _bulk(report, new_places, lambda: collection.insert_many([place for _, place in new_places], ordered=False))
+        report.inserted += len(new_places) - len(failed)
+        written.extend(place for index, (_, place) in enumerate(new_places) if index not in failed)
+
+    if upserts:
+        requests = [ReplaceOne({'place_id': place['place_id']}, place, upsert=True) for _, place in upserts]
+        failed = _bulk(report, upserts, lambda: collection.bulk_write(requests, ordered=False))
+        report.updated += len(upserts) - len(failed)
+        replaced = [place for index, (_, place) in enumerate(upserts) if index not in failed]
+        written.extend(replaced)
+
+    if on_batch is not None and written:
+        on_batch(written, replaced)
+
+# Runs a bulk write and reports the rows it failed to write. Returns the indexes of the failed rows.
+def _bulk(report, rows, write):
+    try:
+        write()
+        return set()
+    except BulkWriteError as e:
+        failed = set()
+        for write_error in e.details.get('writeErrors', []):
+            failed.add(write_error['index'])
+            report.error(rows[write_error['index']][0], write_error.get('errmsg', 'Write failed'))
+        return failed
@@ -0,0 +1,90 @@
+# Sparse fieldsets for the listing endpoints.
+# A client can ask for only the fields it shows, either with ?fields=site_name,image,rating
+# or with a named view such as ?view=card. The fields are passed to MongoDB as a projection,
+# so the other fields are neither read from the database, decoded, nor sent to the client.
+# Without either parameter, the endpoints return whole documents as before.
+import re
+
+# Compact views of places and reviews, e.g. for the listing pages.
+PLACE_VIEWS = {
+    'card': ('place_id', 'site_name', 'image', 'rating'),
+}
+
+# Reviews come either from the Reviews collection, the ReviewDetails read model or joined with their user,
+# so the card view names the user and place fields of all of them. Fields a document does not have are skipped.
+REVIEW_VIEWS = {
+    'card': (
+        'review_id', 'place_id', 'user_id', 'rating', 'text', 'likes', 'timestamp',
+        'user_name', 'user_profile_photo', 'place_name', 'user.fullname', 'user.profile_photo',
+    ),
+}
+
+# Fields the server keeps for itself. They are left out of the whole documents, but can still be asked for by name,
+# e.g. the GeoJSON point of a place, which only exists for the 2dsphere index (see geospatial.py).
+HIDDEN_PLACE_FIELDS = ('geo',)
+
+# Upper bound of the fields in a single request.
+MAX_FIELDS = 50
+
+FIELD_PATTERN = re.compile(r'^[A-Za-z0-9_]+(\.[A-Za-z0-9_]+)*$')
+
+'''
+This function reads the fields requested with the "fields" and "view" query parameters.
+"fields" is a comma separated list of field names (dotted for nested fields) and can be repeated.
+Returns the list of fields, or None if the whole documents are wanted.
+It raises a ValueError for an unknown view or an invalid field name.
+'''
+def requested_fields(args, views):
+    view = args.get('view')
+    fields = [field.strip() for value in args.getlist('fields') for field in value.split(',') if field.strip()]
+    if view is None and not fields:
+        return None
+
+    if view is not None:
+        if view not in views:
+            raise ValueError(f'view must be one of: {", ".join(sorted(views))}')
+        fields = list(views[view]) + fields
+    if len(fields) > MAX_FIELDS:
+        raise ValueError(f'At most {MAX_FIELDS} fields can be requested')
+    for field in fields:
+        if not FIELD_PATTERN.match(field):
+            raise ValueError(f'Invalid field name: {field}')
+
+    # MongoDB rejects a projection of both a field and one of its sub fields, e.g. "user" and "user.fullname".
+    unique = list(dict.fromkeys(fields))
+    return [field for field in unique if not any(field.startswith(parent + '.') for parent in unique)]
+
+'''
+This function builds the MongoDB projection of the requested fields.
+keys are fields the endpoint needs itself, e.g. the sort keys of a paginated query.
+They are read from the database as well, and removed again from the response by trim.
+If fields is None, returns the projection of the whole documents without the hidden fields,
+or None if nothing is hidden.
+'''
+def to_projection(fields, keys=(), hidden=()):
+    if fields is None:
+        return {field: 0 for field in hidden} or None
+    projection = {field: 1 for field in fields}
+    for key in keys:
+        if not _covers(fields, key):
+            projection[key] = 1
+    if '_id' not in fields:
+        projection['_id'] = 0
+    return projection
+
+'''
+This function removes the keys which were only read for the endpoint itself from the documents.
+'''
+def trim(documents, fields, keys=()):
+    if fields is None:
+        return documents
+    extra = [key for key in keys if not _covers(fields, key)]
+    if extra:
+        for document in documents:
+            for key in extra:
+                document.pop(key, None)
+    return documents
+
+# Whether a requested field includes the key, e.g. "place_id" or "user" for "user.fullname".
+def _covers(fields, key):
+    return any(field == key or key.startswith(field + '.') for field in fields)
@@ -0,0 +1,162 @@
+# Running rating aggregates of the places.
+# The PlaceRatings collection holds, for every place, the number of reviews, the sum of their
+# ratings and a histogram of the ratings by star (1 to 5). The review endpoints update them
+# with atomic $inc operations, so the summary of a place is read from one document instead of
+# aggregating all of its reviews. The reconcile command rebuilds them from the reviews.
+import math
+from bson import Decimal128
+from pymongo import ReplaceOne, UpdateOne
+
+PLACE_RATINGS_COLLECTION = 'PlaceRatings'
+
+STARS = ('1', '2', '3', '4', '5')
+
+# Range of the ratings accepted from the clients.
+MIN_RATING = 0
+MAX_RATING = 5
+
+# Ratings are stored as Decimal128 in the reviews, but sent as numbers or strings by the frontend.
+def to_float(rating):
+    if isinstance(rating, Decimal128):
+        return float(rating.to_decimal())
+    return float(rating)
+
+'''
+This function checks a rating sent by a client, before anything is written.
+It raises a ValueError unless the rating is a finite number from MIN_RATING to MAX_RATING.
+'''
+def validate_rating(rating):
+    try:
+        value = to_float(rating)
+    except (TypeError, ValueError):
+        raise ValueError('rating must be a number')
+    if not math.isfinite(value) or not MIN_RATING <= value <= MAX_RATING:
+        raise ValueError(f'rating must be between {MIN_RATING} and {MAX_RATING}')
+    return value
+
+'''
+This function returns the star (histogram bucket) of a rating.
+Ratings are rounded half up, e.g. 4.5 counts as 5 stars, and kept within 1 to 5.
+'''
+def star(rating):
+    return str(min(5, max(1, int(to_float(rating) + 0.5))))
+
+'''
+This function returns the $inc update adding (sign=1) or removing (sign=-1) a rating.
+'''
+def increments(rating, sign=1):
+    return {
+        'review_count': sign,
+        'rating_sum': sign * to_float(rating),
+        'histogram.' + star(rating): sign,
+    }
+
+'''
+This function returns the $inc update replacing an old rating by a new one.
+'''
+def change_increments(old_rating, new_rating):
+    inc = {}
+    for update in (increments(old_rating, -1), increments(new_rating, 1)):
+        for field, value in update.items():
+            inc[field] = inc.get(field, 0) + value
+    return {field: value for field, value in inc.items() if value != 0}
+
+'''
+This function applies an $inc update to the aggregates of a place.
+The aggregates document is created if the place has none, unless upsert is False.
+'''
+def apply(db, place_id, inc, upsert=True):
+    if inc:
+        db[PLACE_RATINGS_COLLECTION].update_one({'_id': place_id}, {'$inc': inc}, upsert=upsert)
+
+'''
+This function removes the rating of a deleted review from the aggregates of its place.
+A place without aggregates (e.g. a deleted place) is left without, rather than given negative counts.
+Legacy reviews without a rating were never counted, so they change nothing.
+'''
+def remove_review(db, place_id, rating):
+    if rating is not None:
+        apply(db, place_id, increments(rating, -1), upsert=False)
+
+'''
+This function replaces the rating of an updated review in the aggregates of its place.
+Like remove_review, it does not create the aggregates of a place which has none.
+A legacy review without a rating only adds its new rating.
+'''
+def change_review(db, place_id, old_rating, new_rating):
+    inc = increments(new_rating) if old_rating is None else change_increments(old_rating, new_rating)
+    apply(db, place_id, inc, upsert=False)
+
+'''
+This function groups the rated reviews matching a filter by place and star in the database.
+Yields the groups as (place_id, star, count, sum of the ratings).
+'''
+def _star_groups(db, match):
+    rating = {'$toDouble': '$rating'}
+    groups = db['Reviews'].aggregate([
+        {'$match': dict(match, rating={'$ne': None})},
+        {'$group': {
+            '_id': {'place_id': '$place_id', 'star': {'$min': [5, {'$max': [1, {'$floor': {'$add': [rating, 0.5]}}]}]}},
+            'count': {'$sum': 1},
+            'sum': {'$sum': rating},
+        }},
+    ])
+    for group in groups:
+        yield group['_id']['place_id'], str(int(group['_id']['star'])), group['count'], group['sum']
+
+'''
+This function removes the ratings of all reviews of a user from the aggregates, e.g. before deleting their account.
+
+Implementation:
+The reviews of the user are grouped by place and star in the database,
+and the result is applied to the places with one bulk write.
+'''
+def remove_user_reviews(db, user_id):
+    updates = [UpdateOne({'_id': place_id}, {'$inc': {
+        'review_count': -count,
+        'rating_sum': -rating_sum,
+        'histogram.' + bucket: -count,
+    }}) for place_id, bucket, count, rating_sum in _star_groups(db, {'user_id': user_id})]
+    if updates:
+        db[PLACE_RATINGS_COLLECTION].bulk_write(updates, ordered=False)
+
+'''
+This function removes the aggregates of a place.
+'''
+def remove_place(db, place_id):
+    db[PLACE_RATINGS_COLLECTION].delete_one({'_id': place_id})
+
+'''
+This function returns the rating summary of a place from its aggregates document.
+'''
+def summary(place_id, aggregates):
+    aggregates = aggregates or {}
+    count = aggregates.get('review_count', 0)
+    histogram = aggregates.get('histogram', {})
+    return {
+        'place_id': place_id,
+        'review_count': count,
+        'average_rating': round(aggregates.get('rating_sum', 0) / count, 2) if count else None,
+        'histogram': {star: histogram.get(star, 0) for star in STARS},
+    }
+
+'''
+This function rebuilds the aggregates of all places from the reviews.
+It fixes any drift, e.g. from writes made before the aggregates existed.
+The reviews are grouped by place and star in the database, so at most 5 groups per place are read.
+Returns the number of places with reviews.
+'''
+def rebuild(db):
+    aggregates = {}
+    for place_id, bucket, count, rating_sum in _star_groups(db, {}):
+        place = aggregates.setdefault(place_id, {
+            '_id': place_id, 'review_count': 0, 'rating_sum': 0.0, 'histogram': {star: 0 for star in STARS}})
+        place['review_count'] += count
+        place['rating_sum'] += rating_sum
+        place['histogram'][bucket] += count
+
+    collection = db[PLACE_RATINGS_COLLECTION]
+    if aggregates:
+        collection.bulk_write([ReplaceOne({'_id': place_id}, place, upsert=True) for place_id, place in aggregates.items()], ordered=False)
+    collection.delete_many({'_id': {'$nin': list(aggregates)}})
+    return len(aggregates)
@@ -0,0 +1,82 @@
+# Caching of read endpoint responses.
+# Every cached endpoint depends on one or more resources (e.g. "places" or "reviews:12").
+# A resource has a version counter in the CacheVersions collection, which the write endpoints
+# bump whenever they change it. The ETag of a response is derived from the URL and the versions
+# of its resources, so it changes as soon as one of them is written to.
+#
+# Clients repeating a request with If-None-Match get a 304 Not Modified without the endpoint running,
+# and other clients get the payload from an in-process cache until the versions change.
+# Reading the versions is still one query to CacheVersions per request, so a 304 or a cached payload
+# costs a database round trip, but not the queries of the endpoint itself.
+import hashlib
+from functools import wraps
+from flask import Response, make_response, request
+from pymongo import UpdateOne
+from caching import TTLCache
+
+class ResourceVersions:
+    def __init__(self, collection):
+        self.collection = collection
+
+    '''
+    This function returns the current versions of the given resources.
+    Resources which were never written to are at version 0.
+    '''
+    def get(self, resources):
+        versions = {version['_id']: version['v'] for version in self.collection.find({'_id': {'$in': resources}})}
+        return [versions.get(resource, 0) for resource in resources]
+
+    '''
+    This function bumps the versions of the given resources, invalidating the cached responses using them.
+    '''
+    def bump(self, *resources):
+        if resources:
+            self.collection.bulk_write([UpdateOne({'_id': resource}, {'$inc': {'v': 1}}, upsert=True) for resource in resources], ordered=False)
+
+class ResponseCache:
+    def __init__(self, versions, maxsize=256, ttl=3600):
+        self.versions = versions
+        self.payloads = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.not_modified = 0
+
+    '''
+    This decorator caches the responses of a read endpoint.
+    resources is a function receiving the arguments of the endpoint and returning the names of the resources it reads.
+
+    Implementation:
+    It computes the ETag from the URL and the current versions of the resources.
+    If the client already has that ETag, it returns 304 Not Modified.
+    If the payload for that ETag is cached, it returns the cached payload.
+    Otherwise it runs the endpoint and caches successful responses.
+    '''
+    def cached(self, resources):
+        def decorator(func):
+            @wraps(func)
+            def cached_wrapper(*args, **kwargs):
+                names = resources(**kwargs)
+                versions = self.versions.get(names)
+                key = '|'.join([request.full_path] + [f'{name}={version}' for name, version in zip(names, versions)])
+                etag = hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+                if request.if_none_match.contains(etag):
+                    self.not_modified += 1
+                    response = Response(status=304)
+                    response.set_etag(etag)
+                    return response
+
+                payload = self.payloads.get(etag)
+                if payload is not None:
+                    response = Response(payload, status=200, mimetype='application/json')
+                    response.set_etag(etag)
+                    return response
+
+                response = make_response(func(*args, **kwargs))
+                if response.status_code == 200:
+                    self.payloads.set(etag, response.get_data())
+                    response.set_etag(etag)
+                return response
+            return cached_wrapper
+        return decorator
+
+    def stats(self):
+        return dict(self.payloads.stats(), not_modified=self.not_modified)
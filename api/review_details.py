@@ -0,0 +1,117 @@
+# Read model of the reviews.
+# The ReviewDetails collection holds a copy of every review together with the name and
+# profile photo of its author and the name of the reviewed place. The feed endpoints read
+# it with a single indexed find, instead of joining the Users and Places collections
+# for every review on every request.
+#
+# The writers of the reviews, users and places collections keep it up to date,
+# and the backfill command rebuilds it from scratch.
+from pymongo import UpdateMany
+
+REVIEW_DETAILS_COLLECTION = 'ReviewDetails'
+
+'''
+This function returns the aggregation pipeline that joins reviews with their user and place.
+
+Implementation:
+It performs left outer joins on the users and places collections,
+deconstructs the joined arrays and picks the fields shown in the review feeds.
+Reviews whose user or place no longer exists are dropped by the unwind stages.
+'''
+def details_pipeline(match=None):
+    pipeline = [
+        {
+            "$lookup": {
+                "from": "Users",
+                "localField": "user_id",
+                "foreignField": "user_id",
+                "as": "user"
+            }
+        },
+        {
+            "$lookup": {
+                "from": "Places",
+                "localField": "place_id",
+                "foreignField": "place_id",
+                "as": "place"
+            }
+        },
+        {"$unwind": "$user"},
+        {"$unwind": "$place"},
+        {
+            "$project": {
+                "_id": 1,
+                "review_id": 1,
+                "rating": 1,
+                "timestamp": 1,
+                "user_id": 1,
+                "place_id": 1,
+                "text": 1,
+                "user_name": "$user.fullname",
+                "user_profile_photo": "$user.profile_photo",
+                "place_name": "$place.site_name",
+                "likes": 1,
+                "edited": 1,
+                "updated_at": 1
+            }
+        }
+    ]
+    if match is not None:
+        pipeline.insert(0, {"$match": match})
+    return pipeline
+
+'''
+This function creates the indexes used by the review feeds.
+'''
+def create_indexes(collection):
+    collection.create_index([('review_id', 1)], unique=True)
+    collection.create_index([('timestamp', -1), ('review_id', 1)])
+    collection.create_index([('user_id', 1), ('timestamp', -1), ('review_id', 1)])
+    collection.create_index([('place_id', 1)])
+
+'''
+This function refreshes the read model entry of a single review.
+It is called after a review is created, so that the entry picks up the user and place details.
+'''
+def refresh_review(db, review_id):
+    details = list(db['Reviews'].aggregate(details_pipeline({"review_id": review_id})))
+    if details:
+        db[REVIEW_DETAILS_COLLECTION].replace_one({"review_id": review_id}, details[0], upsert=True)
+    else:
+        db[REVIEW_DETAILS_COLLECTION].delete_one({"review_id": review_id})
+
+'''
+This function applies an update to the read model entry of a single review.
+The update is the same one applied to the review itself, e.g. {"$set": {"text": ...}} or {"$inc": {"likes": 1}}.
+'''
+def update_review(db, review_id, update):
+    db[REVIEW_DETAILS_COLLECTION].update_one({"review_id": review_id}, update)
+
+'''
+This function removes reviews from the read model.
+The filter is the same one used on the reviews collection, e.g. {"review_id": ...} or {"user_id": ...}.
+'''
+def delete_reviews(db, query):
+    db[REVIEW_DETAILS_COLLECTION].delete_many(query)
+
+'''
+This function copies the new name of a user to all of their reviews.
+'''
+def update_user(db, user_id, fullname):
+    db[REVIEW_DETAILS_COLLECTION].update_many({"user_id": user_id}, {"$set": {"user_name": fullname}})
+
+'''
+This function copies the new names of places to their reviews, e.g. after places are replaced by an import.
+'''
+def update_places(db, places):
+    updates = [UpdateMany({"place_id": place['place_id']}, {"$set": {"place_name": place.get('site_name')}}) for place in places]
+    if updates:
+        db[REVIEW_DETAILS_COLLECTION].bulk_write(updates, ordered=False)
+
+'''
+This function rebuilds the whole read model from the reviews, users and places collections.
+$out replaces the collection in one go, keeping its indexes, so readers never see a half built view.
+'''
+def rebuild(db):
+    db['Reviews'].aggregate(details_pipeline() + [{"$out": REVIEW_DETAILS_COLLECTION}])
+    return db[REVIEW_DETAILS_COLLECTION].count_documents({})
@@ -0,0 +1,145 @@
+# Revocation of tokens, e.g. on logout.
+# Revoked tokens are stored in the blacklist collection until they expire; a TTL index
+# removes them afterwards, so the collection only holds tokens which are still valid.
+# Every worker keeps the revoked tokens in memory and pulls the new ones from the
+# collection at most once per sync interval, so checking a token is a set lookup
+# and does not query the database on every request.
+#
+# The blacklist used to store the revoked tokens themselves, as {"token": ...} without an expiry.
+# migrate converts them, and until it has run the full sync reads their expiry from the token.
+import datetime
+import hashlib
+import logging
+import threading
+import time
+import jwt
+
+class RevokedTokens:
+    def __init__(self, collection, sync_interval=5, logger=None):
+        self.collection = collection
+        self.sync_interval = sync_interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.syncs = 0
+        self.sync_errors = 0
+        self._revoked = {}
+        self._last_sync = None
+        self._next_sync = 0.0
+        self._lock = threading.Lock()
+
+    '''
+    This function creates the indexes of the blacklist collection.
+    The TTL index deletes a revoked token as soon as the token itself expires.
+    '''
+    def create_indexes(self):
+        self.collection.create_index([('expires_at', 1)], expireAfterSeconds=0)
+        self.collection.create_index([('revoked_at', 1)])
+
+    '''
+    This function returns the key identifying a token.
+    New tokens carry a unique "jti" claim, older ones are identified by a hash of the token.
+    '''
+    @staticmethod
+    def token_key(token, claims):
+        return claims.get('jti') or hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    '''
+    This function returns the key and expiry (a timestamp) of a token of the legacy blacklist documents.
+    The signature is not checked, the token was verified when it was revoked.
+    Returns None if the token can not be decoded.
+    '''
+    def legacy_entry(self, token):
+        try:
+            claims = jwt.decode(token, options={'verify_signature': False, 'verify_exp': False})
+        except jwt.InvalidTokenError:
+            return None
+        return self.token_key(token, claims), claims.get('exp', time.time() + 24 * 60 * 60)
+
+    '''
+    This function revokes a token until it expires.
+    '''
+    def revoke(self, token, claims):
+        key = self.token_key(token, claims)
+        expires = claims.get('exp', time.time() + 24 * 60 * 60)
+        self.collection.update_one(
+            {'_id': key},
+            {'$setOnInsert': {
+                'expires_at': datetime.datetime.utcfromtimestamp(expires),
+                'revoked_at': datetime.datetime.utcnow(),
+            }},
+            upsert=True)
+        with self._lock:
+            self._revoked[key] = expires
+
+    '''
+    This function checks if a token has been revoked.
+    Tokens revoked by other workers are seen after at most one sync interval.
+    If the sync fails (e.g. the database is unreachable), the tokens of the last sync are used
+    and the sync is tried again after the interval.
+    '''
+    def is_revoked(self, token, claims):
+        if time.monotonic() >= self._next_sync:
+            try:
+                self.sync()
+            except Exception:
+                self.sync_errors += 1
+                self.logger.exception('Could not sync the revoked tokens')
+        return self.token_key(token, claims) in self._revoked
+
+    '''
+    This function pulls the tokens revoked since the last sync and forgets the expired ones.
+
+    Implementation:
+    Only one thread syncs at a time, the others keep using the current set.
+    The query goes back a few seconds before the last sync, to not miss tokens
+    revoked by a worker whose clock is slightly behind.
+    '''
+    def sync(self):
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sync = time.monotonic() + self.sync_interval
+            now = datetime.datetime.utcnow()
+            query = {'revoked_at': {'$gte': self._last_sync - datetime.timedelta(seconds=5)}} if self._last_sync else {}
+            revoked_tokens = {}
+            for revoked in self.collection.find(query, {'expires_at': 1, 'token': 1}):
+                expires_at = revoked.get('expires_at')
+                if expires_at is not None:
+                    revoked_tokens[revoked['_id']] = expires_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+                elif isinstance(revoked.get('token'), str):
+                    entry = self.legacy_entry(revoked['token'])
+                    if entry is not None:
+                        revoked_tokens[entry[0]] = entry[1]
+            # The set only changes once the whole query succeeded.
+            self._revoked.update(revoked_tokens)
+            self._last_sync = now
+            self.syncs += 1
+
+            # Expired tokens are rejected anyway, no need to remember them.
+            current_time = time.time()
+            for key in [key for key, expires in self._revoked.items() if expires <= current_time]:
+                del self._revoked[key]
+        finally:
+            self._lock.release()
+
+    '''
+    This function converts the legacy blacklist documents, {"token": ...}, to revoked token documents
+    with an expiry, so the TTL index removes them once their token expires.
+    The documents of expired or invalid tokens are deleted. Returns the number of documents converted.
+    '''
+    def migrate(self):
+        converted = 0
+        for legacy in self.collection.find({'token': {'$exists': True}}, {'token': 1}):
+            entry = self.legacy_entry(legacy['token']) if isinstance(legacy['token'], str) else None
+            if entry is not None and entry[1] > time.time():
+                key, expires = entry
+                self.collection.update_one({'_id': key}, {'$setOnInsert': {
+                    'expires_at': datetime.datetime.utcfromtimestamp(expires),
+                    'revoked_at': datetime.datetime.utcnow(),
+                }}, upsert=True)
+                converted += 1
+            self.collection.delete_one({'_id': legacy['_id']})
+        return converted
+
+    def stats(self):
+        return {'size': len(self._revoked), 'syncs': self.syncs, 'sync_errors': self.sync_errors,
+                'sync_interval': self.sync_interval}
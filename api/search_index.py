@@ -0,0 +1,173 @@
+# Inverted index used to search places.
+# Every place is split into terms, and for each (term, place) pair we store a posting
+# with a relevance score in the SearchIndex collection. Searching then becomes an
+# indexed lookup of the query terms instead of a regular expression over every place.
+import re
+import unicodedata
+
+# Relative weight of a term depending on the field it was found in.
+# A match in the name of a place is much more relevant than a match in its summary.
+FIELD_WEIGHTS = {
+    'site_name': 10.0,
+    'tags': 5.0,
+    'categories': 5.0,
+    'summary': 1.0,
+}
+
+# Prefix matches (e.g. "cast" for "castle") score a bit lower than exact matches.
+PREFIX_MATCH_FACTOR = 0.8
+
+# Shorter prefixes match too many terms, so they only match exactly until the user types more.
+MIN_PREFIX_LENGTH = 3
+
+# Common words which do not help to find a place.
+STOP_WORDS = {
+    'a', 'an', 'and', 'at', 'by', 'for', 'from', 'in', 'is', 'it', 'of', 'on', 'or', 'the', 'to', 'with',
+}
+
+# Runs of letters and digits in any script.
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+
+'''
+This function splits a text into case folded terms, dropping stop words.
+Accents are removed (e.g. "Château" gives "chateau"), so a place is found with or without them.
+Letters of other scripts are kept as they are.
+'''
+def tokenize(text):
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', str(text).casefold())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return [token for token in TOKEN_PATTERN.findall(text) if token not in STOP_WORDS]
+
+# Fields can either be strings (site_name, summary) or lists of strings (tags, categories).
+def _field_terms(value):
+    if isinstance(value, (list, tuple)):
+        return [term for item in value for term in tokenize(item)]
+    return tokenize(value)
+
+'''
+This function builds the postings of a place.
+
+Implementation:
+It tokenizes every searchable field and adds the field weight to the score of each term.
+So a term appearing in multiple fields (or multiple times) ranks higher.
+The name of the place is stored with every posting, so that suggestions can be served
+without reading the places collection.
+'''
+def build_postings(place):
+    scores = {}
+    for field, weight in FIELD_WEIGHTS.items():
+        for term in _field_terms(place.get(field)):
+            scores[term] = scores.get(term, 0.0) + weight
+
+    return [{
+        'term': term,
+        'place_id': place['place_id'],
+        'site_name': place.get('site_name'),
+        'score': score,
+    } for term, score in scores.items()]
+
+'''
+This function creates the indexes used by the search index collection.
+'''
+def create_indexes(collection):
+    collection.create_index([('term', 1), ('place_id', 1)], unique=True)
+    collection.create_index([('place_id', 1)])
+
+'''
+This function adds (or replaces) a place in the search index.
+'''
+def index_place(collection, place):
+    collection.delete_many({'place_id': place['place_id']})
+    postings = build_postings(place)
+    if postings:
+        collection.insert_many(postings, ordered=False)
+
+'''
+This function adds (or replaces) many places in the search index at once, e.g. after a bulk import.
+'''
+def index_places(collection, places):
+    collection.delete_many({'place_id': {'$in': [place['place_id'] for place in places]}})
+    postings = [posting for place in places for posting in build_postings(place)]
+    if postings:
+        collection.insert_many(postings, ordered=False)
+
+'''
+This function removes a place from the search index.
+'''
+def remove_place(collection, place_id):
+    collection.delete_many({'place_id': place_id})
+
+'''
+This function rebuilds the whole search index from the given places.
+Returns the number of places indexed.
+'''
+def rebuild(collection, places):
+    collection.delete_many({})
+    count = 0
+    batch = []
+    for place in places:
+        batch.extend(build_postings(place))
+        count += 1
+        if len(batch) >= 1000:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+    return count
+
+'''
+This function searches the index and returns the matching places ranked by relevance.
+
+Implementation:
+Every term of the query must match (AND semantics).
+All terms except the last one must match exactly.
+The last term also matches as a prefix, so results show up while the user is still typing,
+unless it is shorter than MIN_PREFIX_LENGTH: a one or two letter prefix would read the postings
+of a large part of the index.
+The score of a place is the sum of the best posting for every query term.
+
+Returns a list of (score, place_id, site_name) tuples, best match first.
+Ties are broken by place_id so that the order is stable between requests.
+'''
+def search(collection, text, limit=None):
+    terms = tokenize(text)
+    if not terms:
+        return []
+    prefix = terms[-1] if len(terms[-1]) >= MIN_PREFIX_LENGTH else None
+    exact_terms = terms[:-1] if prefix else terms
+
+    clauses = []
+    if exact_terms:
+        clauses.append({'term': {'$in': exact_terms}})
+    if prefix:
+        clauses.append({'term': {'$regex': '^' + re.escape(prefix)}})
+    postings = collection.find(
+        clauses[0] if len(clauses) == 1 else {'$or': clauses},
+        {'_id': 0, 'term': 1, 'place_id': 1, 'site_name': 1, 'score': 1}
+    )
+
+    # Best score of every query term for every place.
+    matches = {}
+    names = {}
+    for posting in postings:
+        place_id = posting['place_id']
+        names[place_id] = posting.get('site_name')
+        term_scores = matches.setdefault(place_id, {})
+        for position, term in enumerate(terms):
+            if posting['term'] == term:
+                score = posting['score']
+            elif prefix and position == len(terms) - 1 and posting['term'].startswith(prefix):
+                score = posting['score'] * PREFIX_MATCH_FACTOR
+            else:
+                continue
+            term_scores[position] = max(term_scores.get(position, 0.0), score)
+
+    results = [
+        (sum(term_scores.values()), place_id, names[place_id])
+        for place_id, term_scores in matches.items()
+        if len(term_scores) == len(terms)
+    ]
+    results.sort(key=lambda result: (-result[0], result[1]))
+    return results[:limit] if limit is not None else results
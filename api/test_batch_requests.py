@@ -0,0 +1,64 @@
+# This file contains the unit tests for the batched requests.
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from flask import Flask, jsonify, request
+import batch_requests
+
+ENDPOINTS = {'echo', 'get_place'}
+
+def make_app():
+    app = Flask(__name__)
+
+    @app.route('/api/echo/<value>')
+    def echo(value):
+        return jsonify({'value': value, 'token': request.headers.get('x-access-token')})
+
+    @app.route('/api/place/<int:place_id>')
+    def get_place(place_id):
+        return jsonify({'place_id': place_id})
+
+    @app.route('/api/logout')
+    def logout():
+        return jsonify({'message': 'logged out'})
+
+    @app.route('/api/batch', methods=['POST'])
+    def run_batch():
+        return jsonify({})
+
+    return app
+
+def test_parse_batch():
+    app = make_app()
+    items = batch_requests.parse_batch({'requests': [{'id': 'place', 'path': '/api/place/1'}, {'path': '/api/echo/1?view=card'}]},
+                                       app.url_map, ENDPOINTS)
+    assert items == [{'id': 'place', 'path': '/api/place/1'}, {'id': 1, 'path': '/api/echo/1?view=card'}]
+
+@pytest.mark.parametrize('data', [
+    None,
+    {'requests': []},
+    {'requests': [{'path': '/api/batch'}]},
+    {'requests': [{'path': '/api/logout'}]},
+    {'requests': [{'path': '/api/place/x'}]},
+    {'requests': [{'path': '/api/missing'}]},
+    {'requests': [{'path': '/api/place/1', 'method': 'DELETE'}]},
+    {'requests': [{'path': 'http://x/'}]},
+    {'requests': [{'path': '/api/place/1'}] * (batch_requests.MAX_BATCH_SIZE + 1)},
+])
+def test_invalid_batches(data):
+    with pytest.raises(ValueError):
+        batch_requests.parse_batch(data, make_app().url_map, ENDPOINTS)
+
+def test_the_app_endpoints_are_allowed():
+    import index
+    for endpoint in batch_requests.BATCH_ENDPOINTS:
+        assert endpoint in index.app.view_functions
+    for endpoint in ('logout', 'export_reviews', 'export_places', 'run_batch'):
+        assert endpoint not in batch_requests.BATCH_ENDPOINTS
+
+def test_run_batch():
+    app = make_app()
+    items = [{'id': 'a', 'path': '/api/echo/1'}, {'id': 'b', 'path': '/api/missing'}]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        responses = batch_requests.run_batch(app, executor, items, [('x-access-token', 't')], 'http://localhost/')
+    assert responses[0] == {'id': 'a', 'status': 200, 'body': {'value': '1', 'token': 't'}}
+    assert (responses[1]['id'], responses[1]['status']) == ('b', 404)
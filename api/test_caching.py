@@ -0,0 +1,35 @@
+# This file contains the unit tests for the in-process caches.
+import time
+from caching import TTLCache
+
+def test_hits_and_misses():
+    cache = TTLCache(maxsize=10, ttl=60)
+    assert cache.get('a') is None
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    stats = cache.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.stats()['evictions'] == 1
+
+def test_entries_expire():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set('a', 1, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get('a') is None
+
+def test_invalidate_if():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set('a', {'user_id': 'u1'})
+    cache.set('b', {'user_id': 'u2'})
+    cache.invalidate_if(lambda _, user: user['user_id'] == 'u1')
+    assert cache.get('a') is None
+    assert cache.get('b') == {'user_id': 'u2'}
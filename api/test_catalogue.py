@@ -0,0 +1,108 @@
+# This file contains the unit tests for the in-process places catalogue.
+import pytest
+from catalogue import PlaceCatalogue
+from pagination import paginate
+
+SORT_ORDERS = {
+    'site_name': [('site_name', 1), ('place_id', 1)],
+    'rating': [('rating', -1), ('place_id', 1)],
+    None: [('place_id', 1)],
+}
+
+class FakeCollection:
+    def __init__(self, documents):
+        self.documents = documents
+        self.finds = 0
+
+    def find(self):
+        self.finds += 1
+        return [dict(document) for document in self.documents]
+
+class FakeVersions:
+    def __init__(self):
+        self.version = 0
+
+    def get(self, resources):
+        return [self.version for _ in resources]
+
+def make_catalogue():
+    places = FakeCollection([
+        {'_id': 'a', 'place_id': 3, 'site_name': 'Castle', 'rating': 4.5, 'categories': ['Heritage', 'Family']},
+        {'_id': 'b', 'place_id': 1, 'site_name': 'Abbey', 'rating': 3.0, 'categories': ['Heritage']},
+        {'_id': 'c', 'place_id': 2, 'site_name': 'Beach', 'rating': 4.5, 'categories': ['Nature', 'Family']},
+        {'_id': 'd', 'place_id': 4, 'site_name': 'Zoo', 'rating': None, 'categories': ['Family']},
+    ])
+    versions = FakeVersions()
+    return PlaceCatalogue(places, versions, SORT_ORDERS, poll_interval=0), places, versions
+
+def test_sort_orders_and_categories():
+    catalogue, _, _ = make_catalogue()
+    assert [place['place_id'] for place in catalogue.find(sort='site_name')] == [1, 2, 3, 4]
+    # Ratings are descending with ties by place_id, and a missing rating comes last like in MongoDB.
+    assert [place['place_id'] for place in catalogue.find(sort='rating')] == [2, 3, 1, 4]
+    assert [place['place_id'] for place in catalogue.find(['Heritage', 'Family'])] == [3]
+    assert [place['place_id'] for place in catalogue.find(['Family'], place_ids=[4, 2, 9])] == [2, 4]
+    assert catalogue.find(['Unknown']) == []
+
+def test_pages_and_projection():
+    catalogue, _, _ = make_catalogue()
+    projection = {'site_name': 1, 'rating': 1, 'place_id': 1, '_id': 0}
+    page, cursor = catalogue.paginate('rating', 2, categories=['Family'], projection=projection)
+    assert page == [{'place_id': 2, 'site_name': 'Beach', 'rating': 4.5}, {'place_id': 3, 'site_name': 'Castle', 'rating': 4.5}]
+    page, cursor = catalogue.paginate('rating', 2, cursor, categories=['Family'], projection=projection)
+    assert [place['place_id'] for place in page] == [4] and cursor is None
+    assert catalogue.get(1, {'site_name': 1, '_id': 0}) == {'site_name': 'Abbey'}
+    assert catalogue.get(1, {'categories': 0, 'rating': 0}) == {'_id': 'b', 'place_id': 1, 'site_name': 'Abbey'}
+    assert catalogue.get(9) is None
+
+def test_reloads_when_the_version_changes():
+    catalogue, places, versions = make_catalogue()
+    catalogue.get(1)
+    catalogue.get(1)
+    assert places.finds == 1
+
+    places.documents = [document for document in places.documents if document['place_id'] != 1]
+    versions.version += 1
+    assert catalogue.get(1) is None
+    assert places.finds == 2
+    assert catalogue.stats()['places'] == 3
+
+@pytest.mark.parametrize('sort', ['rating', 'site_name', None])
+def test_pages_match_the_database(sort):
+    mongomock = pytest.importorskip('mongomock')
+    documents = [{'place_id': place_id, 'site_name': name, 'rating': rating, 'categories': ['Family']}
+                 for place_id, name, rating in [(1, 'Abbey', 4.5), (2, None, None), (3, 'Castle', 3), (4, 'Beach', None),
+                                                (5, None, 4.5), (6, 'Zoo', 4), (7, 'Park', 1)]]
+    documents.append({'place_id': 8, 'categories': ['Family']})
+    collection = mongomock.MongoClient().db.Places
+    collection.insert_many([dict(document) for document in documents])
+    catalogue = PlaceCatalogue(FakeCollection(documents), FakeVersions(), SORT_ORDERS, poll_interval=0)
+
+    # Missing and null sort keys must come at the same positions as in MongoDB, or the cursors of one path skip places in the other.
+    expected, cursor = [], None
+    while True:
+        page, cursor = paginate(collection, {}, SORT_ORDERS[sort], 3, cursor)
+        expected += [place['place_id'] for place in page]
+        if cursor is None:
+            break
+    pages, cursor = [], None
+    while True:
+        page, cursor = catalogue.paginate(sort, 3, cursor, categories=['Family'])
+        pages += [place['place_id'] for place in page]
+        if cursor is None:
+            break
+    assert pages == expected
+    assert [place['place_id'] for place in catalogue.find(['Family'], sort=sort)] == expected
+
+    # A client may page across processes with and without the catalogue.
+    mixed, cursor, use_catalogue = [], None, True
+    while True:
+        if use_catalogue:
+            page, cursor = catalogue.paginate(sort, 2, cursor, categories=['Family'])
+        else:
+            page, cursor = paginate(collection, {}, SORT_ORDERS[sort], 2, cursor)
+        mixed += [place['place_id'] for place in page]
+        use_catalogue = not use_catalogue
+        if cursor is None:
+            break
+    assert mixed == expected
@@ -0,0 +1,24 @@
+# This file contains the unit tests for the streaming export.
+import datetime
+import json
+from bson import Decimal128, ObjectId
+from export import json_array_chunks, ndjson_chunks
+
+DOCUMENTS = [
+    {'_id': ObjectId('65a000000000000000000001'), 'rating': Decimal128('4.5'), 'timestamp': datetime.datetime(2024, 1, 2, 3, 4, 5)},
+    {'_id': ObjectId('65a000000000000000000002'), 'rating': Decimal128('3')},
+    {'_id': ObjectId('65a000000000000000000003'), 'rating': Decimal128('1')},
+]
+
+def test_ndjson_chunks():
+    chunks = list(ndjson_chunks(iter(DOCUMENTS), batch_size=2))
+    assert len(chunks) == 2
+    lines = ''.join(chunks).splitlines()
+    assert json.loads(lines[0]) == {'_id': '65a000000000000000000001', 'rating': 4.5, 'timestamp': '2024-01-02T03:04:05.000Z'}
+    assert len(lines) == 3
+
+def test_json_array_chunks():
+    for batch_size in (1, 2, 10):
+        body = ''.join(json_array_chunks(iter(DOCUMENTS), batch_size=batch_size))
+        assert [document['rating'] for document in json.loads(body)] == [4.5, 3.0, 1.0]
+    assert json.loads(''.join(json_array_chunks(iter([])))) == []
@@ -0,0 +1,85 @@
+# This file contains the unit tests for the geospatial queries on places.
+import pytest
+import geospatial
+from place_documents import build_place_document
+
+class RecordingCollection:
+    def __init__(self, results):
+        self.results = results
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        return iter(self.results)
+
+def test_point():
+    assert geospatial.point('51.5', -0.12) == {'type': 'Point', 'coordinates': [-0.12, 51.5]}
+    assert geospatial.point(None, -0.12) is None
+    assert geospatial.point(91, 0) is None
+    assert geospatial.point('nan', 0) is None
+
+def test_place_documents_store_the_point():
+    data = {'site_name': 'Castle', 'location': {'latitude': 51.5, 'longitude': -0.12}, 'address': {}, 'rating': 4}
+    assert build_place_document(data, 1)['geo']['coordinates'] == [-0.12, 51.5]
+    data['location'] = {}
+    assert 'geo' not in build_place_document(data, 1)
+
+def test_parsing():
+    assert geospatial.parse_bbox('-1,50,1,52') == (-1.0, 50.0, 1.0, 52.0)
+    assert geospatial.parse_radius(None) == geospatial.DEFAULT_RADIUS
+    assert geospatial.parse_radius('250.5') == 250.5
+
+@pytest.mark.parametrize('parse, value', [
+    (geospatial.parse_bbox, '1,50,-1,52'),
+    (geospatial.parse_bbox, '1,2'),
+    (geospatial.parse_bbox, 'nan,50,1,52'),
+    (geospatial.parse_radius, '0'),
+    (geospatial.parse_radius, '100000'),
+    (geospatial.parse_radius, 'nan'),
+    (geospatial.parse_radius, 'inf'),
+    (geospatial.parse_grid_size, '64'),
+])
+def test_invalid_values(parse, value):
+    with pytest.raises(ValueError):
+        parse(value)
+
+def test_small_bbox_is_one_polygon():
+    ring = geospatial.within_bbox((-1, 50, 1, 52))['geo']['$geoWithin']['$geometry']['coordinates'][0]
+    assert ring == [[-1, 49.75], [1, 49.75], [1, 52.25], [-1, 52.25], [-1, 49.75]]
+
+def test_whole_world_bbox():
+    query = geospatial.within_bbox(geospatial.parse_bbox('-180,-90,180,90'))
+    polygons = [clause['geo']['$geoWithin']['$geometry']['coordinates'][0] for clause in query['$or']]
+    assert len(polygons) == 4
+    for ring in polygons:
+        assert ring[0] == ring[-1]
+        longitudes = [longitude for longitude, _ in ring]
+        assert max(longitudes) - min(longitudes) <= geospatial.POLYGON_WIDTH
+        assert all(abs(latitude) == geospatial.MAX_LATITUDE for _, latitude in ring)
+        assert all(abs(a[0] - b[0]) <= geospatial.EDGE_STEP for a, b in zip(ring, ring[1:]))
+    assert polygons[0][0][0] == -180 and polygons[-1][len(polygons[-1]) // 2 - 1][0] == 180
+
+def test_nearby_filters_in_geo_near():
+    collection = RecordingCollection([])
+    geospatial.nearby(collection, geospatial.point(51.5, -0.12), 1000, 10, ['Castles'], {'site_name': 1, '_id': 0})
+    geo_near, limit, project = collection.pipelines[0]
+    assert geo_near['$geoNear']['query'] == {'categories': {'$all': ['Castles']}}
+    assert geo_near['$geoNear']['maxDistance'] == 1000
+    assert limit == {'$limit': 10}
+    assert project == {'$project': {'site_name': 1, '_id': 0, 'distance': 1}}
+
+    geospatial.nearby(collection, geospatial.point(51.5, -0.12), 1000, 10, projection={'geo': 0})
+    assert collection.pipelines[1][2] == {'$project': {'geo': 0}}
+
+def test_single_place_clusters_carry_the_place():
+    collection = RecordingCollection([
+        {'_id': {'x': 0, 'y': 0}, 'count': 3, 'latitude': 50.5, 'longitude': -0.5, 'place_id': 1, 'site_name': 'A'},
+        {'_id': {'x': 1, 'y': 0}, 'count': 1, 'latitude': 50.5, 'longitude': 0.5, 'place_id': 4, 'site_name': 'D'},
+    ])
+    clusters = geospatial.clusters(collection, (-1, 50, 1, 52), 2)
+    assert clusters == [
+        {'count': 3, 'latitude': 50.5, 'longitude': -0.5},
+        {'count': 1, 'latitude': 50.5, 'longitude': 0.5, 'place_id': 4, 'site_name': 'D'},
+    ]
+    trim = collection.pipelines[0][2]
+    assert trim == {'$match': {'longitude': {'$gte': -1, '$lte': 1}, 'latitude': {'$gte': 50, '$lte': 52}}}
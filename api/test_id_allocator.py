@@ -0,0 +1,102 @@
+# This file contains the unit tests for the allocation of ids.
+import threading
+import time
+from id_allocator import IdAllocator
+
+'''
+This class is a counters collection, with the operations of the id allocator.
+Every call can be slowed down or held until an event is set, to simulate the database round trip.
+'''
+class CountersCollection:
+    def __init__(self, delay=0):
+        self.sequences = {}
+        self.delay = delay
+        self.gate = None
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _round_trip(self):
+        self.calls += 1
+        if self.gate is not None:
+            self.gate.wait(5)
+        time.sleep(self.delay)
+
+    def find_one(self, query):
+        self._round_trip()
+        with self._lock:
+            return {'_id': query['_id'], 'seq': self.sequences[query['_id']]} if query['_id'] in self.sequences else None
+
+    def update_one(self, query, update, upsert=False):
+        self._round_trip()
+        with self._lock:
+            self.sequences[query['_id']] = max(self.sequences.get(query['_id'], update['$max']['seq']), update['$max']['seq'])
+
+    def find_one_and_update(self, query, update, upsert=False, return_document=None):
+        self._round_trip()
+        with self._lock:
+            seq = self.sequences[query['_id']] = self.sequences.get(query['_id'], 0) + update['$inc']['seq']
+            return {'_id': query['_id'], 'seq': seq}
+
+def test_blocks_are_leased_when_exhausted():
+    allocator = IdAllocator(CountersCollection(), block_size=3)
+    assert [allocator.next_id('place_id') for _ in range(4)] == [1, 2, 3, 4]
+    assert allocator.stats()['leases'] == 2
+
+    # A request larger than the rest of the block leases a block of its own size, the rest is skipped.
+    assert allocator.next_ids('place_id', 5) == list(range(7, 12))
+    assert allocator.next_id('place_id') == 12
+    assert allocator.stats() == {'block_size': 3, 'leases': 4, 'allocated': 10}
+
+def test_sequences_are_seeded_with_max():
+    counters = CountersCollection()
+    seeds = []
+    allocator = IdAllocator(counters, block_size=10)
+    assert allocator.next_id('place_id', seed=lambda: seeds.append(1) or 100) == 101
+    assert allocator.next_id('place_id', seed=lambda: seeds.append(2) or 100) == 102
+    assert seeds == [1]
+
+    # Another worker seeding with a lower value does not move the sequence back.
+    other = IdAllocator(counters, block_size=10)
+    counters.update_one({'_id': 'place_id'}, {'$max': {'seq': 50}})
+    assert other.next_id('place_id', seed=lambda: 50) == 111
+
+    allocator.reserve_up_to('place_id', 500)
+    assert allocator.next_id('place_id') == 501
+
+def test_concurrent_allocations_are_unique():
+    allocator = IdAllocator(CountersCollection(delay=0.001), block_size=10)
+    results = []
+
+    def allocate():
+        ids = [allocator.next_id('review_id') for _ in range(50)]
+        results.append(ids)
+
+    threads = [threading.Thread(target=allocate) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ids = [id for ids in results for id in ids]
+    assert len(ids) == len(set(ids)) == 400
+    # Threads waiting for a lease take their ids from it instead of leasing a block each.
+    assert allocator.stats()['leases'] == 40
+
+def test_leases_do_not_hold_up_other_sequences():
+    counters = CountersCollection()
+    allocator = IdAllocator(counters, block_size=10)
+    allocator.next_id('user_id')
+
+    counters.gate = threading.Event()
+    leasing = threading.Thread(target=allocator.next_id, args=('place_id',))
+    leasing.start()
+    while counters.calls < 2:
+        time.sleep(0.001)
+
+    # The lease of place_id waits for the database, user_id ids are handed out from memory meanwhile.
+    started = time.perf_counter()
+    assert allocator.next_id('user_id') == 2
+    assert time.perf_counter() - started < 1
+    counters.gate.set()
+    leasing.join()
+    assert allocator.next_id('place_id') == 2
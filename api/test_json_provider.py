@@ -0,0 +1,62 @@
+# This file contains the unit tests for the JSON provider of the API responses.
+import dataclasses
+import datetime
+import decimal
+import uuid
+import pytest
+from bson import Decimal128, ObjectId
+from flask import Flask, jsonify
+import json_provider
+from json_provider import BSONJSONProvider
+
+REVIEW = {
+    '_id': ObjectId('65a1b2c3d4e5f60718293a4b'),
+    'rating': Decimal128('4.5'),
+    'timestamp': datetime.datetime(2024, 1, 2, 3, 4, 5),
+    'user': {'_id': ObjectId('65a1b2c3d4e5f60718293a4c')},
+}
+
+@dataclasses.dataclass
+class Point:
+    lat: float
+    lng: float
+
+# Values converted by both encoders, with the text both must write for them.
+CASES = [
+    (REVIEW, '{"_id":"65a1b2c3d4e5f60718293a4b","rating":4.5,"timestamp":"2024-01-02T03:04:05.000Z",'
+             '"user":{"_id":"65a1b2c3d4e5f60718293a4c"}}'),
+    ({'name': 'Château d’Eau ☕'}, '{"name":"Château d’Eau ☕"}'),
+    ([float('nan'), float('inf'), 1.5, Decimal128('NaN')], '[null,null,1.5,null]'),
+    ({'date': datetime.date(2024, 1, 2)}, '{"date":"Tue, 02 Jan 2024 00:00:00 GMT"}'),
+    ({'price': decimal.Decimal('12.50')}, '{"price":"12.50"}'),
+    ({'id': uuid.UUID('12345678-1234-5678-1234-567812345678')}, '{"id":"12345678-1234-5678-1234-567812345678"}'),
+    ({'point': Point(51.5, -0.1)}, '{"point":{"lat":51.5,"lng":-0.1}}'),
+    ({1: 'a'}, '{"1":"a"}'),
+]
+
+@pytest.fixture
+def without_orjson(monkeypatch):
+    monkeypatch.setattr(json_provider, 'orjson', None)
+
+def test_jsonify_bson_types():
+    app = Flask(__name__)
+    app.json = BSONJSONProvider(app)
+    with app.app_context():
+        response = jsonify([REVIEW])
+    assert response.mimetype == 'application/json'
+    assert response.get_json()[0]['timestamp'] == '2024-01-02T03:04:05.000Z'
+
+@pytest.mark.parametrize('value, expected', CASES)
+def test_orjson_output(value, expected):
+    if json_provider.orjson is None:
+        pytest.skip('orjson is not installed')
+    assert json_provider.dumps(value) == expected
+
+@pytest.mark.parametrize('value, expected', CASES)
+def test_fallback_output(without_orjson, value, expected):
+    assert json_provider.dumps(value) == expected
+    assert json_provider.dumps_bytes(value) == expected.encode('utf-8')
+
+def test_unknown_types_are_rejected(without_orjson):
+    with pytest.raises(TypeError):
+        json_provider.dumps({'value': object()})
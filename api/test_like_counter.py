@@ -0,0 +1,80 @@
+# This file contains the unit tests for the write-behind like counter.
+import pytest
+from pymongo.errors import BulkWriteError
+from like_counter import LikeCounterBuffer
+
+mongomock = pytest.importorskip('mongomock')
+
+'''
+This class fails the updates at the given positions of the next bulk write, like MongoDB reports
+the failed updates of an unordered bulk write. The other updates are written.
+'''
+class FailingCollection:
+    def __init__(self, collection):
+        self.collection = collection
+        self.fail = set()
+        self.writes = 0
+
+    def bulk_write(self, updates, ordered=True):
+        self.writes += 1
+        errors = [{'index': index, 'code': 2, 'errmsg': 'failed'} for index in sorted(self.fail) if index < len(updates)]
+        for index, update in enumerate(updates):
+            if index not in self.fail:
+                self.collection.bulk_write([update])
+        self.fail = set()
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'nInserted': 0, 'nUpserted': 0, 'nMatched': 0,
+                                  'nModified': 0, 'nRemoved': 0, 'upserted': [], 'writeConcernErrors': []})
+
+def make_db(review_ids):
+    client = mongomock.MongoClient()
+    db = {}
+    for name in ('Reviews', 'ReviewDetails'):
+        client.db[name].insert_many([{'review_id': review_id, 'likes': 0} for review_id in review_ids])
+        db[name] = FailingCollection(client.db[name])
+    return db
+
+def likes(db, name):
+    return {review['review_id']: review['likes'] for review in db[name].collection.find()}
+
+def test_likes_are_coalesced_per_review():
+    db = make_db(['r1', 'r2'])
+    flushed = []
+    buffer = LikeCounterBuffer(db, flush_interval=60, on_flush=flushed.append)
+    for _ in range(10):
+        buffer.add('r1', 1)
+    buffer.add('r2', 1)
+    buffer.add('r2', -1)
+    buffer.flush()
+
+    assert db['Reviews'].writes == 1
+    assert likes(db, 'Reviews') == likes(db, 'ReviewDetails') == {'r1': 10, 'r2': 0}
+    assert flushed == [['r1']]
+    stats = buffer.stats()
+    assert stats['received'] == 12
+    assert stats['written'] == 2
+    assert stats['coalesced'] == 11
+
+def test_only_failed_updates_are_retried():
+    db = make_db(['r1', 'r2', 'r3'])
+    buffer = LikeCounterBuffer(db, flush_interval=60)
+    for review_id in ('r1', 'r2', 'r3'):
+        buffer.add(review_id, 1)
+    db['Reviews'].fail = {1}
+    buffer.flush()
+
+    # The read model gets every delta, even if an update of the reviews failed.
+    assert likes(db, 'Reviews') == {'r1': 1, 'r2': 0, 'r3': 1}
+    assert likes(db, 'ReviewDetails') == {'r1': 1, 'r2': 1, 'r3': 1}
+    assert buffer.stats()['failed'] == 1
+
+    buffer.add('r1', 1)
+    buffer.flush()
+    assert likes(db, 'Reviews') == likes(db, 'ReviewDetails') == {'r1': 2, 'r2': 1, 'r3': 1}
+    assert buffer.stats()['failed'] == 0
+
+def test_flush_without_pending_likes_does_not_write():
+    db = make_db(['r1'])
+    buffer = LikeCounterBuffer(db, flush_interval=60)
+    buffer.flush()
+    assert db['Reviews'].writes == 0
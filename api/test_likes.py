@@ -0,0 +1,61 @@
+# This file contains the unit tests for the likes of reviews.
+import datetime
+import pytest
+import likes
+
+mongomock = pytest.importorskip('mongomock')
+
+@pytest.fixture
+def db():
+    db = mongomock.MongoClient().db
+    likes.create_indexes(db[likes.LIKES_COLLECTION])
+    for name in ('Reviews', 'ReviewDetails'):
+        db[name].insert_many([{'review_id': 'r1', 'likes': 1}, {'review_id': 'r2', 'likes': 1}])
+    return db
+
+def test_like_and_unlike(db):
+    assert likes.like(db, 'u1', 'r1')
+    assert likes.liked_review_ids(db, 'u1') == ['r1']
+    assert likes.liked_among(db, 'u1', ['r1', 'r2']) == {'r1'}
+
+    assert likes.unlike(db, 'u1', 'r1')
+    assert likes.liked_review_ids(db, 'u1') == []
+    # Unliking a review which is not liked changes nothing.
+    assert not likes.unlike(db, 'u1', 'r1')
+
+def test_double_like_is_rejected(db):
+    assert likes.like(db, 'u1', 'r1')
+    assert not likes.like(db, 'u1', 'r1')
+    assert db[likes.LIKES_COLLECTION].count_documents({'user_id': 'u1', 'review_id': 'r1'}) == 1
+    # Other users can still like the review.
+    assert likes.like(db, 'u2', 'r1')
+
+def test_remove_user_decrements_the_like_counts(db):
+    likes.like(db, 'u1', 'r1')
+    likes.like(db, 'u2', 'r2')
+    likes.remove_user(db, 'u1')
+    for name in ('Reviews', 'ReviewDetails'):
+        assert {review['review_id']: review['likes'] for review in db[name].find()} == {'r1': 0, 'r2': 1}
+    assert likes.liked_review_ids(db, 'u2') == ['r2']
+
+def test_liked_reviews_pages(db):
+    for day, review_id in enumerate(('r1', 'r2', 'r3'), 1):
+        db['ReviewDetails'].update_one({'review_id': review_id}, {'$set': {'text': review_id.upper()}}, upsert=True)
+        db[likes.LIKES_COLLECTION].insert_one({'user_id': 'u1', 'review_id': review_id,
+                                               'created_at': datetime.datetime(2024, 1, day)})
+    likes.like(db, 'u2', 'r1')
+
+    page, cursor = likes.liked_reviews(db, 'u1', 2, projection={'text': 1, '_id': 0})
+    assert page == [{'text': 'R3'}, {'text': 'R2'}]
+    page, cursor = likes.liked_reviews(db, 'u1', 2, cursor, projection={'text': 1, '_id': 0})
+    assert page == [{'text': 'R1'}] and cursor is None
+
+    # The like of a deleted review is skipped, and the whole reviews are returned without a projection.
+    db['ReviewDetails'].delete_one({'review_id': 'r2'})
+    reviews, cursor = likes.liked_reviews(db, 'u1')
+    assert [review['review_id'] for review in reviews] == ['r3', 'r1'] and cursor is None
+    assert '_id' in reviews[0]
+
+def test_liked_reviews_rejects_a_bad_cursor(db):
+    with pytest.raises(ValueError):
+        likes.liked_reviews(db, 'u1', 2, 'not a cursor')
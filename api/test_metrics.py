@@ -0,0 +1,63 @@
+# This file contains the unit tests for the request instrumentation.
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import pytest
+from flask import Flask, jsonify, request
+import batch_requests
+from metrics import CommandRecorder, Metrics
+
+@pytest.fixture
+def app(monkeypatch):
+    app = Flask(__name__)
+    metrics = Metrics(slow_request_seconds=0)
+    # The command listener is global in pymongo, so it is kept out of the other tests.
+    monkeypatch.setattr('metrics.monitoring.register', lambda listener: None)
+    metrics.init_app(app)
+    recorder = CommandRecorder(metrics)
+    executor = ThreadPoolExecutor(max_workers=2)
+
+    @app.route('/api/places/<place_id>')
+    def get_place(place_id):
+        recorder.started(SimpleNamespace(request_id=place_id, command_name='find', command={'find': 'Places'}))
+        recorder.succeeded(SimpleNamespace(request_id=place_id, command_name='find', duration_micros=2000))
+        return jsonify({'place_id': place_id})
+
+    @app.route('/api/batch', methods=['POST'])
+    def run_batch():
+        items = batch_requests.parse_batch(request.get_json(), app.url_map, {'get_place'})
+        responses = batch_requests.run_batch(app, executor, items, [], request.host_url, request.environ)
+        return jsonify({'responses': responses})
+
+    app.metrics = metrics
+    app.recorder = recorder
+    yield app
+    executor.shutdown()
+
+def test_request_metrics(app, caplog):
+    client = app.test_client()
+    with caplog.at_level(logging.WARNING, logger=app.logger.name):
+        client.get('/api/places/1')
+        client.get('/api/places/2')
+    assert 'find Places 2.0ms ok' in caplog.records[0].getMessage()
+
+    text = app.metrics.render()
+    assert 'http_requests_total{route="/api/places/<place_id>",method="GET",status="200"} 2' in text
+    assert 'http_request_duration_seconds_count{route="/api/places/<place_id>",method="GET"} 2' in text
+    assert 'http_request_mongodb_commands_total{route="/api/places/<place_id>",method="GET"} 2' in text
+    assert 'mongodb_command_duration_seconds_bucket{command="find",outcome="ok",le="0.005"} 2' in text
+    assert 'http_request_db_duration_seconds_sum{route="/api/places/<place_id>",method="GET"} 0.004' in text
+
+def test_batch_sub_requests_count_towards_the_batch(app):
+    response = app.test_client().post('/api/batch', json={'requests': [{'path': '/api/places/1'}, {'path': '/api/places/2'}]})
+    assert [item['status'] for item in response.get_json()['responses']] == [200, 200]
+
+    text = app.metrics.render()
+    assert 'route="/api/places/<place_id>"' not in text
+    assert 'http_requests_total{route="/api/batch",method="POST",status="200"} 1' in text
+    assert 'http_request_mongodb_commands_total{route="/api/batch",method="POST"} 2' in text
+    assert 'mongodb_command_duration_seconds_count{command="find",outcome="ok"} 2' in text
+
+def test_commands_outside_requests_are_ignored(app):
+    app.recorder.succeeded(SimpleNamespace(request_id=1, command_name='update', duration_micros=1000))
+    assert 'command="update"' not in app.metrics.render()
@@ -0,0 +1,48 @@
+# This file contains the unit tests for the pagination helpers.
+import datetime
+import pytest
+from pagination import decode_cursor, encode_cursor, keyset_filter, parse_limit
+
+def test_cursor_round_trip():
+    values = ['Abbey Gardens', 12]
+    assert decode_cursor(encode_cursor(values), 2) == values
+
+def test_cursor_round_trip_with_datetime():
+    values = [datetime.datetime(2024, 1, 2, 3, 4, 5), 'r202']
+    assert decode_cursor(encode_cursor(values), 2) == values
+
+def test_invalid_cursor():
+    with pytest.raises(ValueError):
+        decode_cursor('not-a-cursor', 2)
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor([1]), 2)
+
+def test_cursor_values_must_be_plain():
+    for values in ([{'$ne': None}, 1], [[1], 1], [{'$date': 5}, 1], [{'$date': 'yesterday'}, 1], [float('nan'), 1]):
+        with pytest.raises(ValueError):
+            decode_cursor(encode_cursor(values), 2)
+    assert decode_cursor(encode_cursor([None, 1]), 2) == [None, 1]
+
+def test_keyset_filter():
+    sort_order = [('rating', -1), ('place_id', 1)]
+    assert keyset_filter(sort_order, [4.5, 7]) == {'$or': [
+        {'$or': [{'rating': {'$lt': 4.5}}, {'rating': None}]},
+        {'rating': 4.5, 'place_id': {'$gt': 7}},
+    ]}
+    assert keyset_filter([('place_id', 1)], [7]) == {'place_id': {'$gt': 7}}
+
+def test_keyset_filter_after_null():
+    # Nulls come last in descending order, so only the remaining nulls follow.
+    assert keyset_filter([('rating', -1), ('place_id', 1)], [None, 7]) == {'rating': None, 'place_id': {'$gt': 7}}
+    # Nulls come first in ascending order, so every other value follows.
+    assert keyset_filter([('site_name', 1), ('place_id', 1)], [None, 7]) == {'$or': [
+        {'site_name': {'$ne': None}},
+        {'site_name': None, 'place_id': {'$gt': 7}},
+    ]}
+
+def test_parse_limit():
+    assert parse_limit(None) == 20
+    assert parse_limit('5') == 5
+    assert parse_limit('1000') == 100
+    with pytest.raises(ValueError):
+        parse_limit('0')
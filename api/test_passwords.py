@@ -0,0 +1,51 @@
+# This file contains the unit tests for the password hashing pool.
+import bcrypt
+import pytest
+from passwords import PasswordHasher, PasswordPoolBusy, hash_rounds
+
+def test_hash_and_verify():
+    hasher = PasswordHasher(rounds=4, max_workers=0)
+    hashed = hasher.hash('secret')
+    assert hash_rounds(hashed) == 4
+    assert hasher.verify('secret', hashed)
+    assert not hasher.verify('wrong', hashed)
+
+def test_rehash_on_another_work_factor():
+    old_hash = bcrypt.hashpw(b'secret', bcrypt.gensalt(5)).decode('utf-8')
+    hasher = PasswordHasher(rounds=4, max_workers=0)
+    valid, new_hash = hasher.verify_and_rehash('secret', old_hash)
+    assert valid
+    assert hash_rounds(new_hash) == 4
+    assert hasher.verify_and_rehash('secret', new_hash) == (True, None)
+    assert hasher.verify_and_rehash('wrong', old_hash) == (False, None)
+
+def test_pool():
+    hasher = PasswordHasher(rounds=4, max_workers=1, max_pending=0)
+    hashed = hasher.hash('secret')
+    assert hasher.verify('secret', hashed)
+
+    # Every slot is taken, so the next request is rejected without waiting.
+    hasher._slots.acquire()
+    with pytest.raises(PasswordPoolBusy):
+        hasher.verify('secret', hashed)
+    hasher._slots.release()
+    assert hasher.stats()['rejected'] == 1
+
+def test_timeout_keeps_the_slot_until_the_work_ends():
+    hasher = PasswordHasher(rounds=4, max_workers=1, max_pending=0, timeout=10)
+    hasher.hash('warm up')
+    hasher.timeout = 0.01
+    hasher.rounds = 14
+
+    with pytest.raises(PasswordPoolBusy):
+        hasher.hash('secret')
+    assert hasher.stats()['timed_out'] == 1
+
+    # The hash still runs in the pool, so its slot is not free yet.
+    with pytest.raises(PasswordPoolBusy):
+        hasher.hash('secret')
+    assert hasher.stats()['rejected'] == 1
+
+    # The slot is released once the hash is done.
+    assert hasher._slots.acquire(timeout=30)
+    hasher._slots.release()
@@ -0,0 +1,77 @@
+# This file contains the unit tests for the bulk import of places.
+import io
+import pytest
+from place_documents import build_place_document
+from place_import import csv_row_to_place, import_places, read_csv, read_ndjson
+
+PLACE = {
+    'site_name': 'Abbey Gardens',
+    'location': {'latitude': 51.5, 'longitude': -0.1},
+    'address': {'postcode': 'AB1 2CD'},
+    'rating': 4,
+}
+
+def test_read_ndjson_reports_invalid_lines():
+    stream = io.BytesIO(b'{"site_name": "A"}\n\n{bad\n')
+    rows = list(read_ndjson(stream))
+    assert rows[0] == (1, {'site_name': 'A'}, None)
+    assert rows[1][0] == 3 and rows[1][1] is None and rows[1][2].startswith('Invalid JSON')
+
+def test_csv_row_to_place():
+    place = csv_row_to_place({
+        'site_name': 'Abbey Gardens',
+        'location.latitude': '51.5',
+        'location.longitude': '-0.1',
+        'categories': 'Parks | Gardens',
+        'email': '',
+    })
+    assert place == {
+        'site_name': 'Abbey Gardens',
+        'location': {'latitude': 51.5, 'longitude': -0.1},
+        'categories': ['Parks', 'Gardens'],
+    }
+
+def test_read_csv():
+    stream = io.BytesIO(b'site_name,location.latitude\nAbbey,51.5\nCastle,north\n')
+    rows = list(read_csv(stream))
+    assert rows[0] == (1, {'site_name': 'Abbey', 'location': {'latitude': 51.5}}, None)
+    assert rows[1][0] == 2 and rows[1][2] is not None
+
+def test_build_place_document_validates():
+    place = build_place_document(PLACE, 7)
+    assert place['place_id'] == 7 and place['location_id'] == 7 and place['rating'] == 4.0
+    with pytest.raises(ValueError):
+        build_place_document(dict(PLACE, rating='high'), 7)
+    for rating in ('nan', 'inf', float('nan'), -1, 5.5):
+        with pytest.raises(ValueError, match='between 0 and 5'):
+            build_place_document(dict(PLACE, rating=rating), 7)
+    with pytest.raises(ValueError):
+        build_place_document(dict(PLACE, bogus=1), 7, strict=True)
+
+@pytest.mark.parametrize('place_id', ['7', 0, -1, 1.5, True, [1], {'$gt': 0}])
+def test_invalid_place_ids_are_row_errors(place_id):
+    records = [(1, dict(PLACE, place_id=place_id), None)]
+    report = import_places(None, records, allocate_ids=None)
+    assert report.to_dict() == {'inserted': 0, 'updated': 0, 'failed': 1,
+                                'errors': [{'row': 1, 'error': 'place_id must be a positive integer'}]}
+    assert build_place_document(dict(PLACE, place_id=7), 7, strict=True)['place_id'] == 7
+
+def test_invalid_utf8_is_a_row_error():
+    rows = list(read_ndjson(io.BytesIO(b'{"site_name": "A"}\n{"site_name": "\xff"}\n{"site_name": "B"}\n')))
+    assert [(row, error) for row, _, error in rows] == [(1, None), (2, 'Invalid UTF-8'), (3, None)]
+
+    rows = list(read_csv(io.BytesIO(b'site_name,email\nAbbey,a@example.com\nCastle,\xe9\xff@example.com\nZoo,\n')))
+    assert [(row, error) for row, _, error in rows] == [(1, None), (2, 'Invalid UTF-8'), (3, None)]
+    assert rows[2][1] == {'site_name': 'Zoo'}
+
+def test_replaced_places_are_passed_to_on_batch():
+    mongomock = pytest.importorskip('mongomock')
+    collection = mongomock.MongoClient().db.Places
+    collection.insert_one(build_place_document(PLACE, 7))
+    batches = []
+    records = [(1, dict(PLACE, place_id=7, site_name='Abbey Park'), None), (2, dict(PLACE), None)]
+    report = import_places(collection, records, allocate_ids=lambda count: [8], on_batch=lambda *batch: batches.append(batch))
+    assert (report.inserted, report.updated) == (1, 1)
+    written, replaced = batches[0]
+    assert sorted(place['place_id'] for place in written) == [7, 8]
+    assert [place['site_name'] for place in replaced] == ['Abbey Park']
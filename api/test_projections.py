@@ -0,0 +1,53 @@
+# This file contains the unit tests for the field selection of the responses.
+import pytest
+from werkzeug.datastructures import MultiDict
+from catalogue import PlaceCatalogue
+from conftest import login_headers
+from projections import HIDDEN_PLACE_FIELDS, PLACE_VIEWS, requested_fields, to_projection, trim
+
+def test_whole_documents_by_default():
+    assert requested_fields(MultiDict(), PLACE_VIEWS) is None
+    assert to_projection(None, ['place_id']) is None
+    assert to_projection(None, ['place_id'], HIDDEN_PLACE_FIELDS) == {'geo': 0}
+    assert to_projection(['geo'], hidden=HIDDEN_PLACE_FIELDS) == {'geo': 1, '_id': 0}
+
+def test_view_and_fields():
+    fields = requested_fields(MultiDict([('view', 'card'), ('fields', 'summary,location.latitude')]), PLACE_VIEWS)
+    assert fields == ['place_id', 'site_name', 'image', 'rating', 'summary', 'location.latitude']
+
+@pytest.mark.parametrize('args', [
+    [('view', 'full')],
+    [('fields', '$where')],
+    [('fields', ','.join(['f%d' % i for i in range(51)]))],
+])
+def test_invalid_requests(args):
+    with pytest.raises(ValueError):
+        requested_fields(MultiDict(args), PLACE_VIEWS)
+
+def test_nested_fields_do_not_collide():
+    assert requested_fields(MultiDict([('fields', 'user.fullname,user')]), {}) == ['user']
+
+def test_sort_keys_are_read_but_not_returned():
+    fields = ['site_name']
+    keys = ['rating', 'place_id']
+    assert to_projection(fields, keys) == {'site_name': 1, 'rating': 1, 'place_id': 1, '_id': 0}
+    documents = [{'site_name': 'Castle', 'rating': 4.0, 'place_id': 1}]
+    assert trim(documents, fields, keys) == [{'site_name': 'Castle'}]
+    assert trim([{'rating': 4.0}], ['rating'], keys) == [{'rating': 4.0}]
+
+@pytest.mark.parametrize('catalogue', [False, True])
+def test_responses_leave_out_server_fields(mock_app, monkeypatch, catalogue):
+    if catalogue:
+        monkeypatch.setattr(mock_app, 'place_catalogue', PlaceCatalogue(
+            mock_app.places_collection, mock_app.resource_versions, mock_app.PLACE_SORT_ORDERS, poll_interval=0))
+    mock_app.places_collection.insert_one({'place_id': 1, 'site_name': 'Castle', 'geo': {'type': 'Point', 'coordinates': [-0.12, 51.5]}})
+    client = mock_app.app.test_client()
+    headers = login_headers(mock_app, 'u1', fullname='Ada')
+
+    assert 'geo' not in client.get('/api/place/1', headers=headers).get_json()
+    assert 'geo' not in client.get('/api/places', headers=headers).get_json()[0]
+    assert 'geo' not in client.get('/api/places?limit=5', headers=headers).get_json()['places'][0]
+    assert client.get('/api/place/1?fields=geo', headers=headers).get_json() == {'geo': {'type': 'Point', 'coordinates': [-0.12, 51.5]}}
+
+    user = client.get('/api/users/u1', headers=headers).get_json()
+    assert user['fullname'] == 'Ada' and 'password' not in user
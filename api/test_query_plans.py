@@ -0,0 +1,189 @@
+# Query plan tests.
+# Every endpoint is called against a seeded database with the MongoDB profiler on, so that each query,
+# pipeline, update and delete issued by the app is captured. Each of them is then explained, and the test
+# fails if one reads a collection without an index (COLLSCAN) or examines far more documents than it returns.
+#
+# The end to end test needs a local MongoDB and a scratch database, which is emptied:
+#   MONGO_DB=TouristTalksQueryPlans python -m pytest test_query_plans.py
+import json
+import os
+import sys
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+import database
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+
+# A query may examine up to this many documents per document returned.
+MAX_EXAMINED_RATIO = 10
+
+# Queries examining fewer documents than this are not checked for the ratio.
+MIN_EXAMINED = 100
+
+# Commands which can be explained, and the field holding their filter.
+EXPLAINABLE_COMMANDS = {'find': 'filter', 'aggregate': None, 'findAndModify': 'query', 'findandmodify': 'query',
+                        'count': 'query', 'distinct': 'query', 'update': None, 'delete': None}
+
+'''
+This function turns an entry of the profiler into a command which can be explained.
+Returns None for the operations which are not queries (inserts, getMore, index builds...).
+'''
+def explainable(entry):
+    collection = entry['ns'].split('.', 1)[1]
+    command = entry.get('command', {})
+    if entry['op'] == 'update':
+        return {'update': collection, 'updates': [{key: command[key] for key in ('q', 'u', 'multi', 'upsert') if key in command}]}
+    if entry['op'] == 'remove':
+        return {'delete': collection, 'deletes': [{'q': command.get('q', {}), 'limit': command.get('limit', 0)}]}
+    if entry['op'] in ('query', 'command') and command and next(iter(command)) in EXPLAINABLE_COMMANDS:
+        return {key: value for key, value in command.items()
+                if not key.startswith('$') and key not in ('lsid', 'txnNumber', 'autocommit', 'startTransaction')}
+    return None
+
+'''
+This function returns the filter of a command, or None if it has none, e.g. a pipeline without a leading $match.
+A query with an empty filter and no sort reads the whole collection on purpose (e.g. the exports).
+'''
+def query_filter(command):
+    name = next(iter(command))
+    if name == 'aggregate':
+        pipeline = command.get('pipeline', [])
+        if pipeline and '$geoNear' in pipeline[0]:
+            return pipeline[0]['$geoNear'].get('query', {}) or {'$geoNear': True}
+        return pipeline[0]['$match'] if pipeline and '$match' in pipeline[0] else None
+    if name == 'update':
+        return command['updates'][0].get('q', {})
+    if name == 'delete':
+        return command['deletes'][0].get('q', {})
+    return command.get(EXPLAINABLE_COMMANDS[name]) or {}
+
+def reads_whole_collection(command):
+    return not query_filter(command) and not command.get('sort')
+
+# Yields every dict nested in a document, including itself.
+def _nested(document):
+    if isinstance(document, dict):
+        yield document
+        for value in document.values():
+            yield from _nested(value)
+    elif isinstance(document, list):
+        for value in document:
+            yield from _nested(value)
+
+'''
+This function returns the problems found in the explain output of a command, as a list of strings.
+
+Implementation:
+The stages of the winning plans are checked for COLLSCAN, wherever they are nested
+(find, aggregate $cursor stages, SBE query plans, shards).
+The execution stats of the query layer give the documents examined and returned.
+$lookup stages report their own collection scans on MongoDB 5.0 and later.
+'''
+def plan_problems(explain, whole_collection=False):
+    problems = []
+    for document in _nested(explain):
+        plan = document.get('winningPlan')
+        if not whole_collection and any(node.get('stage') == 'COLLSCAN' for node in _nested(plan)):
+            problems.append('COLLSCAN')
+        stats = document.get('executionStats')
+        if isinstance(stats, dict) and 'totalDocsExamined' in stats and not whole_collection:
+            examined, returned = stats['totalDocsExamined'], stats.get('nReturned', 0)
+            if examined >= MIN_EXAMINED and examined > MAX_EXAMINED_RATIO * max(returned, 1):
+                problems.append(f'examined {examined} documents to return {returned}')
+        if '$lookup' in document and document.get('collectionScans'):
+            problems.append(f'$lookup from {document["$lookup"].get("from")} scanned the collection')
+    return sorted(set(problems))
+
+def test_collscan():
+    explain = {'queryPlanner': {'winningPlan': {'stage': 'PROJECTION_SIMPLE', 'inputStage': {'stage': 'COLLSCAN'}}},
+               'executionStats': {'nReturned': 10, 'totalDocsExamined': 5000}}
+    assert plan_problems(explain) == ['COLLSCAN', 'examined 5000 documents to return 10']
+    assert plan_problems(explain, whole_collection=True) == []
+
+def test_index_scan():
+    explain = {'queryPlanner': {'winningPlan': {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': 'place_id_1'}}},
+               'executionStats': {'nReturned': 10, 'totalDocsExamined': 10}}
+    assert plan_problems(explain) == []
+
+def test_aggregate():
+    explain = {'stages': [
+        {'$cursor': {'queryPlanner': {'winningPlan': {'queryPlan': {'stage': 'IXSCAN'}}},
+                     'executionStats': {'nReturned': 5, 'totalDocsExamined': 5}}},
+        {'$lookup': {'from': 'Users'}, 'collectionScans': 5},
+    ]}
+    assert plan_problems(explain) == ['$lookup from Users scanned the collection']
+
+def test_explainable():
+    entry = {'op': 'remove', 'ns': 'db.Reviews', 'command': {'q': {'user_id': 'u1'}, 'limit': 0}}
+    command = explainable(entry)
+    assert command == {'delete': 'Reviews', 'deletes': [{'q': {'user_id': 'u1'}, 'limit': 0}]}
+    assert not reads_whole_collection(command)
+
+    entry = {'op': 'query', 'ns': 'db.Places', 'command': {'find': 'Places', 'filter': {}, 'lsid': {}, '$db': 'db'}}
+    assert explainable(entry) == {'find': 'Places', 'filter': {}}
+    assert reads_whole_collection(explainable(entry))
+    assert explainable({'op': 'insert', 'ns': 'db.Places', 'command': {'insert': 'Places'}}) is None
+
+def _scratch_database():
+    db_name = os.getenv('MONGO_DB')
+    if not db_name or db_name == database.DEFAULT_DB_NAME:
+        return None, 'set MONGO_DB to a scratch database to run the query plan tests'
+    try:
+        client = MongoClient(os.getenv('MONGO_URI'), serverSelectionTimeoutMS=2000)
+        client.admin.command('ping')
+    except PyMongoError as e:
+        return None, f'MongoDB is not available: {e}'
+    return client[db_name], None
+
+'''
+This fixture seeds the scratch database, calls every endpoint with the profiler on,
+and returns the database with the operations captured by the profiler.
+'''
+@pytest.fixture(scope='module')
+def profiled():
+    # The app loads the .env file, which may set MONGO_URI and MONGO_DB.
+    import index
+    db, reason = _scratch_database()
+    if db is None:
+        pytest.skip(reason)
+
+    import seed
+    from bench_endpoints import context, endpoints
+    if index.db.name != db.name:
+        pytest.skip(f'the app already uses the {index.db.name} database')
+
+    dataset = seed.seed(index, places=200, users=30, reviews=2000)
+    ctx = context(index, dataset, 42)
+
+    # The profiler is larger than its default 1MB, so no operation is dropped.
+    db.command('profile', 0)
+    db['system.profile'].drop()
+    db.create_collection('system.profile', capped=True, size=64 * 1024 * 1024)
+    db.command('profile', 2)
+    try:
+        client = index.app.test_client()
+        for name, request in endpoints(ctx):
+            for i in range(3):
+                client.open(**request(i)).get_data()
+    finally:
+        db.command('profile', 0)
+    return db, list(db['system.profile'].find({'ns': {'$not': {'$regex': r'\.system\.'}}}))
+
+def test_queries_use_indexes(profiled):
+    db, entries = profiled
+    failures = []
+    seen = set()
+    for entry in entries:
+        command = explainable(entry)
+        if command is None:
+            continue
+        key = json.dumps(command, sort_keys=True, default=str)
+        if key in seen:
+            continue
+        seen.add(key)
+        explain = db.command('explain', command, verbosity='executionStats')
+        for problem in plan_problems(explain, reads_whole_collection(command)):
+            failures.append(f'{entry["ns"]}: {problem}\n    {key[:300]}')
+    assert seen, 'no query was captured'
+    assert failures == [], '\n' + '\n'.join(failures)
@@ -0,0 +1,96 @@
+# This file contains the unit tests for the place rating aggregates.
+import pytest
+from bson import Decimal128
+import rating_aggregates
+from rating_aggregates import change_increments, increments, star, summary, validate_rating
+from conftest import login_headers
+
+class GroupingCollection:
+    def __init__(self, groups):
+        self.groups = groups
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        return iter(self.groups)
+
+def test_star():
+    assert star(1) == '1'
+    assert star(4.4) == '4'
+    assert star(Decimal128('4.5')) == '5'
+    assert star(0) == '1'
+    assert star(7) == '5'
+
+def test_increments():
+    assert increments(4) == {'review_count': 1, 'rating_sum': 4.0, 'histogram.4': 1}
+    assert increments('2', -1) == {'review_count': -1, 'rating_sum': -2.0, 'histogram.2': -1}
+
+def test_change_increments():
+    assert change_increments(Decimal128('2'), 5) == {'rating_sum': 3.0, 'histogram.2': -1, 'histogram.5': 1}
+    assert change_increments(4, 4) == {}
+
+def test_validate_rating():
+    assert validate_rating('4.5') == 4.5 and validate_rating(Decimal128('0')) == 0.0
+    for rating in (None, 'high', 'nan', float('inf'), -1, 5.5):
+        with pytest.raises(ValueError):
+            validate_rating(rating)
+
+def test_summary():
+    result = summary(1, {'review_count': 2, 'rating_sum': 7.0, 'histogram': {'3': 1, '4': 1}})
+    assert result == {'place_id': 1, 'review_count': 2, 'average_rating': 3.5,
+                      'histogram': {'1': 0, '2': 0, '3': 1, '4': 1, '5': 0}}
+    assert summary(1, None)['average_rating'] is None
+
+def test_rebuild_groups_in_the_database():
+    mongomock = pytest.importorskip('mongomock')
+    reviews = GroupingCollection([
+        {'_id': {'place_id': 1, 'star': 4.0}, 'count': 2, 'sum': 8.5},
+        {'_id': {'place_id': 1, 'star': 2.0}, 'count': 1, 'sum': 2.0},
+        {'_id': {'place_id': 2, 'star': 5.0}, 'count': 1, 'sum': 5.0},
+    ])
+    ratings = mongomock.MongoClient().db[rating_aggregates.PLACE_RATINGS_COLLECTION]
+    ratings.insert_many([{'_id': 1, 'review_count': 9}, {'_id': 3, 'review_count': 1}])
+    db = {'Reviews': reviews, rating_aggregates.PLACE_RATINGS_COLLECTION: ratings}
+    assert rating_aggregates.rebuild(db) == 2
+
+    match, group = reviews.pipelines[0]
+    assert match == {'$match': {'rating': {'$ne': None}}}
+    assert set(group['$group']) == {'_id', 'count', 'sum'}
+    assert list(ratings.find(sort=[('_id', 1)])) == [
+        {'_id': 1, 'review_count': 3, 'rating_sum': 10.5, 'histogram': {'1': 0, '2': 1, '3': 0, '4': 2, '5': 0}},
+        {'_id': 2, 'review_count': 1, 'rating_sum': 5.0, 'histogram': {'1': 0, '2': 0, '3': 0, '4': 0, '5': 1}},
+    ]
+
+def test_removing_a_review_does_not_create_aggregates():
+    mongomock = pytest.importorskip('mongomock')
+    db = mongomock.MongoClient().db
+    rating_aggregates.apply(db, 1, increments(4))
+    rating_aggregates.remove_review(db, 1, Decimal128('4'))
+    rating_aggregates.remove_review(db, 2, 3)
+    rating_aggregates.change_review(db, 2, 3, 5)
+    assert list(db[rating_aggregates.PLACE_RATINGS_COLLECTION].find()) == [
+        {'_id': 1, 'review_count': 0, 'rating_sum': 0.0, 'histogram': {'4': 0}}]
+
+def test_legacy_reviews_without_rating():
+    mongomock = pytest.importorskip('mongomock')
+    db = mongomock.MongoClient().db
+    rating_aggregates.apply(db, 1, increments(4))
+    rating_aggregates.remove_review(db, 1, None)
+    rating_aggregates.change_review(db, 1, None, 2)
+    assert db[rating_aggregates.PLACE_RATINGS_COLLECTION].find_one({'_id': 1}) == {
+        '_id': 1, 'review_count': 2, 'rating_sum': 6.0, 'histogram': {'2': 1, '4': 1}}
+
+def test_invalid_ratings_are_rejected_before_the_review_is_stored(mock_app):
+    client = mock_app.app.test_client()
+    headers = login_headers(mock_app, 'u1')
+    for rating in ('nan', 'inf', 6):
+        response = client.post('/api/add-review', headers=headers, json={'place_id': 1, 'text': 'A', 'rating': rating, 'user_id': 'u1'})
+        assert response.status_code == 400
+    assert mock_app.reviews_collection.count_documents({}) == 0
+
+    # A legacy review without a rating can be edited and deleted.
+    mock_app.reviews_collection.insert_one({'review_id': 'r1', 'place_id': 1, 'user_id': 'u1', 'text': 'Old'})
+    assert client.put('/api/update-review', headers=headers, json={'review_id': 'r1', 'text': 'New', 'rating': 'nan'}).status_code == 400
+    assert client.put('/api/update-review', headers=headers, json={'review_id': 'r1', 'text': 'New', 'rating': 3}).status_code == 201
+    mock_app.reviews_collection.insert_one({'review_id': 'r2', 'place_id': 1, 'user_id': 'u1', 'text': 'Old'})
+    assert client.delete('/api/delete-review/r2', headers=headers).status_code == 200
@@ -0,0 +1,122 @@
+# This file contains the unit tests for the caching of read endpoint responses.
+import pytest
+from flask import Flask, jsonify
+from conftest import login_headers
+from response_cache import ResourceVersions, ResponseCache
+
+mongomock = pytest.importorskip('mongomock')
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.versions = ResourceVersions(mongomock.MongoClient().db.CacheVersions)
+    app.cache = ResponseCache(app.versions)
+    app.calls = []
+
+    @app.route('/api/places/<place_id>/reviews')
+    @app.cache.cached(lambda place_id: ['reviews', 'reviews:' + place_id])
+    def get_reviews(place_id):
+        app.calls.append(place_id)
+        if place_id == 'missing':
+            return jsonify({'error': 'not found'}), 404
+        return jsonify({'place_id': place_id, 'version': len(app.calls)})
+
+    return app
+
+def test_etag_and_not_modified(app):
+    client = app.test_client()
+    response = client.get('/api/places/1/reviews')
+    etag = response.headers['ETag']
+    assert response.status_code == 200 and etag
+
+    response = client.get('/api/places/1/reviews', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert response.get_data() == b''
+    assert app.cache.stats()['not_modified'] == 1
+    assert app.calls == ['1']
+
+def test_cached_payloads_are_served_without_the_endpoint(app):
+    client = app.test_client()
+    first = client.get('/api/places/1/reviews')
+    second = client.get('/api/places/1/reviews')
+    assert second.get_json() == first.get_json() == {'place_id': '1', 'version': 1}
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert app.calls == ['1']
+
+    # Other URLs have their own ETag, and errors are not cached.
+    assert client.get('/api/places/2/reviews').headers['ETag'] != first.headers['ETag']
+    client.get('/api/places/missing/reviews')
+    assert client.get('/api/places/missing/reviews').status_code == 404
+    assert app.calls == ['1', '2', 'missing', 'missing']
+
+def test_writes_invalidate_the_responses(app):
+    client = app.test_client()
+    etag = client.get('/api/places/1/reviews').headers['ETag']
+    other_etag = client.get('/api/places/2/reviews').headers['ETag']
+
+    app.versions.bump('reviews:1')
+    response = client.get('/api/places/1/reviews', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.get_json()['version'] == 3
+    # The reviews of another place are not affected.
+    assert client.get('/api/places/2/reviews', headers={'If-None-Match': other_etag}).status_code == 304
+
+    app.versions.bump('reviews')
+    assert client.get('/api/places/2/reviews', headers={'If-None-Match': other_etag}).status_code == 200
+    assert app.versions.get(['reviews', 'reviews:1', 'reviews:2']) == [1, 1, 0]
+
+@pytest.mark.parametrize('command, resource', [
+    ('rebuild-search-index', 'places'),
+    ('backfill-review-details', 'reviews'),
+    ('migrate-review-timestamps', 'reviews'),
+    ('migrate-likes', 'reviews'),
+])
+def test_commands_invalidate_the_cached_responses(mock_app, command, resource):
+    versions = mock_app.resource_versions
+    before = versions.get([resource])
+    result = mock_app.app.test_cli_runner().invoke(args=[command])
+    assert result.exit_code == 0, result.output
+    assert versions.get([resource])[0] == before[0] + 1
+
+def test_endpoint_responses_are_cached_until_a_write(mock_app):
+    mock_app.places_collection.insert_one({'place_id': 1, 'site_name': 'Castle', 'rating': 4.0})
+    client = mock_app.app.test_client()
+    headers = login_headers(mock_app, 'u1')
+
+    first = client.get('/api/places/1/summary', headers=headers)
+    assert first.status_code == 200 and first.get_json()['review_count'] == 0
+    etag = first.headers['ETag']
+
+    # A write which bypasses the endpoints does not bump the versions, so the cached payload is served.
+    mock_app.place_ratings_collection.insert_one({'_id': 1, 'review_count': 9, 'rating_sum': 45})
+    hits = mock_app.response_cache.stats()['hits']
+    assert client.get('/api/places/1/summary', headers=headers).get_json() == first.get_json()
+    assert mock_app.response_cache.stats()['hits'] == hits + 1
+    mock_app.place_ratings_collection.delete_one({'_id': 1})
+
+    response = client.get('/api/places/1/summary', headers=dict(headers, **{'If-None-Match': etag}))
+    assert response.status_code == 304 and response.get_data() == b''
+
+    response = client.post('/api/add-review', headers=headers, json={'place_id': 1, 'user_id': 'u1', 'text': 'Great', 'rating': 5})
+    assert response.status_code == 201, response.get_json()
+    review_id = mock_app.reviews_collection.find_one({'place_id': 1})['review_id']
+    response = client.get('/api/places/1/summary', headers=dict(headers, **{'If-None-Match': etag}))
+    assert response.status_code == 200 and response.get_json()['review_count'] == 1
+    etag = response.headers['ETag']
+
+    assert client.delete('/api/delete-review/' + review_id, headers=headers).status_code == 200
+    response = client.get('/api/places/1/summary', headers=dict(headers, **{'If-None-Match': etag}))
+    assert response.status_code == 200 and response.get_json()['review_count'] == 0
+
+def test_deleting_a_place_invalidates_its_responses(mock_app):
+    mock_app.places_collection.insert_one({'place_id': 1, 'site_name': 'Castle', 'rating': 4.0})
+    client = mock_app.app.test_client()
+    headers = login_headers(mock_app, 'u1')
+    admin_headers = login_headers(mock_app, 'admin', role='admin')
+
+    etag = client.get('/api/place/1', headers=headers).headers['ETag']
+    assert client.get('/api/place/1', headers=dict(headers, **{'If-None-Match': etag})).status_code == 304
+    assert client.delete('/api/delete-place/1', headers=admin_headers).status_code == 200
+    assert client.get('/api/place/1', headers=dict(headers, **{'If-None-Match': etag})).status_code == 404
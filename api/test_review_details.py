@@ -0,0 +1,74 @@
+# This file contains the unit tests for the read model of the reviews.
+import json
+import pytest
+from conftest import login_headers
+
+@pytest.fixture
+def client(mock_app):
+    mock_app.places_collection.insert_one({'place_id': 1, 'site_name': 'Castle', 'rating': 4.0})
+    return mock_app.app.test_client()
+
+def details(index, review_id):
+    return index.review_details_collection.find_one({'review_id': review_id}, {'_id': 0})
+
+def test_add_update_and_delete_review(mock_app, client):
+    headers = login_headers(mock_app, 'u1', 'Ada')
+    response = client.post('/api/add-review', headers=headers,
+                           json={'place_id': 1, 'text': 'Great', 'rating': 4, 'user_id': 'u1', 'likes': 0})
+    assert response.status_code == 201
+    review_id = response.get_json()['review_id']
+
+    entry = details(mock_app, review_id)
+    assert entry['text'] == 'Great'
+    assert entry['user_name'] == 'Ada' and entry['user_profile_photo'] == 'photo.png'
+    assert entry['place_name'] == 'Castle'
+
+    response = client.put('/api/update-review', headers=headers, json={'review_id': review_id, 'text': 'Good', 'rating': 3})
+    assert response.status_code == 201
+    entry = details(mock_app, review_id)
+    assert (entry['text'], float(entry['rating'].to_decimal()), entry['edited']) == ('Good', 3.0, True)
+
+    assert client.delete('/api/delete-review/' + review_id, headers=headers).status_code == 200
+    assert details(mock_app, review_id) is None
+
+def test_profile_updates_are_copied_to_the_reviews(mock_app, client):
+    headers = login_headers(mock_app, 'u1', 'Ada')
+    for text in ('First', 'Second'):
+        client.post('/api/add-review', headers=headers, json={'place_id': 1, 'text': text, 'rating': 5, 'user_id': 'u1'})
+
+    response = client.put('/api/update-user-profile', headers=headers,
+                          json={'user_id': 'u1', 'fullname': 'Ada Lovelace', 'username': 'ada', 'email': 'ada@example.com'})
+    assert response.status_code == 200
+    names = [entry['user_name'] for entry in mock_app.review_details_collection.find({'user_id': 'u1'})]
+    assert names == ['Ada Lovelace', 'Ada Lovelace']
+
+    # The feed reads the read model.
+    reviews = client.get('/api/reviews/feed', headers=headers).get_json()['reviews']
+    assert [review['user_name'] for review in reviews] == ['Ada Lovelace', 'Ada Lovelace']
+
+def test_liked_reviews_are_read_from_the_read_model(mock_app, client):
+    headers = login_headers(mock_app, 'u1', 'Ada')
+    for text in ('First', 'Second'):
+        review_id = client.post('/api/add-review', headers=headers,
+                                json={'place_id': 1, 'text': text, 'rating': 5, 'user_id': 'u1'}).get_json()['review_id']
+        mock_app.likes.like(mock_app.db, 'u1', review_id)
+
+    response = client.get('/api/liked-reviews/u1?limit=1&fields=text', headers=headers)
+    assert response.status_code == 200
+    first = response.get_json()
+    response = client.get('/api/liked-reviews/u1?limit=1&fields=text&after=' + first['next'], headers=headers)
+    second = response.get_json()
+    assert sorted(first['reviews'] + second['reviews'], key=lambda review: review['text']) == [{'text': 'First'}, {'text': 'Second'}]
+    assert second['next'] is None
+    assert [review['user_name'] for review in client.get('/api/liked-reviews/u1', headers=headers).get_json()] == ['Ada', 'Ada']
+
+def test_imported_places_rename_their_reviews(mock_app, client):
+    headers = login_headers(mock_app, 'u1', 'Ada')
+    review_id = client.post('/api/add-review', headers=headers,
+                            json={'place_id': 1, 'text': 'Great', 'rating': 4, 'user_id': 'u1'}).get_json()['review_id']
+    admin = login_headers(mock_app, 'a1', role='admin')
+    place = {'place_id': 1, 'site_name': 'Castle Gardens', 'location': {'latitude': 51.5, 'longitude': -0.1},
+             'address': {'postcode': 'AB1 2CD'}, 'rating': 4}
+    response = client.post('/api/import-places', headers=admin, data=json.dumps(place) + '\n')
+    assert response.get_json()['updated'] == 1
+    assert details(mock_app, review_id)['place_name'] == 'Castle Gardens'
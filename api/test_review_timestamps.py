@@ -0,0 +1,61 @@
+# This file contains the unit tests for the timestamps of the reviews and the order of the feeds.
+import datetime
+import time
+from bson import Decimal128
+from conftest import login_headers
+
+def feed(client, headers, limit=2):
+    reviews, after = [], None
+    while True:
+        query = f'/api/reviews/feed?limit={limit}' + (f'&after={after}' if after else '')
+        page = client.get(query, headers=headers).get_json()
+        reviews.extend(review['review_id'] for review in page['reviews'])
+        after = page['next']
+        if after is None:
+            return reviews
+
+def test_string_timestamps_are_migrated_by_the_upgrade(mock_app):
+    reviews = [
+        {'review_id': 'r1', 'timestamp': datetime.datetime(2024, 3, 1)},
+        {'review_id': 'r2', 'timestamp': '2024-02-01T10:00:00.000Z'},
+        {'review_id': 'r3', 'timestamp': '2024-04-01T12:00:00+02:00'},
+        {'review_id': 'r4', 'timestamp': datetime.datetime(2024, 1, 1)},
+        {'review_id': 'r5', 'timestamp': 'yesterday'},
+    ]
+    for review in reviews:
+        review.update(place_id=1, user_id='u1', text='', rating=Decimal128('4'))
+    mock_app.places_collection.insert_one({'place_id': 1, 'site_name': 'Castle'})
+    mock_app.reviews_collection.insert_many([dict(review) for review in reviews])
+    mock_app.review_details_collection.insert_many([dict(review) for review in reviews])
+    headers = login_headers(mock_app, 'u1')
+
+    # The first request of the process upgrades the database.
+    client = mock_app.app.test_client()
+    client.get('/api/reviews/feed')
+    assert mock_app.schema_collection.find_one({'_id': 'schema'})['version'] == mock_app.SCHEMA_VERSION
+    stored = {review['review_id']: review['timestamp'] for review in mock_app.review_details_collection.find()}
+    assert stored['r2'] == datetime.datetime(2024, 2, 1, 10)
+    assert stored['r3'] == datetime.datetime(2024, 4, 1, 10)
+    # A timestamp which can not be parsed is set aside, and the review comes last in the feeds.
+    assert stored['r5'] is None
+    assert mock_app.reviews_collection.find_one({'review_id': 'r5'})['invalid_timestamp'] == 'yesterday'
+    assert feed(client, headers) == ['r3', 'r1', 'r2', 'r4', 'r5']
+
+def test_edited_reviews_keep_their_place_in_the_feed(mock_app):
+    mock_app.places_collection.insert_one({'place_id': 1, 'site_name': 'Castle'})
+    headers = login_headers(mock_app, 'u1')
+    client = mock_app.app.test_client()
+    review_ids = []
+    for text in ('First', 'Second'):
+        response = client.post('/api/add-review', headers=headers, json={'place_id': 1, 'text': text, 'rating': 4, 'user_id': 'u1'})
+        review_ids.append(response.get_json()['review_id'])
+        # MongoDB stores milliseconds, the reviews must not tie.
+        time.sleep(0.002)
+    created = mock_app.reviews_collection.find_one({'review_id': review_ids[0]})['timestamp']
+
+    client.put('/api/update-review', headers=headers, json={'review_id': review_ids[0], 'text': 'Edited', 'rating': 5})
+    for collection in (mock_app.reviews_collection, mock_app.review_details_collection):
+        review = collection.find_one({'review_id': review_ids[0]})
+        assert review['timestamp'] == created
+        assert review['updated_at'] >= created and review['edited']
+    assert feed(client, headers) == review_ids[::-1]
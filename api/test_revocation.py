@@ -0,0 +1,67 @@
+# This file contains the unit tests for the revocation of tokens.
+import datetime
+import time
+import jwt
+import pytest
+from pymongo.errors import ServerSelectionTimeoutError
+from revocation import RevokedTokens
+
+mongomock = pytest.importorskip('mongomock')
+
+def make_token(**claims):
+    claims.setdefault('exp', int(time.time()) + 3600)
+    return jwt.encode(claims, 'secret'), claims
+
+class FailingCollection:
+    def __init__(self, collection):
+        self.collection = collection
+        self.failing = False
+
+    def find(self, *args, **kwargs):
+        if self.failing:
+            raise ServerSelectionTimeoutError('MongoDB is not available')
+        return self.collection.find(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient().db.blacklist
+
+def test_tokens_revoked_by_other_workers_are_seen_after_a_sync(collection):
+    worker, other = RevokedTokens(collection, sync_interval=0), RevokedTokens(collection, sync_interval=60)
+    token, claims = make_token(jti='a')
+    assert not other.is_revoked(token, claims)
+
+    worker.revoke(token, claims)
+    assert worker.is_revoked(token, claims)
+    assert not other.is_revoked(token, claims)
+    other.sync()
+    assert other.is_revoked(token, claims)
+
+def test_legacy_documents_are_revoked(collection):
+    token, claims = make_token(id='u1')
+    expired, _ = make_token(id='u2', exp=int(time.time()) - 60)
+    collection.insert_many([{'token': token}, {'token': expired}, {'token': 'not a token'}])
+
+    revoked_tokens = RevokedTokens(collection)
+    assert revoked_tokens.is_revoked(token, claims)
+
+    assert revoked_tokens.migrate() == 1
+    documents = list(collection.find())
+    assert len(documents) == 1
+    assert documents[0]['_id'] == RevokedTokens.token_key(token, claims)
+    assert documents[0]['expires_at'] == datetime.datetime.utcfromtimestamp(claims['exp'])
+    assert RevokedTokens(collection).is_revoked(token, claims)
+
+def test_sync_failures_keep_the_last_tokens(collection):
+    failing = FailingCollection(collection)
+    revoked_tokens = RevokedTokens(failing, sync_interval=0)
+    token, claims = make_token(jti='a')
+    RevokedTokens(collection).revoke(token, claims)
+    assert revoked_tokens.is_revoked(token, claims)
+
+    failing.failing = True
+    assert revoked_tokens.is_revoked(token, claims)
+    assert revoked_tokens.stats()['sync_errors'] == 1
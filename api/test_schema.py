@@ -0,0 +1,68 @@
+# This file contains the unit tests for the upgrade of the database schema before the first request.
+from pymongo.errors import ServerSelectionTimeoutError
+
+class UnreachableCollection:
+    def __init__(self):
+        self.calls = 0
+
+    def find_one(self, *args, **kwargs):
+        self.calls += 1
+        raise ServerSelectionTimeoutError('unreachable')
+
+def test_first_database_request_upgrades_the_schema(mock_app):
+    client = mock_app.app.test_client()
+    # Endpoints which do not use the database do not wait for the upgrade.
+    assert client.get('/api/server_connectivity').status_code == 200
+    assert mock_app.schema_collection.find_one({'_id': 'schema'}) is None
+
+    client.get('/api/places')
+    assert mock_app.schema_ready
+    assert mock_app.schema_collection.find_one({'_id': 'schema'})['version'] == mock_app.SCHEMA_VERSION
+
+def test_no_upgrade_unless_enabled(mock_app, monkeypatch):
+    monkeypatch.setattr(mock_app, 'AUTO_ENSURE_INDEXES', False)
+    mock_app.app.test_client().get('/api/places')
+    assert not mock_app.schema_ready
+    assert mock_app.schema_collection.find_one({'_id': 'schema'}) is None
+
+def test_failed_upgrade_backs_off(mock_app, monkeypatch):
+    unreachable = UnreachableCollection()
+    monkeypatch.setattr(mock_app, 'schema_collection', unreachable)
+    client = mock_app.app.test_client()
+    client.get('/api/places')
+    client.get('/api/places')
+    assert unreachable.calls == 1 and not mock_app.schema_ready
+
+    # The upgrade is tried again once the back-off is over.
+    monkeypatch.setattr(mock_app, 'schema_retry_at', 0.0)
+    client.get('/api/places')
+    assert unreachable.calls == 2
+
+def test_upgrade_migrates_the_likes_and_builds_the_read_model(mock_app):
+    mock_app.places_collection.insert_one({'place_id': 1, 'site_name': 'Castle'})
+    mock_app.users_collection.insert_one({'user_id': 'u1', 'fullname': 'Ada', 'liked_reviews': ['r1']})
+    mock_app.reviews_collection.insert_one({'review_id': 'r1', 'place_id': 1, 'user_id': 'u1', 'text': 'Great', 'likes': 3})
+
+    mock_app.app.test_client().get('/api/places')
+    assert mock_app.likes.liked_review_ids(mock_app.db, 'u1') == ['r1']
+    assert 'liked_reviews' not in mock_app.users_collection.find_one({'user_id': 'u1'})
+    details = mock_app.review_details_collection.find_one({'review_id': 'r1'})
+    assert (details['likes'], details['place_name'], details['user_name']) == (1, 'Castle', 'Ada')
+
+def test_whole_collection_migrations_only_run_once(mock_app, monkeypatch):
+    mock_app.schema_collection.insert_one({'_id': 'schema', 'version': 6})
+    mock_app.places_collection.insert_one({'place_id': 1, 'site_name': 'Castle'})
+    mock_app.reviews_collection.insert_one({'review_id': 'r1', 'place_id': 1, 'user_id': 'u1'})
+    monkeypatch.setattr(mock_app, 'SCHEMA_VERSION', 7)
+    mock_app.upgrade_schema()
+    assert mock_app.review_details_collection.count_documents({}) == 0
+    assert mock_app.search_index_collection.count_documents({}) == 0
+    assert mock_app.schema_version() == 7
+
+def test_upgrade_indexes_the_places_again(mock_app):
+    mock_app.schema_collection.insert_one({'_id': 'schema', 'version': 5})
+    mock_app.places_collection.insert_one({'place_id': 1, 'site_name': 'Château Impney'})
+    mock_app.search_index_collection.insert_one({'term': 'ch', 'place_id': 1, 'site_name': 'Château Impney', 'score': 10.0})
+    mock_app.upgrade_schema()
+    assert [place_id for _, place_id, _ in mock_app.search_index.search(mock_app.search_index_collection, 'chateau')] == [1]
+    assert mock_app.search_index_collection.count_documents({'term': 'ch'}) == 0
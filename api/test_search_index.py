@@ -0,0 +1,84 @@
+# This file contains the unit tests for the places search index.
+import pytest
+from conftest import login_headers
+from search_index import build_postings, index_places, search, tokenize
+
+PLACES = [
+    {'place_id': 1, 'site_name': 'Castle Howard', 'summary': 'A stately home with gardens', 'tags': [], 'categories': []},
+    {'place_id': 2, 'site_name': 'Abbey Gardens', 'summary': 'Gardens next to the castle ruins', 'tags': [], 'categories': []},
+    {'place_id': 3, 'site_name': 'Castell Coch', 'summary': 'A Victorian folly', 'tags': [], 'categories': []},
+    {'place_id': 4, 'site_name': 'Château Impney', 'summary': 'A hotel', 'tags': [], 'categories': []},
+]
+
+@pytest.fixture
+def collection():
+    mongomock = pytest.importorskip('mongomock')
+    collection = mongomock.MongoClient().db.PlacesSearchIndex
+    index_places(collection, PLACES)
+    return collection
+
+def test_tokenize():
+    assert tokenize('The Castle of Mey, Caithness!') == ['castle', 'mey', 'caithness']
+    assert tokenize(None) == []
+
+def test_tokenize_keeps_non_latin_letters():
+    assert tokenize('Château d’Eau, Kraków') == ['chateau', 'd', 'eau', 'krakow']
+    assert tokenize('Straße') == ['strasse']
+    assert tokenize('東京タワー') == ['東京タワー']
+
+def test_build_postings_weights_fields():
+    place = {
+        'place_id': 7,
+        'site_name': 'Abbey Gardens',
+        'summary': 'Gardens around the abbey ruins',
+        'tags': ['Gardens'],
+        'categories': ['Parks and Gardens'],
+    }
+    postings = {posting['term']: posting for posting in build_postings(place)}
+    assert postings['abbey']['score'] == 11.0
+    assert postings['gardens']['score'] == 21.0
+    assert postings['ruins']['score'] == 1.0
+    assert postings['parks']['site_name'] == 'Abbey Gardens'
+    assert all(posting['place_id'] == 7 for posting in postings.values())
+
+def test_search_ranks_name_matches_first(collection):
+    results = search(collection, 'castle')
+    assert [place_id for _, place_id, _ in results] == [1, 2]
+    assert results[0][2] == 'Castle Howard'
+    assert results[0][0] > results[1][0]
+
+def test_search_requires_every_term(collection):
+    assert [place_id for _, place_id, _ in search(collection, 'castle gardens')] == [2, 1]
+    assert search(collection, 'castle hotel') == []
+
+def test_search_matches_the_last_term_as_prefix(collection):
+    assert [place_id for _, place_id, _ in search(collection, 'abbey gard')] == [2]
+    assert search(collection, 'gard abbey') == []
+    assert [place_id for _, place_id, _ in search(collection, 'cast')] == [1, 3, 2]
+    assert [place_id for _, place_id, _ in search(collection, 'cast', limit=2)] == [1, 3]
+
+def test_search_does_not_expand_short_prefixes(collection):
+    assert search(collection, 'ca') == []
+    assert [place_id for _, place_id, _ in search(collection, 'hotel im')] == []
+    assert [place_id for _, place_id, _ in search(collection, 'hotel imp')] == [4]
+
+def test_search_ignores_accents(collection):
+    assert [place_id for _, place_id, _ in search(collection, 'chateau')] == [4]
+    assert [place_id for _, place_id, _ in search(collection, 'CHÂTEAU imp')] == [4]
+
+def test_suggest_endpoint(mock_app):
+    mock_app.places_collection.insert_many([dict(place) for place in PLACES])
+    client = mock_app.app.test_client()
+    headers = login_headers(mock_app, 'u1')
+
+    response = client.get('/api/places/suggest?q=Cast&limit=2', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json() == [
+        {'place_id': 1, 'site_name': 'Castle Howard'},
+        {'place_id': 3, 'site_name': 'Castell Coch'},
+    ]
+    assert client.get('/api/places/suggest?q=chateau', headers=headers).get_json() == [
+        {'place_id': 4, 'site_name': 'Château Impney'},
+    ]
+    assert client.get('/api/places/suggest?q=castle&limit=0', headers=headers).status_code == 400
+    assert client.get('/api/places/suggest?q=castle').status_code == 401